@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file
+# except in compliance with the License. A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS"
+# BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+import codecs
+import json
+import logging
+import re
+from typing import List, Optional
+
+_BYTE_LEVEL = "byte_level"
+_SENTENCEPIECE = "sentencepiece"
+_METASPACE = "metaspace"
+
+_SPIECE_UNDERLINE = "▁"
+_BYTE_FALLBACK_TOKEN = re.compile(r"<0x([0-9A-Fa-f]{2})>")
+_utf8_decoder = codecs.getincrementaldecoder("utf-8")
+
+
+def _bytes_to_unicode() -> dict:
+    """
+    The printable characters byte level BPE vocabularies use for each byte.
+    """
+    bs = list(range(ord("!"),
+                    ord("~") + 1)) + list(range(
+                        ord("¡"),
+                        ord("¬") + 1)) + list(range(ord("®"),
+                                                    ord("ÿ") + 1))
+    cs = bs[:]
+    n = 0
+    for b in range(256):
+        if b not in bs:
+            bs.append(b)
+            cs.append(256 + n)
+            n += 1
+    return dict(zip(bs, (chr(c) for c in cs)))
+
+
+_BYTE_DECODER = {c: b for b, c in _bytes_to_unicode().items()}
+
+
+def _get_decoder_type(tokenizer) -> str:
+    """
+    :return: the type of the decoder if the text of a token can be
+        concatenated from per token pieces, None otherwise
+    """
+    if getattr(tokenizer, "clean_up_tokenization_spaces", False):
+        # the clean up depends on the surrounding text
+        return None
+    return _get_token_decoder_type(tokenizer)
+
+
+def _get_token_decoder_type(tokenizer) -> str:
+    """
+    :return: the type of the decoder if the bytes of each token are known,
+        None otherwise
+    """
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    decoder = getattr(backend, "decoder", None)
+    if decoder is None:
+        return None
+    config = json.loads(decoder.__getstate__())
+    decoder_type = config["type"]
+    if decoder_type == "ByteLevel":
+        return _BYTE_LEVEL
+    if decoder_type == "Metaspace":
+        if config.get("replacement") != _SPIECE_UNDERLINE or config.get(
+                "prepend_scheme", "always") == "never" or not config.get(
+                    "add_prefix_space", True):
+            return None
+        return _METASPACE
+    if decoder_type == "Sequence":
+        # the decoder of the llama and mistral tokenizers
+        types = [d["type"] for d in config["decoders"]]
+        if types == ["Replace", "ByteFallback", "Fuse", "Strip"]:
+            replace, _, _, strip = config["decoders"]
+            if replace["pattern"].get("String") == _SPIECE_UNDERLINE \
+                    and replace["content"] == " " and strip["content"] == " " \
+                    and strip["start"] == 1 and strip["stop"] == 0:
+                return _SENTENCEPIECE
+    return None
+
+
+def _token_bytes(token: str, decoder_type: str) -> bytes:
+    """
+    :return: the bytes of a token in the text, where the decoder type
+        concatenates the tokens
+    """
+    if token is None:
+        return b""
+    if decoder_type == _BYTE_LEVEL:
+        if all(c in _BYTE_DECODER for c in token):
+            return bytes(_BYTE_DECODER[c] for c in token)
+        return token.encode("utf-8")
+    if decoder_type == _SENTENCEPIECE:
+        match = _BYTE_FALLBACK_TOKEN.fullmatch(token)
+        if match is not None:
+            return bytes([int(match.group(1), 16)])
+    return token.replace(_SPIECE_UNDERLINE, " ").encode("utf-8")
+
+
+def _vocabulary_bytes(tokenizer, decoder_type: str) -> List[bytes]:
+    tokens = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+    return [_token_bytes(token, decoder_type) for token in tokens]
+
+
+def vocabulary_bytes(tokenizer) -> Optional[List[bytes]]:
+    """
+    The bytes of every token of the vocabulary, as they appear in a text
+    before the tokenization spaces are cleaned up.
+    Tokens of byte level BPE and byte fallback vocabularies may be parts of
+    a UTF-8 character.
+
+    :param tokenizer: the huggingface tokenizer
+    :return: the bytes indexed by token id, None if the decoder of the
+        tokenizer is not known
+    """
+    decoder_type = _get_token_decoder_type(tokenizer)
+    if decoder_type is None:
+        return None
+    return _vocabulary_bytes(tokenizer, decoder_type)
+
+
+class DecodeState(object):
+    """
+    The state of one sequence of an IncrementalDetokenizer.
+    """
+
+    __slots__ = ("utf8_decoder", "first", "token_ids", "prefix_offset",
+                 "read_offset")
+
+    def __init__(self):
+        # table lookup
+        self.utf8_decoder = _utf8_decoder(errors="replace")
+        self.first = True
+        # decode fallback
+        self.token_ids = []
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+
+class IncrementalDetokenizer(object):
+    """
+    Converts the tokens generated in a step into the new text of each
+    sequence.
+
+    For byte level BPE and SentencePiece vocabularies the bytes of every token
+    are computed when the detokenizer is created, new tokens are converted by
+    table lookup and incomplete UTF-8 characters are held back until their
+    last byte arrives. Other tokenizers decode the new tokens together with a
+    few previous ones, so that spaces are added as in the full text, in one
+    batch_decode call for all the sequences of the step.
+    """
+
+    def __init__(self, tokenizer):
+        """
+        :param tokenizer: the huggingface tokenizer
+        """
+        self.tokenizer = tokenizer
+        self.decoder_type = _get_decoder_type(tokenizer)
+        # the bytes of every token of the vocabulary, computed once
+        self._pieces = []
+        if self.decoder_type is not None:
+            self._pieces = _vocabulary_bytes(tokenizer, self.decoder_type)
+        logging.debug(
+            f"Incremental detokenizer table lookup: {self.decoder_type}")
+
+    def new_sequence(self) -> DecodeState:
+        """
+        :return: the state of a new sequence, passed to decode
+        """
+        return DecodeState()
+
+    def decode(self, states: List[DecodeState],
+               token_ids: List[List[int]]) -> List[str]:
+        """
+        Decodes the new tokens of the sequences.
+
+        :param states: the states of the sequences
+        :param token_ids: the new token ids of each sequence
+        :return: the new text of each sequence, empty while a character is
+            incomplete
+        """
+        if self.decoder_type is None:
+            return self._batch_decode(states, token_ids)
+        texts = []
+        pieces = self._pieces
+        size = len(pieces)
+        for state, ids in zip(states, token_ids):
+            if state.first and ids:
+                state.first = False
+                data = self._first_token_bytes(ids[0])
+                ids = ids[1:]
+            else:
+                data = b""
+            for token_id in ids:
+                if 0 <= token_id < size:
+                    data += pieces[token_id]
+                else:
+                    data += _token_bytes(
+                        self.tokenizer.convert_ids_to_tokens(token_id),
+                        self.decoder_type)
+            texts.append(state.utf8_decoder.decode(data))
+        return texts
+
+    def _first_token_bytes(self, token_id: int) -> bytes:
+        if self.decoder_type == _METASPACE:
+            # the replacements of the first token are removed
+            token = self.tokenizer.convert_ids_to_tokens(token_id) or ""
+            return token.replace(_SPIECE_UNDERLINE, "").encode("utf-8")
+        data = _token_bytes(self.tokenizer.convert_ids_to_tokens(token_id),
+                            self.decoder_type)
+        if self.decoder_type == _SENTENCEPIECE and data.startswith(b" "):
+            # stripped from the start of the text
+            data = data[1:]
+        return data
+
+    def _batch_decode(self, states: List[DecodeState],
+                      token_ids: List[List[int]]) -> List[str]:
+        # the prefix text is necessary only to defeat cleanup algorithms in
+        # the decode which decide to add a space or not depending on the
+        # surrounding ids
+        sequences = []
+        for state, ids in zip(states, token_ids):
+            state.token_ids.extend(ids)
+            sequences.append(
+                state.token_ids[state.prefix_offset:state.read_offset])
+            sequences.append(state.token_ids[state.prefix_offset:])
+        decoded = self.tokenizer.batch_decode(sequences,
+                                              skip_special_tokens=False)
+        texts = []
+        for i, state in enumerate(states):
+            prefix_text = decoded[2 * i]
+            new_text = decoded[2 * i + 1]
+            if len(new_text) > len(prefix_text) and not new_text.endswith("�"):
+                # utf-8 char at the end means it's a potential unfinished
+                # byte sequence from byte fallback tokenization. If it's in
+                # the middle, it's probably a real invalid id generated by
+                # the model
+                texts.append(new_text[len(prefix_text):])
+                state.prefix_offset = state.read_offset
+                state.read_offset = len(state.token_ids)
+            else:
+                texts.append("")
+        return texts
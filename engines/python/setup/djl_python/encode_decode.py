@@ -50,14 +50,19 @@ def encode_csv(content):  # type: (str) -> np.array
     return stream.getvalue()
 
 
-def decode(inputs: Input, content_type: str, key=None):
+def decode(inputs: Input, content_type: str, key=None, copy: bool = True):
+    """
+    Decodes the content of the input by its content type.
+
+    :param copy: whether json content is returned as a copy that the caller
+        may modify, see Input.get_as_json
+    """
     if not content_type:
-        ret = inputs.get_as_bytes(key=key)
-        if not ret:
+        if not inputs.is_parsed(key=key) and not inputs.get_as_bytes(key=key):
             return {"inputs": ""}
-        return inputs.get_as_json(key=key)
+        return inputs.get_as_json(key=key, copy=copy)
     elif "application/json" in content_type:
-        return inputs.get_as_json(key=key)
+        return inputs.get_as_json(key=key, copy=copy)
     elif "text/csv" in content_type:
         return decode_csv(inputs)
     elif "text/plain" in content_type:
@@ -12,21 +12,14 @@
 # the specific language governing permissions and limitations under the License.
 import logging
 import os
-import re
-
-import torch
-from transformers import (
-    pipeline, Pipeline, Conversation, AutoModelForCausalLM,
-    AutoModelForSeq2SeqLM, AutoTokenizer, AutoConfig,
-    AutoModelForSequenceClassification, AutoModelForTokenClassification,
-    AutoModelForQuestionAnswering, StoppingCriteria, StoppingCriteriaList)
-from transformers.tokenization_utils_base import PreTrainedTokenizerBase
-from peft import PeftConfig, PeftModel, PeftModelForCausalLM
 
+# torch, transformers and peft are imported on first use to keep the worker
+# startup fast
 from djl_python.encode_decode import encode
 from djl_python.inputs import Input
 from djl_python.outputs import Output
-from djl_python.streaming_utils import StreamingUtils
+from djl_python.json_util import copy_json
+from djl_python.response_cache import create_response_cache, json_response_size
 from djl_python.rolling_batch.rolling_batch import get_content_type_from_output_formatter
 
 from djl_python.properties_manager.properties import StreamingEnum, is_rolling_batch_enabled, is_streaming_enabled
@@ -65,16 +58,18 @@ FLASH_2_SUPPORTED_MODELS = {
     "LlamaForCausalLM", "RWForCausalLM", "FalconForCausalLM"
 }
 
+# transformers auto model class names
 PEFT_MODEL_TASK_TO_CLS = {
-    "SEQ_CLS": AutoModelForSequenceClassification,
-    "SEQ_2_SEQ_LM": AutoModelForSeq2SeqLM,
-    "CAUSAL_LM": AutoModelForCausalLM,
-    "TOKEN_CLS": AutoModelForTokenClassification,
-    "QUESTION_ANS": AutoModelForQuestionAnswering,
+    "SEQ_CLS": "AutoModelForSequenceClassification",
+    "SEQ_2_SEQ_LM": "AutoModelForSeq2SeqLM",
+    "CAUSAL_LM": "AutoModelForCausalLM",
+    "TOKEN_CLS": "AutoModelForTokenClassification",
+    "QUESTION_ANS": "AutoModelForQuestionAnswering",
 }
 
 
 def enable_flash():
+    import torch
     if torch.cuda.is_available():
         major, _ = torch.cuda.get_device_capability()
         if major >= 8:
@@ -104,26 +99,6 @@ def get_rolling_batch_class_from_str(rolling_batch_type: str, is_mpi: bool,
     raise ValueError(f"Invalid rolling batch type: {rolling_batch_type}")
 
 
-class StopWord(StoppingCriteria):
-
-    def __init__(self, tokenizer, stop_seq):
-        StoppingCriteria.__init__(self)
-        self.tokenizer = tokenizer
-        self.stop_seq = stop_seq
-
-    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor,
-                 **kwargs):
-        decoded_input_ids = self.tokenizer.decode(
-            input_ids[0][-len(self.stop_seq):])
-
-        matches = re.search(self.stop_seq, decoded_input_ids)
-
-        if matches is not None:
-            return True
-
-        return False
-
-
 class HuggingFaceService(object):
 
     def __init__(self):
@@ -135,11 +110,14 @@ class HuggingFaceService(object):
         self.rolling_batch = None
         self.model_config = None
         self.peft_config = None
+        # whether the pipeline model is a causal LM with LoRA adapters
+        self.is_peft_causal_lm = False
         self.stopping_criteria_list = None
         self.adapter_registry = {}
         self.adapters = None
         self.hf_configs = None
         self.input_format_configs = None
+        self.response_cache = None
 
     def initialize(self, properties: dict):
         self.hf_configs = HuggingFaceProperties(**properties)
@@ -167,9 +145,11 @@ class HuggingFaceService(object):
                 task=self.hf_configs.task,
                 model_id_or_path=self.hf_configs.model_id_or_path,
                 kwargs=self.hf_configs.kwargs)
+            self._update_is_peft_causal_lm()
 
             if "stop_sequence" in properties:
                 self.load_stopping_criteria_list(properties["stop_sequence"])
+            self.response_cache = create_response_cache(self.hf_configs)
 
         self.input_format_configs = InputFormatConfigs(
             is_rolling_batch=is_rolling_batch_enabled(
@@ -199,19 +179,21 @@ class HuggingFaceService(object):
     def load_stopping_criteria_list(self, stop_sequence):
         """
         Uses current tokenizer in self.tokenizer to load StoppingCriteriaList.
-        Input: (str) stop_sequence - currently just one stop sequence supported
+        Input: (str) stop_sequence - a list of stop sequences, see
+            parse_stop_sequence_input
         Output: none (loads into member variable)
         """
         if self.tokenizer is None:
             return
 
-        stop_seq_list = self.parse_stop_sequence_input(stop_sequence)
+        from transformers import StoppingCriteriaList
+        from djl_python.stopping_criteria import StopWord
 
-        stopwords = []
-        for stop_seq in stop_seq_list:
-            stopwords.append(StopWord(self.tokenizer, stop_seq))
+        stop_seq_list = self.parse_stop_sequence_input(stop_sequence)
 
-        self.stopping_criteria_list = StoppingCriteriaList(stopwords)
+        # one matcher for all the stop sequences
+        self.stopping_criteria_list = StoppingCriteriaList(
+            [StopWord(self.tokenizer, stop_seq_list)])
 
     def parse_input(
         self, inputs: Input, tokenizer, output_formatter
@@ -296,6 +278,7 @@ class HuggingFaceService(object):
             if len(batch) > 1:
                 raise NotImplementedError(
                     "Dynamic batch not supported for generic streaming")
+            from djl_python.streaming_utils import StreamingUtils
             outputs.add_property("content-type", "application/jsonlines")
             if self.hf_configs.enable_streaming.value == StreamingEnum.huggingface.value:
                 outputs.add_stream_content(
@@ -315,13 +298,13 @@ class HuggingFaceService(object):
                 "In order to enable dynamic batching, all input batches must have the same parameters"
             )
 
-        if isinstance(self.model, PeftModelForCausalLM):
+        if self.is_peft_causal_lm:
             if self.adapters is None:
                 # Inference with only base model
                 self.adapters = [""] * len(input_data)
             parameters[0]["adapters"] = self.adapters
 
-        prediction = self.hf_pipeline(input_data, **parameters[0])
+        prediction = self._run_pipeline(input_data, input_size, parameters[0])
 
         offset = 0
         for i, item in enumerate(batch):
@@ -349,7 +332,86 @@ class HuggingFaceService(object):
 
         return outputs
 
+    def _run_pipeline(self, input_data: list, input_size: list[int],
+                      parameters: dict) -> list:
+        """
+        Runs the pipeline for the requests whose predictions are not in the
+        response cache.
+
+        :param input_data: the inputs of all the requests
+        :param input_size: the number of inputs of each request
+        :param parameters: the parameters shared by the requests
+        :return: the predictions of all the inputs
+        """
+        if self.response_cache is None:
+            return self.hf_pipeline(input_data, **parameters)
+        parameters = parameters.copy()
+        adapters = parameters.pop("adapters", None)
+        requests = []
+        offset = 0
+        for size in input_size:
+            if size == 0:
+                continue
+            request_adapters = None
+            if adapters is not None:
+                request_adapters = adapters[offset:offset + size]
+            key = self.response_cache.key(input_data[offset:offset + size],
+                                          parameters,
+                                          self._uses_sampling(parameters),
+                                          request_adapters)
+            cached = None if key is None else self.response_cache.get(key)
+            requests.append((offset, size, key, cached))
+            offset += size
+
+        missing = [request for request in requests if request[3] is None]
+        if missing:
+            inputs = [
+                data for offset, size, _, _ in missing
+                for data in input_data[offset:offset + size]
+            ]
+            if adapters is not None:
+                parameters["adapters"] = [
+                    adapter for offset, size, _, _ in missing
+                    for adapter in adapters[offset:offset + size]
+                ]
+            outputs = self.hf_pipeline(inputs, **parameters)
+
+        prediction = []
+        position = 0
+        for _, size, key, cached in requests:
+            if cached is None:
+                cached = outputs[position:position + size]
+                position += size
+                size = None if key is None else json_response_size(cached)
+                # tensors and other outputs that are not json are not cached
+                if size is not None:
+                    # the pipeline outputs are returned, the cache keeps a copy
+                    self.response_cache.put(key, copy_json(cached), size)
+            else:
+                # the caller may change the predictions
+                cached = copy_json(cached)
+            prediction.extend(cached)
+        return prediction
+
+    def _update_is_peft_causal_lm(self):
+        from peft import PeftModelForCausalLM
+        self.is_peft_causal_lm = isinstance(self.model, PeftModelForCausalLM)
+
+    def _uses_sampling(self, parameters: dict) -> bool:
+        """
+        :return: whether the pipeline samples, by default from the generation
+            config of the model
+        """
+        do_sample = parameters.get("do_sample")
+        if do_sample is None:
+            generation_config = getattr(self.model, "generation_config", None)
+            do_sample = getattr(generation_config, "do_sample", False)
+        return bool(do_sample)
+
     def get_pipeline(self, task: str, model_id_or_path: str, kwargs):
+        import transformers
+        from transformers import pipeline, AutoTokenizer
+        from transformers.tokenization_utils_base import PreTrainedTokenizerBase
         # define tokenizer or feature extractor as kwargs to load it the pipeline correctly
         if task in {
                 "automatic-speech-recognition",
@@ -373,9 +435,12 @@ class HuggingFaceService(object):
                     trust_remote_code=self.hf_configs.trust_remote_code,
                     revision=self.hf_configs.revision,
                 )
-                base_model = PEFT_MODEL_TASK_TO_CLS[
-                    self.peft_config.task_type].from_pretrained(
-                        self.peft_config.base_model_name_or_path, **kwargs)
+                from peft import PeftModel
+                model_cls = getattr(
+                    transformers,
+                    PEFT_MODEL_TASK_TO_CLS[self.peft_config.task_type])
+                base_model = model_cls.from_pretrained(
+                    self.peft_config.base_model_name_or_path, **kwargs)
                 self.model = PeftModel.from_pretrained(base_model,
                                                        model_id_or_path)
                 if "load_in_8bit" in kwargs or "load_in_4bit" in kwargs:
@@ -427,6 +492,7 @@ class HuggingFaceService(object):
         return hf_pipeline
 
     def _init_tokenizer(self, model_id_or_path: str):
+        from transformers import AutoTokenizer
         path_to_use = model_id_or_path if self.peft_config is None else self.peft_config.base_model_name_or_path
         self.tokenizer = AutoTokenizer.from_pretrained(
             path_to_use,
@@ -436,6 +502,7 @@ class HuggingFaceService(object):
         )
 
     def _init_model(self, model_id_or_path: str, **kwargs):
+        from transformers import AutoModelForCausalLM, AutoModelForSeq2SeqLM
         architectures = self.model_config.architectures
         if architectures and architectures[0].endswith(
                 "ForConditionalGeneration"):
@@ -447,6 +514,7 @@ class HuggingFaceService(object):
                 kwargs['use_flash_attention_2'] = True
 
         if self.peft_config is not None:
+            from peft import PeftModel
             base_model = model_cls.from_pretrained(
                 self.peft_config.base_model_name_or_path, **kwargs)
             self.model = PeftModel.from_pretrained(base_model,
@@ -467,6 +535,8 @@ class HuggingFaceService(object):
     @staticmethod
     def wrap_conversation_pipeline(hf_pipeline):
 
+        from transformers import Conversation
+
         def wrapped_pipeline(inputs, *args, **kwargs):
             converted_input = Conversation(
                 inputs["text"],
@@ -485,6 +555,7 @@ class HuggingFaceService(object):
         return wrapped_pipeline
 
     def wrap_text_generation_pipeline(self, hf_pipeline):
+        import torch
 
         def wrapped_pipeline(inputs, *args, **kwargs):
             model = hf_pipeline.model
@@ -495,6 +566,13 @@ class HuggingFaceService(object):
             else:
                 input_tokens = input_tokens.to(model.device)
 
+            if self.stopping_criteria_list:
+                generation_config = kwargs.get(
+                    "generation_config") or model.generation_config
+                num_beams = kwargs.get("num_beams",
+                                       generation_config.num_beams)
+                for stopping_criteria in self.stopping_criteria_list:
+                    stopping_criteria.reset(num_beams=num_beams or 1)
             with torch.no_grad():
                 output_tokens = model.generate(
                     *args,
@@ -524,6 +602,7 @@ class HuggingFaceService(object):
         return task
 
     def _read_model_config(self, model_config_path: str):
+        from transformers import AutoConfig
         try:
             self.model_config = AutoConfig.from_pretrained(
                 model_config_path,
@@ -533,6 +612,7 @@ class HuggingFaceService(object):
             logging.warning(
                 f"config.json not found for {model_config_path}. Attempting to load with peft"
             )
+            from peft import PeftConfig
             self.peft_config = PeftConfig.from_pretrained(model_config_path)
             self.model_config = AutoConfig.from_pretrained(
                 self.peft_config.base_model_name_or_path,
@@ -562,12 +642,15 @@ def register_adapter(inputs: Input):
     logging.info(f"Registering adapter {adapter_name} from {adapter_path}")
     _service.adapter_registry[adapter_name] = inputs
     if not is_rolling_batch_enabled(_service.hf_configs.rolling_batch):
+        from peft import PeftModel
+        from transformers import Pipeline
         if isinstance(_service.model, PeftModel):
             _service.model.load_adapter(adapter_path, adapter_name)
         else:
             _service.model = PeftModel.from_pretrained(_service.model,
                                                        adapter_path,
                                                        adapter_name)
+        _service._update_is_peft_causal_lm()
 
         if isinstance(_service.hf_pipeline, Pipeline):
             _service.hf_pipeline.model = _service.model
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file
+# except in compliance with the License. A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS"
+# BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+"""
+Measures module import times, similar to python -X importtime.
+
+Enabled in the python engine with OPTION_IMPORT_PROFILE=true, the report is
+logged as one json line once the first request has been handled.
+"""
+
+import sys
+import threading
+import time
+
+
+class ImportProfiler(object):
+    """
+    Meta path finder that times the execution of every module imported while
+    it is installed.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.local = threading.local()
+        self.phases = []
+        self.phase_start = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+        self.phase_start = time.perf_counter()
+
+    def stop(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def end_phase(self, name: str):
+        """
+        Records the wall time since the previous phase, e.g. model loading.
+
+        :param name: phase name
+        """
+        now = time.perf_counter()
+        self.phases.append({
+            "phase":
+            name,
+            "elapsed_ms":
+            round((now - self.phase_start) * 1000, 3)
+        })
+        self.phase_start = now
+
+    def find_spec(self, name, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is None:
+                continue
+            loader = spec.loader
+            # shared loaders (builtin, frozen) are classes, leave them alone
+            if loader is not None and not isinstance(loader, type) and hasattr(
+                    loader, "exec_module"):
+                loader.exec_module = self._timed(name, loader.exec_module,
+                                                 loader)
+            return spec
+        return None
+
+    def _timed(self, name, exec_module, loader):
+
+        def timed_exec_module(module):
+            try:
+                del loader.exec_module
+            except AttributeError:
+                pass
+            # time spent in nested imports, per thread
+            stack = getattr(self.local, "stack", None)
+            if stack is None:
+                stack = self.local.stack = []
+            stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                cumulative = time.perf_counter() - start
+                children = stack.pop()
+                if stack:
+                    stack[-1] += cumulative
+                with self.lock:
+                    self.records[name] = (cumulative - children, cumulative)
+
+        return timed_exec_module
+
+    def report(self, top: int = 20) -> dict:
+        """
+        :param top: number of slowest modules to include
+        :return: phases, totals and the slowest imports in milliseconds
+        """
+        with self.lock:
+            records = dict(self.records)
+        slowest = sorted(records.items(), key=lambda r: r[1][1],
+                         reverse=True)[:top]
+        return {
+            "phases":
+            self.phases,
+            "modules":
+            len(records),
+            "import_ms":
+            round(sum(r[0] for r in records.values()) * 1000, 3),
+            "top": [{
+                "module": name,
+                "self_ms": round(self_time * 1000, 3),
+                "cumulative_ms": round(cumulative * 1000, 3)
+            } for name, (self_time, cumulative) in slowest],
+        }
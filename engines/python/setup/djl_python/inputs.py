@@ -12,31 +12,38 @@
 # the specific language governing permissions and limitations under the License.
 
 import io
+import os
 import struct
-import json
 import re
+import time
 from typing import List
 
 from .np_util import from_nd_list
+from . import json_util, shm_util
 from .pair_list import PairList
 
 
 def retrieve_buffer(conn, length):
     """
     Retrieves buffer in the specified length.
+
+    The buffer is allocated once with the exact length and filled in place
+    with ``recv_into``, so large payloads are not copied chunk by chunk.
+
     :param conn: socket connection
     :param length: length of the data to be read
     :return: retrieved byte array
     """
-    data = bytearray()
+    data = bytearray(length)
+    view = memoryview(data)
+    pos = 0
 
-    while length > 0:
-        pkt = conn.recv(length)
-        if len(pkt) == 0:
+    while pos < length:
+        size = conn.recv_into(view[pos:], length - pos)
+        if size == 0:
             raise ValueError("Connection disconnected")
 
-        data += pkt
-        length -= len(pkt)
+        pos += size
 
     return data
 
@@ -70,12 +77,225 @@ def retrieve_utf8(conn):
     return data.decode("utf8")
 
 
+class SocketReader(object):
+    """
+    Buffered frame reader over a socket connection.
+
+    Reads the socket in large chunks and decodes the short, int and utf8
+    header fields from the buffer, so a request header costs a handful of
+    ``recv`` calls instead of several per property. Payloads larger than the
+    buffer are received directly into their own preallocated buffer.
+
+    The reader may read ahead into the next request, so one instance must be
+    reused for the whole lifetime of the connection.
+    """
+
+    DEFAULT_BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, conn, buffer_size: int = DEFAULT_BUFFER_SIZE):
+        self.conn = conn
+        self._buf = bytearray(buffer_size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        self.recv_calls = 0
+        self.first_recv_time = None
+        self.recv_time = 0.0
+
+    def reset_stats(self):
+        """
+        Resets the per request counters.
+        """
+        self.recv_calls = 0
+        self.first_recv_time = None
+        self.recv_time = 0.0
+
+    def get_stats(self) -> dict:
+        """
+        Returns the counters collected since the last reset.
+
+        :return: number of recv calls, elapsed milliseconds since the first
+            byte of the request was received and milliseconds spent in recv
+            calls after the first one
+        """
+        latency = 0.0
+        if self.first_recv_time is not None:
+            latency = (time.perf_counter() - self.first_recv_time) * 1000
+        return {
+            "recv_calls": self.recv_calls,
+            "read_latency_ms": latency,
+            "recv_ms": self.recv_time * 1000
+        }
+
+    def _recv_into(self, view, length) -> int:
+        start = time.perf_counter()
+        size = self.conn.recv_into(view, length)
+        if size == 0:
+            raise ValueError("Connection disconnected")
+        self.recv_calls += 1
+        end = time.perf_counter()
+        if self.first_recv_time is None:
+            # the first call mostly waits for the request to arrive
+            self.first_recv_time = end
+        else:
+            self.recv_time += end - start
+        return size
+
+    def _fill(self, length: int):
+        """
+        Makes sure at least length bytes are available in the buffer.
+        """
+        if self._end - self._start >= length:
+            return
+        if self._start > 0:
+            remaining = self._end - self._start
+            self._buf[:remaining] = self._view[self._start:self._end]
+            self._start = 0
+            self._end = remaining
+        while self._end < length:
+            self._end += self._recv_into(self._view[self._end:],
+                                         len(self._buf) - self._end)
+
+    def read_short(self) -> int:
+        self._fill(2)
+        value = struct.unpack_from(">h", self._buf, self._start)[0]
+        self._start += 2
+        return value
+
+    def read_int(self) -> int:
+        self._fill(4)
+        value = struct.unpack_from(">i", self._buf, self._start)[0]
+        self._start += 4
+        return value
+
+    def read_utf8(self):
+        length = self.read_int()
+        if length < 0:
+            return None
+        if length <= len(self._buf):
+            self._fill(length)
+            value = str(self._view[self._start:self._start + length], "utf8")
+            self._start += length
+            return value
+        return self.read_buffer(length).decode("utf8")
+
+    def read_buffer(self, length: int) -> bytearray:
+        """
+        Reads a buffer in the specified length.
+
+        :param length: length of the data to be read
+        :return: retrieved byte array
+        """
+        if length <= len(self._buf):
+            self._fill(length)
+            data = bytearray(self._view[self._start:self._start + length])
+            self._start += length
+            return data
+
+        data = bytearray(length)
+        view = memoryview(data)
+        pos = self._end - self._start
+        view[:pos] = self._view[self._start:self._end]
+        self._start = self._end = 0
+        while pos < length:
+            pos += self._recv_into(view[pos:], length - pos)
+        return data
+
+
+class PropertyMap(dict):
+    """
+    Dictionary of request properties that keeps an index of the case folded
+    keys, so case insensitive lookups don't need to scan all properties.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._folded = {}
+        # incremented on every change
+        self._version = 0
+        for key in self.keys():
+            self._folded.setdefault(key.lower(), key)
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self._folded.setdefault(key.lower(), key)
+        super().__setitem__(key, value)
+        self._version += 1
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._remove_folded(key)
+
+    def _remove_folded(self, key):
+        self._version += 1
+        folded = key.lower()
+        if self._folded.get(folded) == key:
+            del self._folded[folded]
+            # another key may differ only in case
+            for k in self.keys():
+                if k.lower() == folded:
+                    self._folded[folded] = k
+                    break
+
+    def pop(self, key, *args):
+        existed = key in self
+        value = super().pop(key, *args)
+        if existed:
+            self._remove_folded(key)
+        return value
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._remove_folded(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        super().clear()
+        self._folded.clear()
+        self._version += 1
+
+    def get_ignore_case(self, key: str, default=None):
+        """
+        Returns the value of the first key that matches ignoring case.
+
+        :param key: key of map
+        :param default: value returned when the key is not found
+        :return: value of the key
+        """
+        k = self._folded.get(key.lower())
+        if k is None:
+            return default
+        return self[k]
+
+
 class Input(object):
 
     def __init__(self):
         self.function_name = None
-        self.properties = dict()
+        self.properties = PropertyMap()
         self.content = PairList()
+        # batch slot index -> ([(key, value)] properties, [(key, value)] content)
+        self._batch_slots = None
+        # state of properties and content the batch slots were built from
+        self._batch_slots_signature = None
+        # id(raw content) -> (raw content, parsed json), shared with batches
+        self._parsed = {}
+        # drop the raw content once it has been parsed as json
+        self.release_parsed_buffers = os.getenv("OPTION_RELEASE_PARSED_INPUT",
+                                                "false").lower() == "true"
 
     def __str__(self):
         cur_str = "properties: " + str(self.get_properties())
@@ -90,29 +310,71 @@ class Input(object):
         return int(self.properties.get("batch_size", "1"))
 
     def get_batches(self) -> List["Input"]:
+        """
+        Returns one Input per batch slot.
+
+        Only the slot index is cached: it is collected in read() and rebuilt
+        when the properties or the content change through their methods. Each
+        call returns new Inputs, so changing the properties or content of one
+        does not affect later calls. Content values are shared with this
+        Input, not copied.
+
+        :return: list of Input
+        """
         if not self.is_batch():
             return [self]
 
-        batch_size = self.get_batch_size()
+        if self._batch_slots is None or self._batch_slots_changed():
+            # Input was not read from a socket or has been modified since
+            self._index_batches()
+
         batch = []
-        for i in range(batch_size):
-            batch.append(Input())
+        for i in range(self.get_batch_size()):
+            item = Input()
+            item._parsed = self._parsed
+            item.release_parsed_buffers = self.release_parsed_buffers
+            properties, content = self._batch_slots.get(i, ((), ()))
+            for key, value in properties:
+                item.properties[key] = value
+            for key, value in content:
+                item.content.add(key, value)
+            batch.append(item)
+        return batch
 
+    def _batch_signature(self) -> tuple:
+        properties, content = self.properties, self.content
+        # the size catches keys and values appended to the lists directly
+        return (properties, getattr(properties, "_version", None), content,
+                getattr(content, "_version", None), content.size())
+
+    def _batch_slots_changed(self) -> bool:
+        cached = self._batch_slots_signature
+        if cached is None or cached[1] is None or cached[3] is None:
+            # not read yet, or a properties or content type without version
+            return True
+        current = self._batch_signature()
+        return (cached[0] is not current[0] or cached[2] is not current[2]
+                or cached[1::2] != current[1::2] or cached[4] != current[4])
+
+    def _add_batch_property(self, key: str, value):
+        # e.g batch_001_eula and eula is the key
+        if key.startswith("batch_") and key != "batch_size":
+            self._batch_slots.setdefault(int(key[6:9]), ([], []))[0].append(
+                (key[10:], value))
+
+    def _add_batch_content(self, key: str, value):
+        # e.g batch_001_inputs and inputs is the key
+        self._batch_slots.setdefault(int(key[6:9]), ([], []))[1].append(
+            (key[10:], value))
+
+    def _index_batches(self):
+        self._batch_slots = {}
         for key, value in self.properties.items():
-            # e.g batch_001_eula and eula is the key
-            if key.startswith("batch_") and key != "batch_size":
-                index = int(key[6:9])
-                key = key[10:]
-                batch[index].properties[key] = value
-
+            self._add_batch_property(key, value)
         for i in range(self.content.size()):
-            # e.g batch_001_inputs and inputs is the key
-            key = self.content.key_at(i)
-            index = int(key[6:9])
-            key = key[10:]
-            batch[index].content.add(key, self.content.value_at(i))
-
-        return batch
+            self._add_batch_content(self.content.key_at(i),
+                                    self.content.value_at(i))
+        self._batch_slots_signature = self._batch_signature()
 
     def get_function_name(self) -> str:
         return self.function_name
@@ -140,10 +402,11 @@ class Input(object):
         :param key: key of map
         :return: value of the key
         """
+        if isinstance(self.properties, PropertyMap):
+            return self.properties.get_ignore_case(key)
+        key = key.lower()
         return next(
-            (v
-             for k, v in self.properties.items() if k.lower() == key.lower()),
-            None)
+            (v for k, v in self.properties.items() if k.lower() == key), None)
 
     def contains_key(self, key) -> bool:
         return self.content.get(key) is not None
@@ -167,6 +430,16 @@ class Input(object):
             return self.get_as_bytes(key=key)
 
     def get_as_bytes(self, key=None):
+        ret = self._get_content(key)
+        if self._parsed and ret is not None and len(ret) == 0:
+            cached = self._parsed.get(id(ret))
+            if cached is not None and cached[0] is ret:
+                raise ValueError(
+                    "The content was released once parsed as json, use "
+                    "get_as_json() instead")
+        return ret
+
+    def _get_content(self, key=None):
         if self.content.is_empty():
             return None
 
@@ -183,11 +456,59 @@ class Input(object):
             ret = self.content.value_at(0)
         return ret
 
+    def get_as_buffer(self, key=None) -> memoryview:
+        """
+        Returns a read-only view of the content without copying it.
+
+        :param key: optional key
+        :return: read-only memoryview of the content
+        """
+        ret = self.get_as_bytes(key=key)
+        if ret is None:
+            return None
+        return memoryview(ret).toreadonly()
+
     def get_as_string(self, key=None) -> str:
         return self.get_as_bytes(key=key).decode("utf-8")
 
-    def get_as_json(self, key=None):
-        return json.loads((self.get_as_bytes(key=key).decode("utf-8")))
+    def get_as_json(self, key=None, copy: bool = True):
+        """
+        Returns the content parsed as json.
+
+        The content is parsed once, the parsed object is kept for later calls.
+        If release_parsed_buffers is set, the raw content is cleared once
+        parsed.
+
+        :param key: optional key
+        :param copy: whether to return a copy of the parsed object that the
+            caller may modify, otherwise the kept object is returned and must
+            not be modified
+        :return: parsed json
+        """
+        data = self._get_content(key)
+        cached = self._parsed.get(id(data))
+        if cached is not None and cached[0] is data:
+            result = cached[1]
+        else:
+            result = json_util.loads(data)
+            if self.release_parsed_buffers and type(data) is bytearray:
+                try:
+                    data.clear()
+                except BufferError:
+                    # the buffer is still exported, e.g. by get_as_buffer()
+                    pass
+            self._parsed[id(data)] = (data, result)
+        return json_util.copy_json(result) if copy else result
+
+    def is_parsed(self, key=None) -> bool:
+        """
+        Whether the content was parsed as json and its raw buffer released.
+
+        :param key: optional key
+        """
+        data = self._get_content(key)
+        cached = self._parsed.get(id(data))
+        return cached is not None and cached[0] is data and len(data) == 0
 
     def get_as_image(self, key=None):
         from PIL import Image
@@ -201,11 +522,19 @@ class Input(object):
         :param key: optional key
         :return: list of numpy array
         """
-        return from_nd_list(self.get_as_bytes(key=key))
+        data = self.get_as_bytes(key=key)
+        transport = shm_util.get_transport()
+        if transport is not None and transport.accepts(data):
+            return transport.decode(data)
+        return from_nd_list(data)
 
     def get_as_npz(self, key=None) -> list:
         import numpy
-        npz = numpy.load(io.BytesIO(self.get_as_bytes(key=key)))
+        data = self.get_as_bytes(key=key)
+        transport = shm_util.get_transport()
+        if transport is not None and transport.accepts(data):
+            return transport.decode(data)
+        npz = numpy.load(io.BytesIO(data))
         result = [npz[name] for name in npz.files]
         return result
 
@@ -218,19 +547,44 @@ class Input(object):
         return self.content.is_empty()
 
     def read(self, conn):
-        prop_size = retrieve_short(conn)
+        """
+        Reads a request from the connection.
+
+        :param conn: socket connection or a SocketReader wrapping it
+        """
+        if isinstance(conn, SocketReader):
+            read_short = conn.read_short
+            read_int = conn.read_int
+            read_utf8 = conn.read_utf8
+            read_buffer = conn.read_buffer
+        else:
+            read_short = lambda: retrieve_short(conn)
+            read_int = lambda: retrieve_int(conn)
+            read_utf8 = lambda: retrieve_utf8(conn)
+            read_buffer = lambda length: retrieve_buffer(conn, length)
+
+        self._batch_slots = {}
+        prop_size = read_short()
 
         for _ in range(prop_size):
-            key = retrieve_utf8(conn)
-            val = retrieve_utf8(conn)
+            key = read_utf8()
+            val = read_utf8()
             self.properties[key] = val
 
-        content_size = retrieve_short(conn)
+        is_batch = self.is_batch()
+        if is_batch:
+            for key, val in self.properties.items():
+                self._add_batch_property(key, val)
+
+        content_size = read_short()
 
         for _ in range(content_size):
-            key = retrieve_utf8(conn)
-            length = retrieve_int(conn)
-            val = retrieve_buffer(conn, length)
+            key = read_utf8()
+            length = read_int()
+            val = read_buffer(length)
             self.content.add(key=key, value=val)
+            if is_batch:
+                self._add_batch_content(key, val)
 
         self.function_name = self.properties.get('handler')
+        self._batch_slots_signature = self._batch_signature()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file
+# except in compliance with the License. A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS"
+# BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+"""
+Pluggable JSON encoding of outputs.
+
+The encoder is selected with OPTION_JSON_ENCODER:
+    json (default): the json module
+    auto: orjson if installed, otherwise the json module
+    orjson, ujson: the given library
+Output is compact; OPTION_JSON_INDENT restores indented output (json only).
+Note that orjson encodes NaN and Infinity as null, while json rejects them,
+so the faster libraries are opt-in.
+
+Inputs are parsed straight from bytes with orjson when it is installed,
+unless OPTION_JSON_DECODER is set to json.
+"""
+
+import datetime
+import json
+import logging
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _default(obj):
+    """
+    Converts the types the JSON libraries don't support natively.
+    """
+    if isinstance(obj, datetime.datetime):
+        return obj.__str__()
+    if np is not None:
+        if isinstance(obj, np.integer):
+            return int(obj)
+        elif isinstance(obj, np.floating):
+            return float(obj)
+        elif isinstance(obj, np.bool_):
+            return bool(obj)
+        elif isinstance(obj, np.ndarray):
+            return obj.tolist()
+    raise TypeError(
+        f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+# https://github.com/automl/SMAC3/issues/453
+class _JSONEncoder(json.JSONEncoder):
+    """
+    custom `JSONEncoder` to make sure float and int64 ar converted
+    """
+
+    def default(self, obj):
+        try:
+            return _default(obj)
+        except TypeError:
+            return super(_JSONEncoder, self).default(obj)
+
+
+class JsonEncoder(object):
+    """
+    Encodes values to utf-8 JSON bytes.
+    """
+
+    name = "json"
+
+    def __init__(self, indent: int = None):
+        self.encoder = _JSONEncoder(ensure_ascii=False,
+                                    allow_nan=False,
+                                    indent=indent,
+                                    separators=(",", ":"))
+
+    def dumps(self, val) -> bytes:
+        if np is not None and type(val) is np.ndarray:
+            val = val.tolist()
+        return self.encoder.encode(val).encode("utf-8")
+
+
+class OrjsonEncoder(JsonEncoder):
+    """
+    orjson encoder, serializes numpy arrays and scalars natively.
+    """
+
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+        self.option = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+                       | orjson.OPT_PASSTHROUGH_DATETIME)
+
+    def dumps(self, val) -> bytes:
+        try:
+            return self.orjson.dumps(val, default=_default, option=self.option)
+        except TypeError:
+            # e.g. non-contiguous arrays or dtypes orjson doesn't support
+            return self.orjson.dumps(_to_native(val), option=self.option)
+
+
+class UjsonEncoder(JsonEncoder):
+    """
+    ujson encoder.
+    """
+
+    name = "ujson"
+
+    def __init__(self):
+        import ujson
+        self.ujson = ujson
+
+    def dumps(self, val) -> bytes:
+        if np is not None and type(val) is np.ndarray:
+            val = val.tolist()
+        return self.ujson.dumps(val,
+                                ensure_ascii=False,
+                                default=_default,
+                                escape_forward_slashes=False).encode("utf-8")
+
+
+def _to_native(val):
+    if isinstance(val, dict):
+        return {k: _to_native(v) for k, v in val.items()}
+    if isinstance(val, (list, tuple)):
+        return [_to_native(v) for v in val]
+    try:
+        return _default(val)
+    except TypeError:
+        return val
+
+
+_ENCODERS = {
+    "orjson": OrjsonEncoder,
+    "ujson": UjsonEncoder,
+    "json": JsonEncoder,
+}
+_encoder = None
+_orjson_loads = None
+
+
+def create_encoder(name: str = "json"):
+    """
+    Creates the JSON encoder with the given name.
+
+    :param name: json, auto, orjson or ujson
+    :return: the encoder
+    """
+    if name == "auto":
+        for candidate in ("orjson", "json"):
+            try:
+                return _ENCODERS[candidate]()
+            except ImportError:
+                pass
+    if name not in _ENCODERS:
+        raise ValueError(f"Unsupported json encoder: {name}")
+    return _ENCODERS[name]()
+
+
+def get_encoder():
+    """
+    :return: the encoder configured with OPTION_JSON_ENCODER and OPTION_JSON_INDENT
+    """
+    global _encoder
+    if _encoder is None:
+        indent = os.getenv("OPTION_JSON_INDENT")
+        if indent:
+            _encoder = JsonEncoder(int(indent))
+        else:
+            _encoder = create_encoder(
+                os.getenv("OPTION_JSON_ENCODER", "json").lower())
+        logging.info(f"Using {_encoder.name} to encode json outputs.")
+    return _encoder
+
+
+def set_encoder(encoder):
+    """
+    Overrides the JSON encoder, None resets to the configured one.
+
+    :param encoder: object with a dumps(val) -> bytes method
+    """
+    global _encoder
+    _encoder = encoder
+
+
+def dumps(val) -> bytes:
+    """
+    Encodes a value to utf-8 JSON bytes.
+
+    :param val: value to encode
+    :return: encoded bytes
+    """
+    return get_encoder().dumps(val)
+
+
+_CONTAINERS = (dict, list)
+
+
+def copy_json(value):
+    """
+    Copies the dicts and lists of a parsed json value, the other values are
+    immutable. Much faster than copy.deepcopy.
+
+    :param value: parsed json
+    :return: the copy
+    """
+    if type(value) is dict:
+        return {
+            k: copy_json(v) if type(v) in _CONTAINERS else v
+            for k, v in value.items()
+        }
+    if type(value) is list:
+        return [copy_json(v) if type(v) in _CONTAINERS else v for v in value]
+    return value
+
+
+def _get_orjson_loads():
+    global _orjson_loads
+    if _orjson_loads is None:
+        _orjson_loads = False
+        if os.getenv("OPTION_JSON_DECODER", "auto").lower() != "json":
+            try:
+                import orjson
+                _orjson_loads = orjson.loads
+            except ImportError:
+                pass
+    return _orjson_loads
+
+
+def loads(data):
+    """
+    Parses utf-8 JSON without decoding it to str first.
+
+    :param data: bytes-like object or str
+    :return: parsed object
+    """
+    orjson_loads = _get_orjson_loads()
+    if orjson_loads:
+        try:
+            return orjson_loads(data)
+        except ValueError:
+            # e.g. NaN literals or big integers, that json accepts
+            pass
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
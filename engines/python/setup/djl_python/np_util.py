@@ -11,6 +11,7 @@
 # BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
 # the specific language governing permissions and limitations under the License.
 
+import functools
 import io
 import struct
 
@@ -124,7 +125,11 @@ def get_long(encoded: bytearray, idx: int) -> tuple:
 def from_nd_list(encoded: bytearray) -> list:
     """
     Converts djl format to list of numpy array
-    :param encoded: bytearray
+
+    The returned arrays are views into the encoded buffer, the tensor data is
+    not copied.
+
+    :param encoded: bytearray or any bytes-like object
     :return: list of numpy array
     """
     if len(encoded) >= 4 and encoded[0] == 80 and encoded[1] == 75:
@@ -135,28 +140,44 @@ def from_nd_list(encoded: bytearray) -> list:
             result.append(item[1])
         return result
 
-    idx = 0
-    num_ele, idx = get_int(encoded, idx)
+    view = memoryview(encoded)
+    if view.format != "B" or view.ndim != 1:
+        view = view.cast("B")
+    num_ele = struct.unpack_from(">i", view, 0)[0]
+    idx = 4
     result = []
     for _ in range(num_ele):
-        magic, idx = get_str(encoded, idx)
+        magic, idx = _unpack_str(view, idx)
         if magic != MAGIC_NUMBER:
             raise AssertionError(f"magic number is not NDAR, actual {magic}")
-        version, idx = get_int(encoded, idx)
+        version = struct.unpack_from(">i", view, idx)[0]
+        idx += 4
         if version != VERSION:
             raise AssertionError(
                 f"require version {VERSION}, actual {version}")
-        flag, idx = get_byte_as_int(encoded, idx)
+        flag = view[idx]
+        idx += 1
         if flag == 1:
-            _, idx = get_str(encoded, idx)
-        _, idx = get_str(encoded, idx)  # ignore sparse format
-        datatype, idx = get_str(encoded, idx)
-        shape, idx = _shape_decode(encoded, idx)
-        order, idx = get_byte_as_int(encoded, idx)
-        data_length, idx = get_int(encoded, idx)
-        data, idx = get_bytes(encoded, idx, data_length)
-        nd = np.ndarray(shape, np.dtype(datatype.lower()), data)
-        nd = nd.newbyteorder(chr(order))
+            _, idx = _unpack_str(view, idx)
+        _, idx = _unpack_str(view, idx)  # ignore sparse format
+        datatype, idx = _unpack_str(view, idx)
+        ndim = struct.unpack_from(">i", view, idx)[0]
+        shape = struct.unpack_from(f">{ndim}q", view, idx + 4)
+        idx += 4 + 8 * ndim
+        layout_len = struct.unpack_from(">i", view, idx)[0]
+        idx += 4 + 2 * layout_len
+        order = view[idx]
+        data_length = struct.unpack_from(">i", view, idx + 1)[0]
+        idx += 5
+        dtype = _DTYPES.get((datatype, order))
+        if dtype is None:
+            dtype = np.dtype(datatype.lower()).newbyteorder(chr(order))
+            _DTYPES[(datatype, order)] = dtype
+        nd = np.frombuffer(view,
+                           dtype=dtype,
+                           count=data_length // dtype.itemsize,
+                           offset=idx).reshape(shape)
+        idx += data_length
         result.append(nd)
     return result
 
@@ -168,23 +189,93 @@ def to_nd_list(np_list) -> bytearray:
     :param np_list: list of numpy array
     :return: djl NDList as bytearray
     """
-    arr = bytearray()
+    buffers = to_nd_list_buffers(np_list)
+    arr = bytearray(sum(memoryview(buf).nbytes for buf in buffers))
+    view = memoryview(arr)
+    idx = 0
+    for buf in buffers:
+        size = memoryview(buf).nbytes
+        view[idx:idx + size] = buf
+        idx += size
+    return arr
+
+
+def to_nd_list_buffers(np_list) -> list:
+    """
+    Converts list of numpy array into djl NDList as a list of buffers.
+
+    All the headers are written into one preallocated buffer, the tensor data
+    is returned as memoryviews of the arrays without copying, which is suitable
+    for a vectored send.
+
+    :param np_list: list of numpy array
+    :return: list of bytes-like objects that concatenated form the NDList
+    """
     if type(np_list) is not list:
         np_list = [np_list]
 
-    arr.extend(set_int(len(np_list)))
+    arrays = []
+    header_size = 4
     for nd in np_list:
-        arr.extend(set_str(MAGIC_NUMBER))
-        arr.extend(set_int(VERSION))
-        arr.append(0)  # no name
-        arr.extend(set_str("default"))
-        arr.extend(set_str(str(nd.dtype).upper()))
-        _shape_encode(nd.shape, arr)
-        arr.append(ord('<'))  # use little endian
-        nd_bytes = nd.newbyteorder('<').tobytes("C")
-        arr.extend(set_int(len(nd_bytes)))
-        arr.extend(nd_bytes)  # make it big endian
-    return arr
+        if type(nd) is not np.ndarray:
+            nd = np.asarray(nd)
+        if nd.dtype.byteorder == ">":
+            nd = nd.astype(nd.dtype.newbyteorder("<"))  # use little endian
+        if not nd.flags.c_contiguous:
+            nd = nd.copy(order="C")
+        dtype = _DTYPE_NAMES.get(nd.dtype)
+        if dtype is None:
+            dtype = str(nd.dtype).upper().encode("utf8")
+            _DTYPE_NAMES[nd.dtype] = dtype
+        header = _header_struct(len(dtype), nd.ndim)
+        arrays.append((nd, dtype, header))
+        header_size += _ND_PREFIX_SIZE + header.size
+
+    header_buf = bytearray(header_size)
+    header_view = memoryview(header_buf)
+    struct.pack_into(">i", header_buf, 0, len(arrays))
+    idx = 4
+    start = 0
+    buffers = []
+    for nd, dtype, header in arrays:
+        if nd.size > 0:
+            data = memoryview(nd).cast("B")
+        else:
+            data = memoryview(b"")
+        ndim = nd.ndim
+        header_buf[idx:idx + _ND_PREFIX_SIZE] = _ND_PREFIX
+        idx += _ND_PREFIX_SIZE
+        header.pack_into(header_buf, idx, len(dtype), dtype, ndim, *nd.shape,
+                         ndim, *_LAYOUT_CHARS[:ndim], 60, data.nbytes)
+        idx += header.size
+        buffers.append(header_view[start:idx])
+        buffers.append(data)
+        start = idx
+    if start == 0:
+        buffers.append(header_view)
+    return buffers
+
+
+# magic number, version, no name flag and the "default" sparse format
+_ND_PREFIX = struct.pack(">h4sibh7s", len(MAGIC_NUMBER),
+                         MAGIC_NUMBER.encode("utf8"), VERSION, 0, 7,
+                         b"default")
+_ND_PREFIX_SIZE = len(_ND_PREFIX)
+_DTYPE_NAMES = {}
+_DTYPES = {}
+_LAYOUT_CHARS = (ord("?"), ) * 64
+
+
+@functools.lru_cache(maxsize=None)
+def _header_struct(dtype_len: int, ndim: int) -> struct.Struct:
+    # datatype, shape, layout, byte order and data length
+    return struct.Struct(f">h{dtype_len}si{ndim}qi{ndim}hBi")
+
+
+def _unpack_str(view: memoryview, idx: int) -> tuple:
+    length = struct.unpack_from(">h", view, idx)[0]
+    idx += 2
+    return str(view[idx:idx + length], "utf8"), idx + length
 
 
 def _shape_encode(shape: tuple, arr: bytearray):
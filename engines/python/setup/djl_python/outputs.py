@@ -12,36 +12,59 @@
 # the specific language governing permissions and limitations under the License.
 
 import json
+import queue
 import struct
 import logging
+import threading
+import time
 
 from .np_util import to_nd_list
+from . import json_util, request_timing, shm_util
 from .pair_list import PairList
 
+DEFAULT_COALESCE_MAX_BYTES = 64 * 1024
+DEFAULT_COALESCE_MAX_DELAY = 0.002
+# chunks generated ahead of a coalesced stream that is not sent fast enough
+COALESCE_QUEUE_SIZE = 256
 
-# https://github.com/automl/SMAC3/issues/453
-class _JSONEncoder(json.JSONEncoder):
+# Upper bound of buffers passed to a single sendmsg call, IOV_MAX is 1024 on
+# most platforms.
+MAX_IOV_PER_SEND = 512
+
+
+def _as_byte_view(buf) -> memoryview:
     """
-    custom `JSONEncoder` to make sure float and int64 ar converted
+    Returns a flat byte view of a buffer object without copying it when possible.
     """
+    view = memoryview(buf)
+    if view.format == "B" and view.ndim == 1:
+        return view
+    if view.c_contiguous:
+        return view.cast("B")
+    return memoryview(view.tobytes())
 
-    def default(self, obj):
-        import datetime
-        if isinstance(obj, datetime.datetime):
-            return obj.__str__()
 
-        try:
-            import numpy as np
-            if isinstance(obj, np.integer):
-                return int(obj)
-            elif isinstance(obj, np.floating):
-                return float(obj)
-            elif isinstance(obj, np.ndarray):
-                return obj.tolist()
-        except ImportError:
-            pass
+def send_buffers(cl_socket, buffers: list):
+    """
+    Sends a list of buffers with vectored writes, handling partial writes.
 
-        return super(_JSONEncoder, self).default(obj)
+    :param cl_socket: socket connection
+    :param buffers: list of bytes-like objects
+    """
+    views = [_as_byte_view(b) for b in buffers]
+    if not hasattr(cl_socket, "sendmsg"):
+        for view in views:
+            cl_socket.sendall(view)
+        return
+
+    index = 0
+    while index < len(views):
+        sent = cl_socket.sendmsg(views[index:index + MAX_IOV_PER_SEND])
+        while index < len(views) and sent >= views[index].nbytes:
+            sent -= views[index].nbytes
+            index += 1
+        if sent > 0:
+            views[index] = views[index][sent:]
 
 
 class Output(object):
@@ -55,6 +78,10 @@ class Output(object):
         self.finalize_function = None
         self.finalize_args = None
         self.stream_output_formatter = None
+        self.coalesce_max_bytes = None
+        self.coalesce_max_delay = None
+        self.stream_chunks = 0
+        self.stream_frames = 0
 
     def __str__(self):
         d = dict()
@@ -103,18 +130,28 @@ class Output(object):
             self.content.add(key=key, value=value.encode("utf-8"))
         elif type(value) is bytearray:
             self.content.add(key=key, value=value)
-        elif type(value) is bytes:
-            self.content.add(key=key, value=bytearray(value))
+        elif type(value) is bytes or type(value) is memoryview:
+            self.content.add(key=key, value=value)
         else:
             self.content.add(key=key, value=self._encode_json(value))
         return self
 
     def add_as_numpy(self, np_list, key=None, batch_index=None):
+        transport = shm_util.get_transport()
+        if transport is not None and transport.should_use(np_list):
+            return self.add(transport.encode(np_list),
+                            key=key,
+                            batch_index=batch_index)
         return self.add(to_nd_list(np_list), key=key, batch_index=batch_index)
 
     def add_as_npz(self, np_list, key=None, batch_index=None):
         import numpy as np
         import io
+        transport = shm_util.get_transport()
+        if transport is not None and transport.should_use(np_list):
+            return self.add(transport.encode(np_list),
+                            key=key,
+                            batch_index=batch_index)
         memory_file = io.BytesIO()
         np.savez(memory_file, *np_list)
         memory_file.seek(0)
@@ -126,9 +163,7 @@ class Output(object):
                         batch_index=batch_index)
 
     def _default_stream_output_formatter(token_texts):
-        token_texts = {"outputs": token_texts}
-        json_encoded_str = json.dumps(token_texts) + "\n"
-        return bytearray(json_encoded_str.encode("utf-8"))
+        return json_util.dumps({"outputs": token_texts}) + b"\n"
 
     def add_stream_content(self,
                            stream_content,
@@ -137,15 +172,29 @@ class Output(object):
         self.stream_output_formatter = output_formatter
         return self
 
+    def set_stream_coalescing(self,
+                              max_bytes: int = DEFAULT_COALESCE_MAX_BYTES,
+                              max_delay: float = DEFAULT_COALESCE_MAX_DELAY):
+        """
+        Enables merging of consecutive streaming chunks into one frame.
+
+        Chunks that are ready within max_delay seconds of the first pending
+        chunk are sent together, until max_bytes is reached. The order of
+        the streamed content is preserved.
+
+        :param max_bytes: maximum size of a merged frame
+        :param max_delay: maximum seconds a chunk waits before being sent
+        """
+        self.coalesce_max_bytes = max_bytes
+        self.coalesce_max_delay = max_delay
+        return self
+
+    def is_stream_coalescing_enabled(self) -> bool:
+        return self.coalesce_max_delay is not None
+
     @staticmethod
     def _encode_json(val) -> bytes:
-        return bytearray(
-            json.dumps(val,
-                       ensure_ascii=False,
-                       allow_nan=False,
-                       indent=2,
-                       cls=_JSONEncoder,
-                       separators=(",", ":")).encode("utf-8"))
+        return json_util.dumps(val)
 
     @staticmethod
     def binary_encode(data: dict) -> bytes:
@@ -175,6 +224,8 @@ class Output(object):
             return self.finalize_function(*self.finalize_args)
 
     def send(self, cl_socket):
+        timing = request_timing.current()
+        start = time.perf_counter() if timing is not None else None
         msg = bytearray()
         msg += struct.pack('>h', self.code)
         self.write_utf8(msg, self.message)
@@ -187,51 +238,156 @@ class Output(object):
         if self.stream_content is None:
             size = self.content.size()
             msg += struct.pack('>h', size)
+            buffers = []
             for i in range(size):
                 k = self.content.key_at(i)
-                v = self.content.value_at(i)
+                v = _as_byte_view(self.content.value_at(i))
                 self.write_utf8(msg, k)
-                msg += struct.pack('>i', len(v))
-                msg += v
-            cl_socket.sendall(msg)
+                msg += struct.pack('>i', v.nbytes)
+                buffers.append(msg)
+                buffers.append(v)
+                msg = bytearray()
+            if msg:
+                buffers.append(msg)
+            if timing is not None:
+                encoded = time.perf_counter()
+                timing.record("encode", encoded - start)
+            send_buffers(cl_socket, buffers)
+            if timing is not None:
+                timing.record("send", time.perf_counter() - encoded)
             return
 
         msg += struct.pack('>h', -1)
         cl_socket.sendall(msg)
 
+        try:
+            self._send_stream(cl_socket)
+        finally:
+            if timing is not None:
+                # includes generating the streamed content
+                timing.record("stream", time.perf_counter() - start)
+
+    def _send_stream(self, cl_socket):
+        if self.is_stream_coalescing_enabled():
+            self._send_coalesced_stream(cl_socket)
+            return
+
         while True:
             try:
-                data = next(self.stream_content)
-                if self.stream_output_formatter is not None:
-                    data = self.stream_output_formatter(data)
+                data = self._next_stream_data()
+                self._send_stream_frame(cl_socket, [data], len(data))
+            except StopIteration:
+                self._send_stream_end(cl_socket)
+                break
+            except Exception as e:
+                logging.exception("Failed read streaming content from output")
+                self._send_stream_end(cl_socket, str(e))
+                break
 
-                msg = bytearray()
-                msg += b'\1'
-
-                if type(data) is str:
-                    data = data.encode('utf-8')
-                elif type(data) is bytearray:
-                    pass
-                elif type(data) is bytes:
-                    data = bytearray(data)
-                else:
-                    data = bytearray(self._encode_json(data))
+    def _next_stream_data(self):
+        data = next(self.stream_content)
+        if self.stream_output_formatter is not None:
+            data = self.stream_output_formatter(data)
 
-                msg += struct.pack('>i', len(data))
-                msg += data
-                cl_socket.sendall(msg)
+        if type(data) is str:
+            data = data.encode('utf-8')
+        elif type(data) is bytearray or type(data) is bytes:
+            pass
+        elif type(data) is memoryview:
+            data = _as_byte_view(data)
+        else:
+            data = self._encode_json(data)
+        self.stream_chunks += 1
+        return data
+
+    def _send_stream_frame(self, cl_socket, chunks: list, size: int):
+        msg = bytearray()
+        msg += b'\1'
+        msg += struct.pack('>i', size)
+        send_buffers(cl_socket, [msg] + chunks)
+        self.stream_frames += 1
+
+    @staticmethod
+    def _send_stream_end(cl_socket, error: str = None):
+        msg = bytearray()
+        msg += b'\0'
+        if error is None:
+            msg += struct.pack('>i', 0)
+        else:
+            data = error.encode('utf-8')
+            msg += struct.pack('>i', len(data))
+            msg += data
+        cl_socket.sendall(msg)
+
+    def _send_coalesced_stream(self, cl_socket):
+        """
+        Pulls the stream content on a background thread and merges the chunks
+        that become ready within the coalescing delay into one frame.
+        """
+        ready = queue.Queue(maxsize=COALESCE_QUEUE_SIZE)
+        stop = threading.Event()
+        end_of_stream = object()
+
+        def produce():
+            try:
+                while not stop.is_set():
+                    ready.put(self._next_stream_data())
             except StopIteration:
-                msg = bytearray()
-                msg += b'\0'
-                msg += struct.pack('>i', 0)
-                cl_socket.sendall(msg)
-                break
+                ready.put(end_of_stream)
             except Exception as e:
                 logging.exception("Failed read streaming content from output")
-                msg = bytearray()
-                msg += b'\0'
-                data = str(e).encode('utf-8')
-                msg += struct.pack('>i', len(data))
-                msg += data
-                cl_socket.sendall(msg)
+                ready.put(e)
+
+        producer = threading.Thread(target=produce,
+                                    name="djl-stream-producer",
+                                    daemon=True)
+        producer.start()
+        try:
+            self._send_ready_chunks(cl_socket, ready, end_of_stream)
+        finally:
+            # stops generating when sending failed, e.g. the client is gone
+            stop.set()
+            while producer.is_alive():
+                try:
+                    # makes room for a producer waiting on the full queue
+                    ready.get_nowait()
+                except queue.Empty:
+                    producer.join(0.01)
+
+    def _send_ready_chunks(self, cl_socket, ready: queue.Queue, end_of_stream):
+        """
+        Sends the chunks of the producer until the end of the stream.
+        """
+        pending = []
+        pending_size = 0
+        deadline = None
+        while True:
+            try:
+                if pending:
+                    item = ready.get(
+                        timeout=max(0.0, deadline - time.perf_counter()))
+                else:
+                    item = ready.get()
+            except queue.Empty:
+                item = None
+
+            if item is None or item is end_of_stream or isinstance(
+                    item, Exception):
+                if pending:
+                    self._send_stream_frame(cl_socket, pending, pending_size)
+                    pending = []
+                    pending_size = 0
+                if item is None:
+                    continue
+                self._send_stream_end(
+                    cl_socket, None if item is end_of_stream else str(item))
                 break
+
+            if not pending:
+                deadline = time.perf_counter() + self.coalesce_max_delay
+            pending.append(item)
+            pending_size += len(item)
+            if pending_size >= self.coalesce_max_bytes:
+                self._send_stream_frame(cl_socket, pending, pending_size)
+                pending = []
+                pending_size = 0
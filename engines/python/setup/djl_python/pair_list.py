@@ -20,33 +20,58 @@ class PairList(object):
                 raise ValueError("key value size mismatch.")
             self.keys = keys
             self.values = values
-        elif pair_list:
-            for pair in pair_list:
-                self.keys.append(pair[0])
-                self.values.append(pair[1])
-        elif pair_map:
-            for key, value in pair_map.items():
-                self.keys.append(key)
-                self.values.append(value)
         else:
             self.keys = []
             self.values = []
+            if pair_list:
+                for pair in pair_list:
+                    self.keys.append(pair[0])
+                    self.values.append(pair[1])
+            elif pair_map:
+                for key, value in pair_map.items():
+                    self.keys.append(key)
+                    self.values.append(value)
+        self._index = {}
+        self._indexed_size = 0
+        # incremented on every change made through the methods
+        self._version = 0
+        self._rebuild_index()
+
+    def _rebuild_index(self):
+        """
+        Maps each key to the position of its first occurrence.
+        """
+        self._index = {}
+        for i, key in enumerate(self.keys):
+            self._index.setdefault(key, i)
+        self._indexed_size = len(self.keys)
+
+    def _append(self, key, value):
+        if self._indexed_size != len(self.keys):
+            self._rebuild_index()
+        self._index.setdefault(key, len(self.keys))
+        self.keys.append(key)
+        self.values.append(value)
+        self._indexed_size += 1
+        self._version += 1
 
     def add(self, key=None, value=None, index=None, pair=None):
         if index is not None and value is not None:
             self.keys.insert(index, key)
             self.values.insert(index, value)
+            self._rebuild_index()
+            self._version += 1
         elif pair:
-            self.keys.append(pair[0])
-            self.values.append(pair[1])
+            self._append(pair[0], pair[1])
         elif value is not None:  # ignore None value
-            self.keys.append(key)
-            self.values.append(value)
+            self._append(key, value)
 
     def add_all(self, other):
         if other:
-            self.keys.extend(other.keys())
-            self.values.extend(other.values())
+            self.keys.extend(other.get_keys())
+            self.values.extend(other.get_values())
+            self._rebuild_index()
+            self._version += 1
 
     def size(self):
         return len(self.keys)
@@ -55,9 +80,12 @@ class PairList(object):
         return self.size() == 0
 
     def get(self, key):
-        if key not in self.keys:
+        if self._indexed_size != len(self.keys):
+            # keys were modified directly
+            self._rebuild_index()
+        key_index = self._index.get(key)
+        if key_index is None:
             return None
-        key_index = self.keys.index(key)
         return self.values[key_index]
 
     def key_at(self, index: int):
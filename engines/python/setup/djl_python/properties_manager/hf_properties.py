@@ -3,8 +3,6 @@ import os
 from enum import Enum
 from typing import Optional
 
-import torch
-
 from pydantic import field_validator, model_validator
 
 from djl_python.properties_manager.properties import Properties, RollingBatchEnum
@@ -27,6 +25,7 @@ class HFQuantizeMethods(str, Enum):
 def get_torch_dtype_from_str(dtype: str):
     if dtype == "auto":
         return dtype
+    import torch
     if dtype == "fp32":
         return torch.float32
     if dtype == "fp16":
@@ -40,6 +39,11 @@ def get_torch_dtype_from_str(dtype: str):
     raise ValueError(f"Invalid data type: {dtype}")
 
 
+def _cuda_device_count() -> int:
+    import torch
+    return torch.cuda.device_count()
+
+
 class HuggingFaceProperties(Properties):
     device_id: int = -1
     task: str = None
@@ -111,10 +115,10 @@ class HuggingFaceProperties(Properties):
             self.kwargs["device_map"] = self.device_map
             self.device = None
             logging.info(f"Using device map {self.device_map}")
-        elif self.tensor_parallel_degree > 0 and torch.cuda.device_count() > 0:
+        elif self.tensor_parallel_degree > 0 and _cuda_device_count() > 0:
             self.kwargs["device_map"] = "auto"
             self.device = None
-            world_size = torch.cuda.device_count()
+            world_size = _cuda_device_count()
             assert world_size == self.tensor_parallel_degree, \
                 f"TP degree ({self.tensor_parallel_degree}) doesn't match available GPUs ({world_size})"
             logging.info(f"Using {world_size} gpus")
@@ -56,6 +56,14 @@ class Properties(BaseModel):
     revision: Optional[str] = None
     output_formatter: Optional[Union[str, Callable]] = None
     waiting_steps: Optional[int] = None
+    # prompt tokens admitted into a rolling batch per step
+    max_rolling_batch_prefill_tokens: Optional[int] = None
+    # exact match cache of deterministic responses in MB, 0 disables it
+    response_cache_size: int = 0
+    response_cache_ttl: int = 600
+    response_cache_allow_seeded: bool = False
+    # identical deterministic rolling batch requests share one generation
+    coalesce_requests: bool = False
     is_mpi: bool = False
 
     # Spec_dec
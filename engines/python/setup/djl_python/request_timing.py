@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file
+# except in compliance with the License. A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS"
+# BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+"""
+Per request stage timing.
+
+Enabled with OPTION_REQUEST_TIMING=true. The python engine records the read,
+decode, handler, encode, send and finalize stages of every request. Handlers
+and rolling batchers add their own stages with span():
+
+    from djl_python import request_timing
+
+    with request_timing.span("tokenize"):
+        ...
+
+The durations are aggregated into histograms per stage and logged as one
+json line every OPTION_REQUEST_TIMING_LOG_INTERVAL seconds (default 60).
+When disabled, span() returns a shared no-op context manager.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+# histogram bucket i counts durations below 2^i microseconds, up to ~1 hour
+_NUM_BUCKETS = 32
+
+
+class StageHistogram(object):
+    """
+    Log2 bucketed histogram of durations.
+    """
+
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        self.buckets = [0] * _NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        micros = int(seconds * 1e6)
+        self.buckets[min(micros.bit_length(), _NUM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p: float) -> float:
+        """
+        Returns the upper bound of the bucket of the percentile in seconds.
+
+        :param p: percentile between 0 and 100
+        """
+        rank = self.count * p / 100
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n > 0:
+                return min((1 << i) / 1e6, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 3),
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p90_ms": round(self.percentile(90) * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class TimingRegistry(object):
+    """
+    Aggregates the stage durations of all requests and logs them periodically.
+    """
+
+    def __init__(self, log_interval: float):
+        self.log_interval = log_interval
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.last_log = time.monotonic()
+
+    def add(self, stages: dict):
+        with self.lock:
+            for stage, seconds in stages.items():
+                histogram = self.histograms.get(stage)
+                if histogram is None:
+                    histogram = self.histograms[stage] = StageHistogram()
+                histogram.add(seconds)
+        if time.monotonic() - self.last_log >= self.log_interval:
+            self.log_metrics()
+
+    def get_summary(self) -> dict:
+        with self.lock:
+            return {
+                stage: histogram.summary()
+                for stage, histogram in self.histograms.items()
+            }
+
+    def log_metrics(self):
+        """
+        Logs the summary since the last call and resets the histograms.
+        """
+        with self.lock:
+            summary = {
+                stage: histogram.summary()
+                for stage, histogram in self.histograms.items()
+            }
+            self.histograms = {}
+            self.last_log = time.monotonic()
+        if summary:
+            logging.info(f"Request timing: {json.dumps(summary)}")
+
+
+class RequestTiming(object):
+    """
+    Stage durations in seconds of one request.
+    """
+
+    __slots__ = ("stages", "start")
+
+    def __init__(self):
+        self.stages = {}
+        self.start = time.perf_counter()
+
+    def record(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+
+class _Span(object):
+
+    __slots__ = ("timing", "stage", "start")
+
+    def __init__(self, timing: RequestTiming, stage: str):
+        self.timing = timing
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.timing.record(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _NoopSpan(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+_local = threading.local()
+_registry = None
+if os.getenv("OPTION_REQUEST_TIMING", "false").lower() == "true":
+    _registry = TimingRegistry(
+        float(os.getenv("OPTION_REQUEST_TIMING_LOG_INTERVAL", "60")))
+
+
+def is_enabled() -> bool:
+    return _registry is not None
+
+
+def enable(log_interval: float = 60):
+    """
+    Enables timing, e.g. for tests and benchmarks.
+    """
+    global _registry
+    _registry = TimingRegistry(log_interval)
+
+
+def disable():
+    global _registry
+    _registry = None
+
+
+def get_registry():
+    return _registry
+
+
+def new_request():
+    """
+    :return: a RequestTiming, or None if timing is disabled
+    """
+    if _registry is None:
+        return None
+    return RequestTiming()
+
+
+def activate(timing):
+    """
+    Makes the request the target of span() and record() on this thread.
+
+    :param timing: RequestTiming or None
+    """
+    _local.timing = timing
+
+
+def current():
+    """
+    :return: the RequestTiming active on this thread, or None
+    """
+    return getattr(_local, "timing", None)
+
+
+def span(stage: str):
+    """
+    Measures a block of code as a stage of the current request.
+
+    :param stage: stage name, e.g. tokenize, prefill, decode or detokenize
+    :return: context manager
+    """
+    timing = getattr(_local, "timing", None)
+    if timing is None:
+        return _NOOP_SPAN
+    return _Span(timing, stage)
+
+
+def record(stage: str, seconds: float):
+    """
+    Adds a duration to a stage of the current request.
+    """
+    timing = getattr(_local, "timing", None)
+    if timing is not None:
+        timing.record(stage, seconds)
+
+
+def observe(stage: str, seconds: float):
+    """
+    Adds one duration to the histogram of a stage, independent of the
+    current request, e.g. the queueing delay of a rolling batch request.
+    """
+    if _registry is not None:
+        _registry.add({stage: seconds})
+
+
+def finish(timing):
+    """
+    Adds the stages of a finished request to the histograms.
+
+    :param timing: RequestTiming or None
+    """
+    if timing is not None and _registry is not None:
+        timing.stages["total"] = time.perf_counter() - timing.start
+        _registry.add(timing.stages)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file
+# except in compliance with the License. A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS"
+# BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+"""
+Exact match cache of the responses of deterministic generation requests.
+
+Enabled with option.response_cache_size, the memory of the cache in MB.
+Entries expire after option.response_cache_ttl seconds (default 600).
+Greedy requests are cached, sampled requests only with a seed of their own
+and option.response_cache_allow_seeded=true. Whether a request samples is
+decided by the backend, from its own defaults, not from the request alone.
+The hit and miss counters are logged as one json line every 60 seconds.
+
+request_key() also identifies the identical requests that rolling batches
+coalesce with option.coalesce_requests.
+"""
+
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+# the approximate memory of a cache entry, of a cached token and of a value
+# of a json response, the text is added to it
+_ENTRY_BYTES = 256
+_TOKEN_BYTES = 160
+_VALUE_BYTES = 64
+
+
+class CachedResponse(object):
+    """
+    The tokens of a generation, recorded as they are generated and replayed
+    by identical requests.
+    """
+
+    __slots__ = ("tokens", "finished", "finish_reason",
+                 "prompt_tokens_details", "size")
+
+    def __init__(self):
+        self.tokens = []
+        # whether the last token was generated
+        self.finished = False
+        self.finish_reason = None
+        self.prompt_tokens_details = None
+        self.size = _ENTRY_BYTES
+
+    def add_token(self, token_id: list, text: str, log_prob: float,
+                  special_token: bool):
+        self.tokens.append((token_id, text, log_prob, special_token))
+        self.size += _TOKEN_BYTES + len(text)
+
+    def finish(self, finish_reason: str, prompt_tokens_details: list):
+        self.finished = True
+        self.finish_reason = finish_reason
+        self.prompt_tokens_details = prompt_tokens_details
+
+
+def json_response_size(value: Any) -> Optional[int]:
+    """
+    Estimates the memory of a response made of dicts, lists, strings and
+    numbers, like CachedResponse does: the text length plus a constant per
+    value.
+
+    :param value: the response
+    :return: the approximate memory in bytes, None if the response holds
+        other values, e.g. tensors
+    """
+    size = _ENTRY_BYTES
+    pending = [value]
+    while pending:
+        value = pending.pop()
+        size += _VALUE_BYTES
+        if type(value) is str:
+            size += len(value)
+        elif type(value) is dict:
+            for key, item in value.items():
+                if type(key) is not str:
+                    return None
+                size += len(key)
+                pending.append(item)
+        elif type(value) is list:
+            pending.extend(value)
+        elif value is not None and type(value) not in (bool, int, float):
+            return None
+    return size
+
+
+def request_key(prompt: Any,
+                parameters: dict,
+                sampling: bool,
+                adapter: Any = None,
+                namespace: str = None,
+                allow_seeded: bool = False) -> Optional[bytes]:
+    """
+    Builds the key of the response of a deterministic request.
+
+    :param prompt: the prompt, as is
+    :param parameters: the generation parameters
+    :param sampling: whether the backend samples the tokens of the request,
+        including when sampling is its default
+    :param adapter: the name of the adapter, if any
+    :param namespace: the model and revision
+    :param allow_seeded: whether sampled requests with a seed are
+        deterministic
+    :return: the key, None if the request is not deterministic
+    """
+    if sampling:
+        if not allow_seeded or parameters.get("seed") is None:
+            return None
+    elif "seed" in parameters:
+        # the frontend assigns a random seed to every request, greedy
+        # decoding doesn't use it
+        parameters = {k: v for k, v in parameters.items() if k != "seed"}
+    try:
+        text = json.dumps([namespace, adapter, prompt, parameters],
+                          sort_keys=True,
+                          ensure_ascii=False)
+    except (TypeError, ValueError):
+        # parameters that can't be compared, for example objects
+        return None
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class ResponseCache(object):
+    """
+    Memory bounded LRU cache with expiry, keyed by the model, adapter, prompt
+    and generation parameters of a request. Used by the thread running the
+    inference, it is not thread safe.
+    """
+
+    def __init__(self,
+                 max_bytes: int,
+                 ttl: float,
+                 allow_seeded: bool = False,
+                 namespace: str = None,
+                 log_interval: float = 60):
+        """
+        :param max_bytes: the approximate memory of the cached responses
+        :param ttl: seconds a response is cached
+        :param allow_seeded: whether to cache sampled requests with a seed
+        :param namespace: the model and revision, part of every key
+        :param log_interval: seconds between the logs of the counters
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.allow_seeded = allow_seeded
+        self.namespace = namespace
+        self.log_interval = log_interval
+        self._entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._last_log = time.monotonic()
+
+    def key(self,
+            prompt: Any,
+            parameters: dict,
+            sampling: bool,
+            adapter: Any = None):
+        """
+        :return: the cache key of a request, see request_key
+        """
+        return request_key(prompt, parameters, sampling, adapter,
+                           self.namespace, self.allow_seeded)
+
+    def get(self, key) -> Optional[Any]:
+        """
+        :param key: the key from key()
+        :return: the cached response, None if there is none
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+        else:
+            self._entries.move_to_end(key)
+            self.hits += 1
+        self._maybe_log()
+        return None if entry is None else entry[2]
+
+    def put(self, key, value: Any, size: int):
+        """
+        Caches a response, evicting the least recently used ones when the
+        cache is full.
+
+        :param key: the key from key()
+        :param value: the response
+        :param size: the approximate memory of the response in bytes
+        """
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, value)
+        self.size += size
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        self.size -= self._entries.pop(key)[1]
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "size_bytes": self.size,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _maybe_log(self):
+        now = time.monotonic()
+        if now - self._last_log >= self.log_interval:
+            self._last_log = now
+            logging.info(f"Response cache: {json.dumps(self.stats())}")
+
+
+def create_response_cache(properties) -> Optional[ResponseCache]:
+    """
+    :param properties: the Properties of the model
+    :return: the response cache, None if it is disabled
+    """
+    if not properties.response_cache_size:
+        return None
+    logging.info(
+        f"Response cache of {properties.response_cache_size} MB, ttl "
+        f"{properties.response_cache_ttl} seconds, seeded sampling cached: "
+        f"{properties.response_cache_allow_seeded}")
+    return ResponseCache(
+        properties.response_cache_size * 1024 * 1024,
+        properties.response_cache_ttl,
+        allow_seeded=properties.response_cache_allow_seeded,
+        namespace=f"{properties.model_id_or_path}@{properties.revision}")
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file
+# except in compliance with the License. A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS"
+# BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+import logging
+import time
+
+from djl_python import request_timing
+
+# requests that were deferred this many steps are admitted first
+DEFAULT_MAX_WAIT_STEPS = 16
+
+
+class PrefillAdmissionController(object):
+    """
+    Limits the number of prompt tokens that are prefilled in one step.
+
+    A burst of long prompts would otherwise stall the decoding of every
+    running request for one long prefill step. Requests that don't fit into
+    the budget stay pending and are considered again in the next step. When
+    the budget is exceeded the shortest prompts are admitted first, requests
+    that waited max_wait_steps are admitted before them regardless of their
+    length.
+    """
+
+    def __init__(self,
+                 max_prefill_tokens: int,
+                 max_wait_steps: int = DEFAULT_MAX_WAIT_STEPS):
+        """
+        :param max_prefill_tokens: prompt tokens admitted per step
+        :param max_wait_steps: steps after which a deferred request is
+            admitted first
+        """
+        self.max_prefill_tokens = max_prefill_tokens
+        self.max_wait_steps = max_wait_steps
+
+    def admit(self, pending: list, num_active: int) -> tuple:
+        """
+        Selects the pending requests to prefill in this step.
+
+        :param pending: pending requests in arrival order, with input_ids
+        :param num_active: number of requests already in the batch
+        :return: the admitted and the remaining requests, both in arrival order
+        """
+        budget = self.max_prefill_tokens
+        if sum(len(request.input_ids) for request in pending) <= budget:
+            admitted = pending
+            remaining = []
+        else:
+            starving = [
+                request for request in pending
+                if request.queued_steps >= self.max_wait_steps
+            ]
+            waiting = sorted((request for request in pending
+                              if request.queued_steps < self.max_wait_steps),
+                             key=lambda r: (len(r.input_ids), r.id))
+            selected = set()
+            for request in starving + waiting:
+                tokens = len(request.input_ids)
+                # a prompt longer than the budget runs alone, when it starves
+                # or nothing else would run
+                runs_alone = not selected and (num_active == 0
+                                               or request.queued_steps
+                                               >= self.max_wait_steps)
+                if tokens <= budget or runs_alone:
+                    selected.add(request.id)
+                    budget -= tokens
+                if budget <= 0:
+                    break
+            admitted = [r for r in pending if r.id in selected]
+            remaining = [r for r in pending if r.id not in selected]
+            for request in remaining:
+                request.queued_steps += 1
+            logging.debug(
+                f"Prefill budget {self.max_prefill_tokens} tokens: admitted "
+                f"{len(admitted)} requests, deferred {len(remaining)}")
+
+        now = time.perf_counter()
+        for request in admitted:
+            request_timing.observe("queue", now - request.arrival_time)
+        return admitted, remaining
@@ -19,6 +19,8 @@ from lmi_dist.init_engine import engine_from_args
 from vllm.lora.request import LoRARequest
 from vllm import SamplingParams
 
+from djl_python.response_cache import create_response_cache
+from djl_python.vocabulary import VocabularyTable
 from djl_python.rolling_batch.rolling_batch import RollingBatch, stop_on_any_exception, Token, filter_unused_generation_params
 from djl_python.rolling_batch.rolling_batch_vllm_utils import (
     get_speculative_decoding_metrics_record, update_request_cache_with_output,
@@ -38,6 +40,8 @@ class LmiDistRollingBatch(RollingBatch):
     It also gets any new tokens from the backend and sends them back to the handler.
     """
 
+    native_stop_sequences = True
+
     def __init__(self, model_id_or_path: str, properties: dict, **kwargs):
         """
         Initializes the LmiDistRollingBatch.
@@ -48,7 +52,9 @@ class LmiDistRollingBatch(RollingBatch):
         self.lmi_dist_config = LmiDistRbProperties(**properties)
         super().__init__(
             waiting_steps=self.lmi_dist_config.waiting_steps,
-            output_formatter=self.lmi_dist_config.output_formatter)
+            output_formatter=self.lmi_dist_config.output_formatter,
+            response_cache=create_response_cache(self.lmi_dist_config),
+            coalesce_requests=self.lmi_dist_config.coalesce_requests)
         self.supports_speculative_decoding = supports_speculative_decoding()
         engine_kwargs = {}
         if self.supports_speculative_decoding:
@@ -83,6 +89,7 @@ class LmiDistRollingBatch(RollingBatch):
         if self.lmi_dist_config.max_rolling_batch_prefill_tokens is None:
             kwargs["warmup_prefill_tokens"] = _WARMUP_PREFILL_TOKENS
         self.engine = engine_from_args(engine_args, **kwargs)
+        self.vocabulary = VocabularyTable(self.get_tokenizer())
         self.request_cache = OrderedDict()
         self.model_type = getattr(kwargs.get("model_config", None),
                                   "model_type", None)
@@ -99,6 +106,24 @@ class LmiDistRollingBatch(RollingBatch):
     def get_tokenizer(self):
         return self.engine.preprocessor.tokenizer.tokenizer
 
+    def abort_requests(self, requests: list) -> None:
+        """
+        Aborts the cancelled requests in the engine, which frees their KV cache
+        """
+        slots = {request.slot for request in requests}
+        for key in [
+                key for key, cache in self.request_cache.items()
+                if cache["slot"] in slots
+        ]:
+            self.engine.abort_request(key)
+            self.request_cache.pop(key)
+
+    def _fail_cached_request(self, request_id: str, error: Exception):
+        cache = self.request_cache.get(request_id)
+        if cache is None:
+            raise error
+        self.fail_request(self.request_table.get(cache["slot"]), error)
+
     def translate_lmi_dist_params(self, parameters: dict):
         """
         Helper function to convert DJL Serving parameter names to parameter names
@@ -155,18 +180,23 @@ class LmiDistRollingBatch(RollingBatch):
         # step 0: register new requests to engine
         for request in new_requests:
             request_id = str(request.id)
-            params = self.translate_lmi_dist_params(request.parameters)
-            request_params = RequestParams(**params)
-            lora_request_params = get_lora_request_params(
-                request, self.lora_ids)
-            lmi_dist_request = Request(
-                id=request_id,
-                prompt=request.input_text,
-                params=request_params,
-                lora_request=lora_request_params["lora_request"]
-                if lora_request_params else None)
-            self.engine.add_request(lmi_dist_request)
+            try:
+                params = self.translate_lmi_dist_params(request.parameters)
+                request_params = RequestParams(**params)
+                lora_request_params = get_lora_request_params(
+                    request, self.lora_ids)
+                lmi_dist_request = Request(
+                    id=request_id,
+                    prompt=request.input_text,
+                    params=request_params,
+                    lora_request=lora_request_params["lora_request"]
+                    if lora_request_params else None)
+                self.engine.add_request(lmi_dist_request)
+            except Exception as e:
+                self.fail_request(request, e)
+                continue
             self.request_cache[request_id] = {
+                "slot": request.slot,
                 "curr_length": 0,
                 "text": "",
                 "cumulative_logprob": 0.0,
@@ -178,8 +208,12 @@ class LmiDistRollingBatch(RollingBatch):
 
         # step 1: put result to cache
         for request_output in request_outputs:
-            self.request_cache = update_request_cache_with_output(
-                self.request_cache, request_output, self.get_tokenizer())
+            try:
+                self.request_cache = update_request_cache_with_output(
+                    self.request_cache, request_output, self.vocabulary)
+            except Exception as e:
+                self._fail_cached_request(request_output.request_id, e)
+                continue
             # Record SD metrics
             completion_output = request_output.outputs[0]
             if self.lmi_dist_config.record_acceptance_rate and request_output.finished:
@@ -193,8 +227,8 @@ class LmiDistRollingBatch(RollingBatch):
 
         # step 2: send result back
         finished_id = []
-        for (key, cache), request in zip(self.request_cache.items(),
-                                         self.active_requests):
+        for key, cache in self.request_cache.items():
+            request = self.request_table.get(cache["slot"])
             finish_reason = None
             prompt_tokens_details = None
             if cache["finished"]:
@@ -40,6 +40,7 @@ class NeuronRollingBatch(RollingBatch):
         super().__init__(**kwargs)
         self.scheduler = self._scheduler_class(model, tokenizer, batch_size,
                                                n_positions)
+        self.vocabulary = self.scheduler.vocabulary
 
     def reset(self) -> None:
         """
@@ -48,6 +49,15 @@ class NeuronRollingBatch(RollingBatch):
         self.scheduler.clear()
         super().reset()
 
+    def abort_requests(self, requests: list) -> None:
+        """
+        Clears the scheduler slots of the cancelled requests.
+        """
+        self.scheduler.filter([
+            request.id for request in self.request_table
+            if not request.last_token
+        ])
+
     def get_tokenizer(self):
         return self.scheduler.tokenizer
 
@@ -72,14 +82,20 @@ class NeuronRollingBatch(RollingBatch):
                                              batch_size)
         if len(new_requests) > 0:
             generations = self.scheduler.prefill(new_requests)
-        else:
+        elif any(not request.last_token for request in self.request_table):
             generations = self.scheduler.decode()
+        else:
+            # all requests were cancelled
+            generations = []
         generation_dict = {
             generation.request_id: generation
             for generation in generations
         }
         req_ids = []
-        for request in self.active_requests:
+        for request in self.request_table:
+            if request.last_token:
+                # cancelled before this step
+                continue
             generation = generation_dict.get(request.id, None)
             if generation:
                 is_last_token = False
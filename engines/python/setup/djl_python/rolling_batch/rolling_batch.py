@@ -10,15 +10,26 @@
 # or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS"
 # BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
 # the specific language governing permissions and limitations under the License.
+import bisect
+import heapq
 import json
 import logging
+import math
 import os
 import time
 from abc import ABC, abstractmethod
+from json.encoder import encode_basestring
 from typing import List, Union, List, Callable, Optional
 
+from djl_python import request_timing
+from djl_python.response_cache import CachedResponse, request_key
+from djl_python.rolling_batch.admission_controller import PrefillAdmissionController
+from djl_python.stop_sequence_matcher import get_stop_sequence_matcher
+
 FINISH_REASON_MAPPER = ["length", "eos_token", "stop_sequence"]
 TGI_COMPAT = False
+# details key of the tokens already encoded by the built-in formatters
+TOKEN_FRAGMENTS = "token_fragments"
 
 
 class Token(object):
@@ -26,6 +37,9 @@ class Token(object):
         This class represents the token that comes to the output.
     """
 
+    __slots__ = ("id", "text", "log_prob", "special_token", "request_id",
+                 "token_bytes")
+
     def __init__(self,
                  id: List[int],
                  text: str,
@@ -44,18 +58,94 @@ class Token(object):
         self.log_prob = log_prob
         self.special_token = special_token
         self.request_id = None
+        # the UTF-8 bytes of the token, from the vocabulary of the backend
+        self.token_bytes = None
 
     def as_dict(self):
-        output = {}
-        if self.id:
-            output["id"] = self.id
-        if self.text:
-            output["text"] = self.text
-        if self.log_prob:
-            output["log_prob"] = self.log_prob
-        if self.special_token:
-            output["special_token"] = self.special_token
-        return output
+        return _token_dict(self.id, self.text, self.log_prob,
+                           self.special_token)
+
+
+def _token_dict(id: List[int], text: str, log_prob: float,
+                special_token: bool) -> dict:
+    output = {}
+    if id:
+        output["id"] = id
+    if text:
+        output["text"] = text
+    if log_prob:
+        output["log_prob"] = log_prob
+    if special_token:
+        output["special_token"] = special_token
+    return output
+
+
+# The formatters below write their json with string templates, byte for byte
+# what json.dumps(..., ensure_ascii=False) produces for the same objects. Only
+# the new token text is escaped per token; details of every token are encoded
+# once, when the token arrives (see Request.token_fragments).
+_dumps = json.JSONEncoder(ensure_ascii=False).encode
+_escape = encode_basestring
+
+
+def _number(value) -> str:
+    """
+    json of a number, skips the encoder for plain ints and finite floats.
+    """
+    if type(value) is int:
+        return int.__repr__(value)
+    if type(value) is float and math.isfinite(value):
+        return float.__repr__(value)
+    return _dumps(value)
+
+
+def _bytes_json(token: Token) -> str:
+    """
+    :return: the bytes list of the chat logprobs of the token
+    """
+    if not token.text:
+        return "null"
+    data = token.token_bytes
+    if data is None:
+        data = token.text.encode("utf-8")
+    return str(list(data))
+
+
+def _token_json(token: Token) -> str:
+    """
+    :return: token.as_dict() encoded as json
+    """
+    parts = []
+    if token.id:
+        parts.append(f"\"id\": [{', '.join(map(_number, token.id))}]")
+    if token.text:
+        parts.append(f"\"text\": {_escape(token.text)}")
+    if token.log_prob:
+        parts.append(f"\"log_prob\": {_number(token.log_prob)}")
+    if token.special_token:
+        parts.append(f"\"special_token\": {_dumps(token.special_token)}")
+    return f"{{{', '.join(parts)}}}"
+
+
+def _chat_logprob_json(token: Token) -> str:
+    """
+    :return: the chat completions logprobs entry of the token encoded as json
+    """
+    # Currently only support 1 top_logprobs
+    text = _escape(token.text) if token.text else "null"
+    log_prob = _number(token.log_prob) if token.log_prob else "null"
+    b = _bytes_json(token)
+    return (
+        f"{{\"token\": {text}, \"logprob\": {log_prob}, \"bytes\": {b}, "
+        f"\"top_logprobs\": [{{\"token\": {text}, \"logprob\": {log_prob}, "
+        f"\"bytes\": {b}}}]}}")
+
+
+def _tokens_json(details: dict) -> str:
+    fragments = details.get(TOKEN_FRAGMENTS)
+    if fragments is None:
+        return _dumps(details.get("tokens", None))
+    return f"[{', '.join(fragments)}]"
 
 
 def _json_output_formatter(token: Token, first_token: bool, last_token: bool,
@@ -68,21 +158,17 @@ def _json_output_formatter(token: Token, first_token: bool, last_token: bool,
     json_encoded_str = f"{{\"generated_text\": \"{generated_text}" if first_token else ""
     if first_token and TGI_COMPAT:
         json_encoded_str = f"[{json_encoded_str}"
-    json_encoded_str = f"{json_encoded_str}{json.dumps(token.text, ensure_ascii=False)[1:-1]}"
+    json_encoded_str = f"{json_encoded_str}{_escape(token.text)[1:-1]}"
     if last_token:
         if details:
-            final_dict = {
-                "finish_reason": details.get("finish_reason", None),
-                "generated_tokens": details.get("generated_tokens", None),
-                "inputs": details.get("inputs", None),
-                "tokens": details.get("tokens", None),
-            }
-
+            details_str = (
+                f"{{\"finish_reason\": {_dumps(details.get('finish_reason', None))}, "
+                f"\"generated_tokens\": {_dumps(details.get('generated_tokens', None))}, "
+                f"\"inputs\": {_dumps(details.get('inputs', None))}, "
+                f"\"tokens\": {_tokens_json(details)}")
             if "prompt_tokens_details" in details:
-                final_dict["prefill"] = details.get("prompt_tokens_details")
-
-            details_str = f"\"details\": {json.dumps(final_dict, ensure_ascii=False)}"
-            json_encoded_str = f"{json_encoded_str}\", {details_str}}}"
+                details_str = f"{details_str}, \"prefill\": {_dumps(details.get('prompt_tokens_details'))}"
+            json_encoded_str = f"{json_encoded_str}\", \"details\": {details_str}}}}}"
         else:
             json_encoded_str = f"{json_encoded_str}\"}}"
         if TGI_COMPAT:
@@ -99,21 +185,18 @@ def _jsonlines_output_formatter(token: Token, first_token: bool,
 
     :return: formatted output
     """
-    token_dict = token.as_dict()
-    final_dict = {"token": token_dict}
+    json_encoded_str = f"{{\"token\": {_token_json(token)}"
     if last_token:
-        final_dict["generated_text"] = generated_text
+        json_encoded_str = f"{json_encoded_str}, \"generated_text\": {_dumps(generated_text)}"
         if details:
-            final_dict["details"] = {
-                "finish_reason": details.get("finish_reason", None),
-                "generated_tokens": details.get("generated_tokens", None),
-                "inputs": details.get("inputs", None),
-            }
+            details_str = (
+                f"{{\"finish_reason\": {_dumps(details.get('finish_reason', None))}, "
+                f"\"generated_tokens\": {_dumps(details.get('generated_tokens', None))}, "
+                f"\"inputs\": {_dumps(details.get('inputs', None))}")
             if "prompt_tokens_details" in details:
-                final_dict["details"]["prefill"] = details.get(
-                    "prompt_tokens_details")
-    json_encoded_str = json.dumps(final_dict, ensure_ascii=False) + "\n"
-    return json_encoded_str
+                details_str = f"{details_str}, \"prefill\": {_dumps(details.get('prompt_tokens_details'))}"
+            json_encoded_str = f"{json_encoded_str}, \"details\": {details_str}}}"
+    return f"{json_encoded_str}}}\n"
 
 
 def _json_chat_output_formatter(token: Token, first_token: bool,
@@ -124,59 +207,36 @@ def _json_chat_output_formatter(token: Token, first_token: bool,
 
     :return: formatted output
     """
-    created = int(time.time())
-    choice1 = {
-        "index": 0,
-        "message": {
-            "role": "assistant",
-            "content": generated_text
-        }
-    }
-    response1 = {
-        "id": f"chatcmpl-{id}",
-        "object": "chat.completion",
-        "created": created,
-        "choices": [choice1]  # Currently only support 1 choice
-    }
-    json_encoded_str = f"{json.dumps(response1, ensure_ascii=False)[:-5]}" if first_token else ""
-    json_encoded_str = f"{json_encoded_str}{json.dumps(token.text, ensure_ascii=False)[1:-1]}"
+    # Currently only support 1 choice
+    json_encoded_str = ""
+    if first_token:
+        created = int(time.time())
+        json_encoded_str = (
+            f"{{\"id\": {_escape(f'chatcmpl-{id}')}, \"object\": \"chat.completion\", "
+            f"\"created\": {created}, \"choices\": [{{\"index\": 0, \"message\": "
+            f"{{\"role\": \"assistant\", \"content\": {_dumps(generated_text)[:-1]}"
+        )
+    json_encoded_str = f"{json_encoded_str}{_escape(token.text)[1:-1]}"
     if last_token:
-        logprobs = None
+        logprobs = "null"
         parameters = details.get("parameters", {})
         if parameters.get("logprobs"):
-            logprobs = {
-                "content": [{
-                    "token":
-                        t.get("text"),
-                    "logprob":
-                        t.get("log_prob"),
-                    "bytes":
-                        (b := [ord(c)
-                               for c in t.get("text")] if t.get("text") else None),
-                    "top_logprobs":  # Currently only support 1 top_logprobs
-                        [{
-                            "token": t.get("text"),
-                            "logprob": t.get("log_prob"),
-                            "bytes": b
-                        }]
-                } for t in details.get("tokens", [])
+            fragments = details.get(TOKEN_FRAGMENTS)
+            if fragments is None:
+                fragments = [
+                    _chat_logprob_json(
+                        Token(None, t.get("text"), t.get("log_prob")))
+                    for t in details.get("tokens", [])
                 ]
-            }
-        choice2 = {
-            "logprobs": logprobs,
-            "finish_reason": details.get("finish_reason")
-        }
+            logprobs = f"{{\"content\": [{', '.join(fragments)}]}}"
         prompt_tokens = int(details.get("prompt_tokens", 0))
         completion_tokens = int(details.get("generated_tokens", 0))
-        response2 = {
-            "choices": [choice2],
-            "usage": {
-                "prompt_tokens": prompt_tokens,
-                "completion_tokens": completion_tokens,
-                "total_tokens": (prompt_tokens + completion_tokens)
-            }
-        }
-        json_encoded_str = f"{json_encoded_str}\"}}, {json.dumps(response2, ensure_ascii=False)[14:]}"
+        json_encoded_str = (
+            f"{json_encoded_str}\"}}, \"logprobs\": {logprobs}, "
+            f"\"finish_reason\": {_dumps(details.get('finish_reason'))}}}], "
+            f"\"usage\": {{\"prompt_tokens\": {prompt_tokens}, "
+            f"\"completion_tokens\": {completion_tokens}, "
+            f"\"total_tokens\": {prompt_tokens + completion_tokens}}}}}")
     return json_encoded_str
 
 
@@ -189,41 +249,23 @@ def _jsonlines_chat_output_formatter(token: Token, first_token: bool,
     :return: formatted output
     """
     created = int(time.time())
-    delta = {"content": token.text}
-    if first_token:
-        delta["role"] = "assistant"
+    role = ", \"role\": \"assistant\"" if first_token else ""
 
-    logprobs = None
+    logprobs = "null"
     parameters = details.get("parameters", {})
     if parameters.get("logprobs"):
-        logprobs = {
-            "content":
-                [{
-                    "token": token.text,
-                    "logprob": token.log_prob,
-                    "bytes": (b := [ord(c) for c in token.text] if token.text else None),
-                    "top_logprobs":  # Currently only support 1 top_logprobs
-                        [{
-                            "token": token.log_prob,
-                            "logprob": token.log_prob,
-                            "bytes": b
-                        }]
-                }]
-        },
-    choice = {
-        "index": 0,
-        "delta": delta,
-        "logprobs": logprobs,
-        "finish_reason": details.get("finish_reason")
-    }
-    response = {
-        "id": f"chatcmpl-{id}",
-        "object": "chat.completion.chunk",
-        "created": created,
-        "choices": [choice]  # Currently only support 1 choice
-    }
-    json_encoded_str = json.dumps(response, ensure_ascii=False) + "\n"
-    return json_encoded_str
+        log_prob = _number(token.log_prob)
+        b = _bytes_json(token)
+        logprobs = (
+            f"[{{\"content\": [{{\"token\": {_dumps(token.text)}, "
+            f"\"logprob\": {log_prob}, \"bytes\": {b}, \"top_logprobs\": "
+            f"[{{\"token\": {log_prob}, \"logprob\": {log_prob}, \"bytes\": {b}}}]}}]}}]"
+        )
+    return (
+        f"{{\"id\": {_escape(f'chatcmpl-{id}')}, \"object\": \"chat.completion.chunk\", "
+        f"\"created\": {created}, \"choices\": [{{\"index\": 0, \"delta\": "
+        f"{{\"content\": {_dumps(token.text)}{role}}}, \"logprobs\": {logprobs}, "
+        f"\"finish_reason\": {_dumps(details.get('finish_reason'))}}}]}}\n")
 
 
 def get_content_type_from_output_formatter(output_formatter: Union[str,
@@ -256,6 +298,21 @@ def get_output_formatter(output_formatter: Union[str, Callable], stream: bool):
     return _json_output_formatter
 
 
+_LAST_TOKEN_DETAILS_FORMATTERS = frozenset(
+    (_json_output_formatter, _jsonlines_output_formatter,
+     _json_chat_output_formatter))
+_BUILTIN_FORMATTERS = _LAST_TOKEN_DETAILS_FORMATTERS | {
+    _jsonlines_chat_output_formatter
+}
+_CHAT_FORMATTERS = frozenset(
+    (_json_chat_output_formatter, _jsonlines_chat_output_formatter))
+# built-in formatters that write the details of every token on the last one
+_TOKEN_FRAGMENT_WRITERS = {
+    _json_output_formatter: _token_json,
+    _json_chat_output_formatter: _chat_logprob_json,
+}
+
+
 def filter_unused_generation_params(parameters: dict,
                                     allowed_params: set,
                                     backend: str,
@@ -281,6 +338,17 @@ class Request(object):
 
     """
 
+    __slots__ = ("id", "input_text", "parameters", "original_params",
+                 "details", "adapter", "input_ids", "next_token_str",
+                 "first_token", "last_token", "generated_tokens", "token_ids",
+                 "token_log_probs", "token_special_flags", "_token_dicts",
+                 "token_fragments", "_token_fragment_writer",
+                 "decoder_input_details", "full_text_prefix",
+                 "step_token_number", "output_formatter", "slot",
+                 "arrival_time", "queued_steps", "error", "stop_matcher",
+                 "stop_state", "stopped", "cache_key", "cached_response",
+                 "leader", "followers", "skip_tokens", "vocabulary")
+
     def __init__(
         self,
         id: int,
@@ -313,24 +381,121 @@ class Request(object):
         self.next_token_str = ""
         self.first_token = True
         self.last_token = False
-        self.token_cache = None
+        # texts of the generated tokens, with details also the ids, log
+        # probabilities and special token flags as parallel lists
         self.generated_tokens = []
+        self.token_ids = None
+        self.token_log_probs = None
+        self.token_special_flags = None
+        self._token_dicts = None
         self.decoder_input_details = parameters.get("decoder_input_details",
                                                     False)
         if self.details:
-            self.token_cache = []
+            self.token_ids = []
+            self.token_log_probs = []
+            self.token_special_flags = []
         self.full_text_prefix = input_text if parameters.pop(
             "return_full_text", False) else ""
         # spec_dec
         self.step_token_number = 0
+        # assigned by the RequestTable when the request becomes active
+        self.slot = None
+        self.arrival_time = time.perf_counter()
+        # steps the request was held back by admission control
+        self.queued_steps = 0
+        # set when the request failed on its own, see RollingBatch.fail_request
+        self.error = None
+        # text level stop sequences, for backends that don't support them
+        self.stop_matcher = None
+        self.stop_state = 0
+        # finished by a stop sequence, the backend may still run it
+        self.stopped = False
+        # the response recorded for the response cache and the followers
+        self.cache_key = None
+        self.cached_response = None
+        # coalesced requests, see RollingBatch._follow
+        self.leader = None
+        self.followers = None
+        # tokens already sent to a follower that became the leader
+        self.skip_tokens = 0
+        # looks up the bytes of the tokens, see use_vocabulary
+        self.vocabulary = None
 
         # output formatter
         stream = parameters.pop("stream", False)
         self.output_formatter = get_output_formatter(output_formatter, stream)
+        # json of each token, encoded as it arrives for the built-in formatters
+        self.token_fragments = None
+        self._token_fragment_writer = None
+        if self.details:
+            writer = _TOKEN_FRAGMENT_WRITERS.get(self.output_formatter)
+            if writer is _chat_logprob_json and not self.original_params.get(
+                    "logprobs"):
+                writer = None
+            if writer is not None:
+                self.token_fragments = []
+                self._token_fragment_writer = writer
 
     def __repr__(self):
         return f"<Request id: {self.id} Input {self.input_text} Parameters {self.parameters} Finished {self.last_token}>"
 
+    def use_vocabulary(self, vocabulary):
+        """
+        Sets the VocabularyTable of the backend, the bytes of the tokens are
+        looked up in it if the output has chat logprobs.
+
+        :param vocabulary: the VocabularyTable of the backend
+        """
+        is_chat = self.output_formatter in _CHAT_FORMATTERS
+        if is_chat and self.original_params.get("logprobs"):
+            self.vocabulary = vocabulary
+
+    @property
+    def token_cache(self):
+        """
+        The generated tokens as dicts, None if details are not requested.
+
+        The list is built on first access and extended on later ones.
+        """
+        if self.token_ids is None:
+            return None
+        if self._token_dicts is None:
+            self._token_dicts = []
+        token_dicts = self._token_dicts
+        for i in range(len(token_dicts), len(self.token_ids)):
+            token_dicts.append(
+                _token_dict(self.token_ids[i], self.generated_tokens[i],
+                            self.token_log_probs[i],
+                            self.token_special_flags[i]))
+        return token_dicts
+
+    def get_details(self,
+                    finish_reason: str = None,
+                    include_tokens: bool = True) -> dict:
+        """
+        Builds the details passed to the output formatter.
+
+        :param finish_reason: why the generation ended
+        :param include_tokens: whether to include the token dicts, otherwise
+            the encoded tokens are passed as TOKEN_FRAGMENTS if there are any
+        :return: details dict
+        """
+        details_dict = {}
+        if self.details:
+            details_dict["finish_reason"] = finish_reason
+            if include_tokens:
+                details_dict["tokens"] = self.token_cache
+            elif self.token_fragments is not None:
+                details_dict[TOKEN_FRAGMENTS] = self.token_fragments
+            details_dict["generated_tokens"] = len(self.token_ids)
+            details_dict["inputs"] = self.input_text
+            details_dict["parameters"] = self.original_params
+            details_dict["prompt_tokens"] = len(self.input_ids)
+        # Special handling for error case
+        elif finish_reason == "error":
+            details_dict["finish_reason"] = finish_reason
+        return details_dict
+
     def set_next_token(self,
                        next_token: Union[Token, str],
                        last_token: bool = False,
@@ -346,39 +511,81 @@ class Request(object):
             length: end because max_output_token size reached
             eos_token: End of sequence token found
             stop_sequence: Preset stop sequence token found
+            cancelled: the request was cancelled
+            error: the request failed
         :param prompt_tokens_details: prompt tokens details when parameter decoder_input_details is true.
         """
         if isinstance(next_token, str):
             next_token = Token([-1], next_token)
+        if self.skip_tokens:
+            # generated again for a follower that became the leader
+            self.skip_tokens -= 1
+            if not last_token:
+                return
+            next_token = Token([-1], "")
         next_token.request_id = self.id
-        if self.token_cache is not None:
-            self.token_cache.append(next_token.as_dict())
+        vocabulary = self.vocabulary
+        if vocabulary is not None and next_token.id[0] >= 0:
+            next_token.token_bytes = vocabulary.bytes_of(next_token.id)
+        if self.stop_matcher is not None and next_token.text:
+            self.stop_state, end = self.stop_matcher.feed(
+                self.stop_state, next_token.text)
+            if end >= 0:
+                if end < len(next_token.text):
+                    # the bytes of the text are used
+                    next_token.token_bytes = None
+                # the stop sequence is kept in the output
+                next_token.text = next_token.text[:end]
+                last_token = True
+                finish_reason = "stop_sequence"
+                self.stopped = True
+                self.stop_matcher = None
         self.generated_tokens.append(next_token.text)
+        if self.cached_response is not None and finish_reason not in (
+                "cancelled", "error"):
+            self.cached_response.add_token(next_token.id, next_token.text,
+                                           next_token.log_prob,
+                                           next_token.special_token)
+            if last_token:
+                self.cached_response.finish(finish_reason,
+                                            prompt_tokens_details)
+        if self.token_ids is not None:
+            self.token_ids.append(next_token.id)
+            self.token_log_probs.append(next_token.log_prob)
+            self.token_special_flags.append(next_token.special_token)
+            if self.token_fragments is not None:
+                self.token_fragments.append(
+                    self._token_fragment_writer(next_token))
         self.step_token_number = len(
             next_token.id) if next_token.id[0] != -1 else -1
-        details_dict = {}
-        # making detailed information captured for each token generation
-        if self.details:
-            details_dict["finish_reason"] = finish_reason
-            details_dict["tokens"] = self.token_cache
-            details_dict["generated_tokens"] = len(self.token_cache)
-            details_dict["inputs"] = self.input_text
-            details_dict["parameters"] = self.original_params
-            details_dict["prompt_tokens"] = len(self.input_ids)
-        # Special handling for error case
-        elif finish_reason == "error":
-            details_dict["finish_reason"] = finish_reason
-        generated_text = self.full_text_prefix
-        if last_token:
-            generated_text = generated_text + ''.join(self.generated_tokens)
-            if self.decoder_input_details:
-                details_dict["prompt_tokens_details"] = prompt_tokens_details
-        if self.output_formatter is None:
+        output_formatter = self.output_formatter
+        if output_formatter is None:
             self.next_token_str += next_token.text
         else:  # output only supports size one now
-            self.next_token_str += self.output_formatter(
-                next_token, self.first_token, last_token, details_dict,
-                generated_text, self.id)
+            # built-in formatters only read the details of the last token
+            if last_token or output_formatter not in _LAST_TOKEN_DETAILS_FORMATTERS:
+                details_dict = self.get_details(finish_reason,
+                                                include_tokens=output_formatter
+                                                not in _BUILTIN_FORMATTERS)
+            else:
+                details_dict = {}
+            generated_text = self.full_text_prefix
+            if last_token:
+                generated_text = generated_text + ''.join(
+                    self.generated_tokens)
+                if self.decoder_input_details:
+                    details_dict[
+                        "prompt_tokens_details"] = prompt_tokens_details
+            try:
+                self.next_token_str += output_formatter(
+                    next_token, self.first_token, last_token, details_dict,
+                    generated_text, self.id)
+            except Exception as e:
+                # a failing formatter only fails this request
+                logging.exception(
+                    f"Output formatter failed for request {self.id}")
+                self.error = str(e)
+                last_token = True
         self.last_token = last_token
         self.first_token = False
 
@@ -413,9 +620,123 @@ class Request(object):
         return self.last_token
 
 
+def _request_id(request: Request) -> int:
+    return request.id
+
+
+def _adapter_key(adapter):
+    """
+    :return: the adapter as part of a response cache key
+    """
+    if adapter is None:
+        return None
+    if hasattr(adapter, "get_property"):
+        # the registered adapter input
+        return [adapter.get_property("name"), adapter.get_property("src")]
+    return str(adapter)
+
+
+class RequestTable(object):
+    """
+    The active requests of a rolling batch, indexed by stable slot ids.
+
+    A request keeps its slot from admission until it is removed, and freed
+    slots are reused. Iteration returns the requests in request id order,
+    which is the arrival order of the results sent back to the frontend.
+    Each slot has a preallocated result record that is updated in place
+    every step.
+    """
+
+    __slots__ = ("_requests", "_order", "_records", "_free_slots")
+
+    def __init__(self):
+        self._requests = {}
+        # (request id, slot) of the requests, sorted
+        self._order = []
+        self._records = []
+        self._free_slots = []
+
+    def add(self, request: Request) -> int:
+        """
+        Adds a request to a free slot.
+
+        :param request: the request
+        :return: the slot id
+        """
+        if self._free_slots:
+            slot = self._free_slots.pop()
+        else:
+            slot = len(self._records)
+            self._records.append({
+                "data": "",
+                "last": False,
+                "step_token_num": 0
+            })
+        request.slot = slot
+        self._requests[slot] = request
+        # requests admitted ahead of older ones keep the arrival order
+        bisect.insort(self._order, (request.id, slot))
+        return slot
+
+    def remove(self, slot: int):
+        """
+        Removes the request in the slot and frees the slot.
+
+        :param slot: the slot id
+        """
+        request = self._requests.pop(slot)
+        request.slot = None
+        del self._order[bisect.bisect_left(self._order, (request.id, slot))]
+        self._free_slots.append(slot)
+
+    def get(self, slot: int) -> Request:
+        """
+        :param slot: the slot id
+        :return: the request in the slot, None if the slot is free
+        """
+        return self._requests.get(slot)
+
+    def get_record(self, slot: int) -> dict:
+        """
+        :param slot: the slot id
+        :return: the result record of the slot
+        """
+        return self._records[slot]
+
+    def clear(self):
+        for request in self._requests.values():
+            request.slot = None
+        self._requests.clear()
+        self._order.clear()
+        self._free_slots = list(reversed(range(len(self._records))))
+
+    def __iter__(self):
+        requests = self._requests
+        return (requests[slot] for _, slot in self._order)
+
+    def __len__(self):
+        return len(self._requests)
+
+
+def _error_result(error: str) -> dict:
+    # the frontend returns the code and the error instead of the data
+    return {
+        "data": _dumps({
+            "code": 424,
+            "error": error
+        }),
+        "last": True,
+        "step_token_num": 0,
+        "code": 424,
+        "error": error
+    }
+
+
 def stop_on_any_exception(func):
     """
-    Decorator that handles errors sent from backend
+    Decorator that handles batch level errors sent from backend, all active
+    requests fail and the rolling batch is reset. Errors of single requests
+    are handled by RollingBatch.fail_request instead.
     """
 
     def try_catch_handling(self, *args, **kwargs):
@@ -423,7 +744,11 @@ def stop_on_any_exception(func):
             return func(self, *args, **kwargs)
         except Exception:
             logging.exception("Rolling batch inference error")
-            for request in self.active_requests:
+            for request in list(self._requests_in_order()):
+                if request.last_token:
+                    continue
+                # pending and coalesced requests are dropped by the reset
+                self._finish_early(request)
                 token = Token([-1], "", -1, None)
                 request.set_next_token(token,
                                        last_token=True,
@@ -443,6 +768,13 @@ class RollingBatch(ABC):
 
     """
 
+    # whether the backend handles the stop_sequences parameter itself,
+    # otherwise the generated text is matched by the requests
+    native_stop_sequences = False
+    # whether abort_requests stops running requests in the backend, running
+    # requests of other backends can't be cancelled
+    supports_cancel = True
+
     def __init__(self, **kwargs):
         """
         Initializes the rolling batch scheduler.
@@ -451,20 +783,44 @@ class RollingBatch(ABC):
         """
 
         self.pending_requests: List[Request] = []
-        self.active_requests: List[Request] = []
+        self.request_table = RequestTable()
         self.req_id_counter = 0
         self.waiting_steps = kwargs.get("waiting_steps", None)
+        self.admission_controller = None
+        max_prefill_tokens = kwargs.get("max_prefill_tokens", None)
+        if max_prefill_tokens:
+            self.admission_controller = PrefillAdmissionController(
+                int(max_prefill_tokens))
         self.current_step = 0
         self.default_output_formatter = kwargs.get("output_formatter", None)
+        # see djl_python.response_cache
+        self.response_cache = kwargs.get("response_cache", None)
+        # identical deterministic requests share one generation
+        self.coalesce_requests = str(kwargs.get("coalesce_requests",
+                                                False)).lower() == "true"
+        self.leaders = {}
+        self.followers: List[Request] = []
+        # the VocabularyTable of the tokenizer, set by backends that have one
+        self.vocabulary = None
         # TODO: remove global context through refactoring
         global TGI_COMPAT
         # TODO: better handling to make it part of properties
         TGI_COMPAT = os.environ.get("OPTION_TGI_COMPAT",
                                     "false").lower() == 'true'
 
+    @property
+    def active_requests(self) -> List[Request]:
+        """
+        :return: the active requests in order, iterate request_table instead
+            to avoid the copy
+        """
+        return list(self.request_table)
+
     def reset(self):
         self.pending_requests = []
-        self.active_requests = []
+        self.request_table.clear()
+        self.leaders = {}
+        self.followers = []
         self.req_id_counter = 0
 
     def get_tokenizer(self):
@@ -473,6 +829,17 @@ class RollingBatch(ABC):
         """
         raise RuntimeError("get_tokenizer function not supported")
 
+    def uses_sampling(self, parameters: dict) -> bool:
+        """
+        Whether the backend samples the tokens of a request, only greedy
+        requests are cached and coalesced. Backends that sample by default or
+        with other parameters than do_sample override it.
+
+        :param parameters: the generation parameters of the request
+        :return: whether the generation is random
+        """
+        return bool(parameters.get("do_sample", False))
+
     @abstractmethod
     def inference(self, input_data, parameters, adapters=None):
         """
@@ -501,37 +868,287 @@ class RollingBatch(ABC):
 
         :return: list of current active requests (including those that have just been added)
         """
-        total_req_len = len(self.active_requests) + len(self.pending_requests)
+        total_req_len = len(self.request_table) + len(
+            self.pending_requests) + len(self.followers)
+        # the known requests come first, in arrival order
+        cancelled = [
+            request for request, params in zip(self._requests_in_order(),
+                                               parameters[:total_req_len])
+            if params.get("cancel")
+        ]
         if batch_size > total_req_len:
             for i in range(total_req_len, batch_size):
                 data = input_data[i]
                 params = parameters[i] if i < len(parameters) else {}
                 adapter = adapters[i] if adapters is not None and i < len(
                     parameters) else None
+                cancel = params.pop("cancel", False)
                 details = params.pop("details", False)
                 request = Request(self.req_id_counter,
                                   data,
                                   params,
                                   details,
-                                  input_ids=self.get_tokenizer().encode(data)
-                                  if details else None,
+                                  input_ids=None,
                                   adapter=adapter,
                                   output_formatter=params.pop(
                                       "output_formatter",
                                       self.default_output_formatter))
+                # only the generation parameters are left
+                cache_key = None
+                if self.response_cache is not None:
+                    cache_key = self.response_cache.key(
+                        data, params, self.uses_sampling(params),
+                        _adapter_key(adapter))
+                elif self.coalesce_requests:
+                    cache_key = request_key(data, params,
+                                            self.uses_sampling(params),
+                                            _adapter_key(adapter))
+                if self.vocabulary is not None:
+                    request.use_vocabulary(self.vocabulary)
+                if not self.native_stop_sequences:
+                    request.stop_matcher = get_stop_sequence_matcher(
+                        params.pop("stop_sequences", None))
                 self.pending_requests.append(request)
                 self.req_id_counter += 1
+                if details or self.admission_controller:
+                    try:
+                        request.input_ids = self.get_tokenizer().encode(data)
+                    except Exception as e:
+                        request.input_ids = []
+                        self.fail_request(request, e)
+                if cancel:
+                    cancelled.append(request)
+                elif cache_key is not None and not request.last_token:
+                    self._lookup_response(request, cache_key)
+        if cancelled:
+            self._cancel_requests(cancelled)
         # wait steps and not feeding new requests
         if self.waiting_steps and self.current_step < self.waiting_steps:
             self.current_step += 1
             return []
-        # add all pending to active requests
-        active_pos = len(self.active_requests)
-        self.active_requests.extend(self.pending_requests)
+        # add pending to active requests, within the prefill token budget
+        if self.admission_controller is None:
+            new_requests = self.pending_requests
+            self.pending_requests = []
+        else:
+            new_requests, self.pending_requests = self.admission_controller.admit(
+                self.pending_requests, len(self.request_table))
+        for request in new_requests:
+            self.request_table.add(request)
         # reset states
-        self.pending_requests = []
-        self.current_step = 0
-        return self.active_requests[active_pos:]
+        if not self.pending_requests:
+            self.current_step = 0
+        return new_requests
+
+    def _requests_in_order(self):
+        """
+        :return: iterator over the active, the pending and the coalesced
+            requests in arrival order, the order of the requests sent by the
+            frontend
+        """
+        if not self.pending_requests and not self.followers:
+            return iter(self.request_table)
+        # requests held back by admission control keep their position
+        return heapq.merge(self.request_table,
+                           self.pending_requests,
+                           self.followers,
+                           key=_request_id)
+
+    def _cancel_requests(self, requests: list[Request]):
+        """
+        Finishes the cancelled requests in this step. Running requests are
+        removed from the backend, pending ones are never sent to it. Both
+        get a slot until their last result is returned.
+
+        :param requests: the cancelled requests
+        """
+        running = []
+        for request in requests:
+            if request.last_token:
+                continue
+            if request.slot is not None and not self.supports_cancel:
+                self.fail_request(
+                    request,
+                    ValueError(
+                        f"{type(self).__name__} can't cancel running requests")
+                )
+                continue
+            if self._finish_early(request):
+                running.append(request)
+            request.set_next_token("",
+                                   last_token=True,
+                                   finish_reason="cancelled")
+        if running:
+            self.abort_requests(running)
+        logging.debug(f"Cancelled {len(requests)} requests")
+
+    def _lookup_response(self, request: Request, cache_key: bytes):
+        """
+        Finishes a new deterministic request with a cached response, or
+        attaches it to a running identical request, or records its response.
+
+        :param request: the new pending request
+        :param cache_key: the key of its response
+        """
+        request.cache_key = cache_key
+        if self.response_cache is not None:
+            cached_response = self.response_cache.get(cache_key)
+            if cached_response is not None:
+                self._finish_early(request)
+                self._replay_response(request, cached_response)
+                logging.debug(
+                    f"Request {request.id} served from the response cache")
+                return
+        if self.coalesce_requests:
+            leader = self.leaders.get(cache_key)
+            if leader is not None:
+                self._follow(leader, request)
+                return
+            self.leaders[cache_key] = request
+            request.followers = []
+        request.cached_response = CachedResponse()
+
+    def _replay_response(self,
+                         request: Request,
+                         cached_response: CachedResponse,
+                         start: int = 0):
+        """
+        Sets the tokens of a response generated for an identical request.
+
+        :param request: the request
+        :param cached_response: the response, recorded by the leader or from
+            the response cache
+        :param start: the index of the first token to set
+        """
+        tokens = cached_response.tokens
+        last = len(tokens) - 1 if cached_response.finished else len(tokens)
+        for i in range(start, len(tokens)):
+            if request.last_token:
+                break
+            token = Token(*tokens[i])
+            if i < last:
+                request.set_next_token(token)
+            else:
+                request.set_next_token(
+                    token,
+                    last_token=True,
+                    finish_reason=cached_response.finish_reason,
+                    prompt_tokens_details=cached_response.prompt_tokens_details
+                )
+
+    def _follow(self, leader: Request, request: Request):
+        """
+        Coalesces a new request with an identical running or pending one. The
+        follower gets the tokens of the leader, including the ones generated
+        before it arrived, and is never sent to the backend. Requests the
+        backend samples have no key and are never coalesced, see
+        uses_sampling.
+
+        :param leader: the request generating the response
+        :param request: the new identical request
+        """
+        self.pending_requests.remove(request)
+        request.leader = leader
+        leader.followers.append(request)
+        # the new requests have the highest ids, the list stays sorted
+        self.followers.append(request)
+        logging.debug(f"Request {request.id} follows request {leader.id}")
+
+    def _unfollow(self, request: Request):
+        request.leader.followers.remove(request)
+        request.leader = None
+        self.followers.remove(request)
+
+    def _update_followers(self):
+        """
+        Sends the tokens generated in this step to the followers. When a
+        leader stops before its last token, for example because it was
+        cancelled, its first follower takes over and is sent to the backend.
+        """
+        for cache_key, leader in list(self.leaders.items()):
+            cached_response = leader.cached_response
+            for follower in leader.followers:
+                self._replay_response(follower, cached_response,
+                                      len(follower.generated_tokens))
+            if not leader.last_token:
+                continue
+            del self.leaders[cache_key]
+            if cached_response.finished or not leader.followers:
+                continue
+            new_leader = leader.followers[0]
+            self._unfollow(new_leader)
+            new_leader.followers = leader.followers
+            leader.followers = []
+            for follower in new_leader.followers:
+                follower.leader = new_leader
+            # the tokens sent so far are generated again
+            new_leader.cached_response = cached_response
+            new_leader.skip_tokens = len(new_leader.generated_tokens)
+            self.leaders[cache_key] = new_leader
+            index = len(self.pending_requests)
+            while index and self.pending_requests[index -
+                                                  1].id > new_leader.id:
+                index -= 1
+            self.pending_requests.insert(index, new_leader)
+            logging.debug(f"Request {new_leader.id} takes over from request "
+                          f"{leader.id}")
+
+    def _cache_response(self, request: Request):
+        """
+        Caches the response of a finished request, unless it was cut short.
+
+        :param request: the finished request
+        """
+        cached_response = request.cached_response
+        if self.response_cache is not None and cached_response.finished:
+            self.response_cache.put(request.cache_key, cached_response,
+                                    cached_response.size)
+        request.cached_response = None
+
+    def _finish_early(self, request: Request) -> bool:
+        """
+        Moves a pending request that finishes before it ran to a slot, which
+        holds it until its last result is returned.
+
+        :param request: the request
+        :return: whether the request was already active
+        """
+        if request.slot is not None:
+            return True
+        if request.leader is not None:
+            self._unfollow(request)
+        else:
+            self.pending_requests.remove(request)
+        self.request_table.add(request)
+        return False
+
+    def fail_request(self, request: Request, error: Exception):
+        """
+        Fails a single request, for example for invalid parameters, while the
+        rest of the batch keeps running. The error is returned as the last
+        result of the request in this step.
+
+        :param request (Request): the failed request, pending or active
+        :param error (Exception): the cause
+        """
+        logging.warning(f"Request {request.id} failed: {error}")
+        if request.last_token:
+            return
+        request.error = str(error)
+        request.last_token = True
+        if self._finish_early(request):
+            self.abort_requests([request])
+
+    def abort_requests(self, requests: list[Request]):
+        """
+        Removes cancelled or failed requests from the backend, called before
+        the next step. The requests are already finished and must not be
+        updated by the step, their slots are freed by postprocess_results.
+        Requests the backend doesn't know (anymore) must be ignored.
+
+        :param requests (list[Request]): the finished active requests
+        """
+        pass
 
     @abstractmethod
     def preprocess_requests(self, requests: list[Request]):
@@ -546,30 +1163,70 @@ class RollingBatch(ABC):
         """
         Returns most recent produced token by each request in a list of dicts
 
-        :return: a list of dicts, each one containing token and metadata
-        """
-        results = []
-        for i in range(len(self.active_requests)):
-            req = self.active_requests[i]
-            res = {
-                "data": req.get_next_token(),
-                "last": req.is_last_token(),
-                "step_token_num": req.get_step_token_number()
-            }
-            req.reset_next_token()
-            results.append(res)
-
-        # add empty tokens to pending requests
-        for i in range(len(self.active_requests),
-                       len(self.active_requests) + len(self.pending_requests)):
-            res = {"data": "", "last": False, "step_token_num": 0}
-            results.append(res)
-
-        self.active_requests = [
-            req for req in self.active_requests if not req.is_last_token()
-        ]
-
-        if len(self.active_requests) + len(self.pending_requests) == 0:
+        :return: a list of dicts, each one containing token and metadata. The
+            dicts of active requests are reused by the next step.
+        """
+        with request_timing.span("postprocess"):
+            if self.leaders:
+                self._update_followers()
+            table = self.request_table
+            results = []
+            finished = []
+            aborted = []
+            finished_followers = []
+            for req in self._requests_in_order():
+                if req.leader is not None:
+                    if req.error is not None:
+                        results.append(_error_result(req.error))
+                    else:
+                        results.append({
+                            "data": req.next_token_str,
+                            "last": req.last_token,
+                            "step_token_num": req.step_token_number
+                        })
+                    req.next_token_str = ""
+                    if req.last_token:
+                        finished_followers.append(req)
+                    continue
+                if req.slot is None:
+                    # pending requests only have the tokens of their leader
+                    results.append({
+                        "data": req.next_token_str,
+                        "last": False,
+                        "step_token_num": 0
+                    })
+                    req.next_token_str = ""
+                    continue
+                if req.error is not None:
+                    # a new dict, the record of the slot is reused
+                    results.append(_error_result(req.error))
+                    finished.append(req.slot)
+                    aborted.append(req)
+                    continue
+                res = table.get_record(req.slot)
+                res["data"] = req.next_token_str
+                res["last"] = req.last_token
+                res["step_token_num"] = req.step_token_number
+                req.next_token_str = ""
+                results.append(res)
+                if req.last_token:
+                    finished.append(req.slot)
+                    if req.stopped:
+                        aborted.append(req)
+                    if req.cached_response is not None:
+                        self._cache_response(req)
+
+            if aborted:
+                # stopped here or their output formatter failed, the backend
+                # may still run them
+                self.abort_requests(aborted)
+            for slot in finished:
+                table.remove(slot)
+            for req in finished_followers:
+                self._unfollow(req)
+
+        if len(self.request_table) + len(self.pending_requests) + len(
+                self.followers) == 0:
             self.req_id_counter = 0
 
         return results
@@ -15,6 +15,10 @@ from seq_scheduler.lm_block import HuggingfaceBlock, BloomBlock, FalconBlock
 from seq_scheduler.search_config import SearchConfig
 from seq_scheduler.seq_batch_scheduler import SeqBatchScheduler
 from collections import namedtuple, defaultdict
+from djl_python import request_timing
+from djl_python.detokenizer import DecodeState, IncrementalDetokenizer
+from djl_python.vocabulary import VocabularyTable
+from djl_python.response_cache import create_response_cache
 from djl_python.rolling_batch.rolling_batch import RollingBatch, stop_on_any_exception, filter_unused_generation_params
 from transformers import AutoModelForCausalLM, AutoTokenizer, AutoConfig
 
@@ -62,10 +66,15 @@ class SchedulerRollingBatch(RollingBatch):
         """
 
         self.scheduler_configs = SchedulerRbProperties(**properties)
+        max_prefill_tokens = self.scheduler_configs.max_rolling_batch_prefill_tokens
         super().__init__(
             waiting_steps=self.scheduler_configs.waiting_steps,
-            output_formatter=self.scheduler_configs.output_formatter)
+            max_prefill_tokens=max_prefill_tokens,
+            output_formatter=self.scheduler_configs.output_formatter,
+            response_cache=create_response_cache(self.scheduler_configs),
+            coalesce_requests=self.scheduler_configs.coalesce_requests)
         self._init_model_and_tokenizer()
+        self.vocabulary = VocabularyTable(self.tokenizer)
         self._init_scheduler()
 
     @stop_on_any_exception
@@ -89,6 +98,14 @@ class SchedulerRollingBatch(RollingBatch):
         self._prefill_and_decode(preprocessed_new_requests)
         return self.postprocess_results()
 
+    def abort_requests(self, requests: list) -> None:
+        """
+        Trims the cancelled requests from the scheduler batches.
+        """
+        request_ids = [request.slot for request in requests]
+        self.scheduler.remove_requests(request_ids)
+        self.tokenizer_streaming.remove_request(exit_req_ids=request_ids)
+
     def preprocess_requests(self, requests: list):
         """
         Aggregates a batch of requests.
@@ -96,36 +113,53 @@ class SchedulerRollingBatch(RollingBatch):
         :param requests: List of Request objects
         :return: aggregate data structure containing request data for the whole batch
         """
-        Requests = namedtuple(
-            'Requests',
-            ['input_texts', 'search_configs', 'request_ids', 'prompts'])
+        Requests = namedtuple('Requests', [
+            'input_texts', 'input_ids', 'search_configs', 'request_ids',
+            'prompts'
+        ])
         new_requests = Requests(defaultdict(list), defaultdict(list),
-                                defaultdict(list), defaultdict(dict))
+                                defaultdict(list), defaultdict(list),
+                                defaultdict(dict))
 
         for request in requests:
             parameters = request.parameters
-            search_algorithm = parameters.get('decoding_strategy',
-                                              self.search_algorithm)
+            search_algorithm = self._search_algorithm(parameters)
 
-            # TODO: This is not needed when search algorithm automatically chosen for the user.
-            if str(parameters.get(
-                    "do_sample",
-                    self.search_config.sampling)).lower() == "true":
-                search_algorithm = "sample"
+            try:
+                search_config = self._construct_search_config(parameters)
+            except Exception as e:
+                self.fail_request(request, e)
+                continue
 
             new_requests.input_texts[search_algorithm].append(
                 request.input_text)
+            # encoded by get_new_requests for details or admission control
+            new_requests.input_ids[search_algorithm].append(request.input_ids
+                                                            or None)
 
             if "cached_prompt" in parameters:
                 new_requests.prompts[search_algorithm][
-                    request.id] = parameters.pop("cached_prompt")
+                    request.slot] = parameters.pop("cached_prompt")
 
-            search_config = self._construct_search_config(parameters)
             new_requests.search_configs[search_algorithm].append(search_config)
-            new_requests.request_ids[search_algorithm].append(request.id)
+            # the scheduler addresses requests by their slot in the table
+            new_requests.request_ids[search_algorithm].append(request.slot)
 
         return new_requests
 
+    def _search_algorithm(self, parameters: dict) -> str:
+        """
+        :return: the decoding strategy of a request
+        """
+        # TODO: This is not needed when search algorithm automatically chosen for the user.
+        if str(parameters.get("do_sample",
+                              self.search_config.sampling)).lower() == "true":
+            return "sample"
+        return parameters.get('decoding_strategy', self.search_algorithm)
+
+    def uses_sampling(self, parameters: dict) -> bool:
+        return self._search_algorithm(parameters) == "sample"
+
     def _init_model_and_tokenizer(self) -> None:
         """
         Helper function for __init__ that creates a huggingface model and tokenizer.
@@ -224,29 +258,37 @@ class SchedulerRollingBatch(RollingBatch):
                 prompt_ids = self._get_prompt_ids(
                     new_requests.prompts[search_algorithm])
                 prompt_ids = prompt_ids if prompt_ids else None
+                with request_timing.span("tokenize"):
+                    input_ids = self._get_input_ids(
+                        input_texts=input_texts,
+                        input_ids=new_requests.input_ids[search_algorithm])
                 # Prefills search states for each request and merges to the existing batch
-                self.scheduler.add_request(
-                    input_ids=self._get_input_ids(input_texts=input_texts),
-                    request_uids=_get_request_ids_tensor(
-                        request_ids=request_ids),
-                    search_algorithm=search_algorithm,
-                    search_configs=search_configs,
-                    kv_cache_prompt_ids=prompt_ids)
+                with request_timing.span("prefill"):
+                    self.scheduler.add_request(
+                        input_ids=input_ids,
+                        request_uids=_get_request_ids_tensor(
+                            request_ids=request_ids),
+                        search_algorithm=search_algorithm,
+                        search_configs=search_configs,
+                        kv_cache_prompt_ids=prompt_ids)
 
                 self.tokenizer_streaming.add_request(
                     request_ids=request_ids, results=self.scheduler.results)
 
         # Decoding step. Generates a token for all the requests in a batch.
-        generated_token_ids, request_ids, exit_req_ids = self.scheduler.inference_call(
-        )
+        with request_timing.span("decode"):
+            generated_token_ids, request_ids, exit_req_ids = self.scheduler.inference_call(
+            )
 
         # Collect output into scheduler.results
         for request_id, generated_token_id in zip(request_ids,
                                                   generated_token_ids):
             self.scheduler.results[request_id].extend(generated_token_id)
 
-        generated_tokens: List[str] = self.tokenizer_streaming.decode_token(
-            request_ids, self.scheduler.results)
+        with request_timing.span("detokenize"):
+            generated_tokens: List[
+                str] = self.tokenizer_streaming.decode_token(
+                    request_ids, self.scheduler.results)
 
         # Deleting the finished results here
         for request_id in exit_req_ids:
@@ -254,23 +296,32 @@ class SchedulerRollingBatch(RollingBatch):
                 del self.scheduler.results[request_id]
         self.tokenizer_streaming.remove_request(exit_req_ids=exit_req_ids)
 
-        for request_id, generated_token, request in zip(
-                request_ids, generated_tokens, self.active_requests):
+        for request_id, generated_token in zip(request_ids, generated_tokens):
             is_last_token = (request_id in exit_req_ids)
-            request.set_next_token(''.join(generated_token),
-                                   last_token=is_last_token)
+            self.request_table.get(request_id).set_next_token(
+                ''.join(generated_token), last_token=is_last_token)
 
-    def _get_input_ids(self, input_texts: list) -> torch.Tensor:
+    def _get_input_ids(self,
+                       input_texts: list,
+                       input_ids: list = None) -> torch.Tensor:
         """
         Converts input texts into token IDs
 
         :param input_texts (list): Input texts for a particular strategy
+        :param input_ids (list): Token IDs of the input texts already
+            encoded, None for the others
 
         :return input_ids: torch.Tensor of token IDs
         """
-        input_ids = self.tokenizer(input_texts,
-                                   return_tensors="pt",
-                                   padding=True).input_ids
+        if input_ids and all(ids is not None for ids in input_ids):
+            # pad the prompts the rolling batch encoded, don't encode again
+            encoded = {"input_ids": input_ids}
+            input_ids = self.tokenizer.pad(encoded,
+                                           return_tensors="pt").input_ids
+        else:
+            input_ids = self.tokenizer(input_texts,
+                                       return_tensors="pt",
+                                       padding=True).input_ids
         input_ids = input_ids.to(self.model.device)
         return input_ids
 
@@ -362,45 +413,34 @@ class TokenizerStreaming:
 
     def __init__(self, tokenizer) -> None:
         self.tokenizer = tokenizer
+        self.detokenizer = IncrementalDetokenizer(tokenizer)
 
-        self.prefix_offset: defaultdict = defaultdict(int)
-        self.read_offset: defaultdict = defaultdict(int)
+        self.states: Dict[int, DecodeState] = {}
+        self.read_offset: Dict[int, int] = {}
 
     def add_request(self, request_ids: List[int], results: Dict[int,
                                                                 List[int]]):
         for req_id in request_ids:
-            self.prefix_offset[req_id] = len(results[req_id])
+            self.states[req_id] = self.detokenizer.new_sequence()
             self.read_offset[req_id] = len(results[req_id])
 
     def remove_request(self, exit_req_ids: List[int]):
         for req_id in exit_req_ids:
-            del self.prefix_offset[req_id]
-            del self.read_offset[req_id]
+            self.states.pop(req_id, None)
+            self.read_offset.pop(req_id, None)
 
     def decode_token(self, request_ids: List[int],
                      results: Dict[int, List[int]]) -> List[str]:
-        """Hack to hopefully support generate_stream for the maximum number of tokenizers"""
-        # The prefix text is necessary only to defeat cleanup algorithms in the decode
-        # which decide to add a space or not depending on the surrounding ids.
-        new_text_batch: List[str] = []
+        """
+        Decodes the tokens generated since the last call for all the requests
+        at once.
+        """
+        states = []
+        new_token_ids = []
         for req in request_ids:
             # Here request_ids is assumed to be order-reserved
-            prefix_text: str = self.tokenizer.decode(
-                results[req][self.prefix_offset[req]:self.read_offset[req]],
-                skip_special_tokens=False)
-            new_text: str = self.tokenizer.decode(
-                results[req][self.prefix_offset[req]:],
-                skip_special_tokens=False)
-            if len(new_text) > len(prefix_text) and not new_text.endswith("�"):
-                # utf-8 char at the end means it's a potential unfinished byte sequence
-                # from byte fallback tokenization.
-                # If it's in the middle, it's probably a real invalid id generated
-                # by the model
-                new_text = new_text[len(prefix_text):]
-                self.prefix_offset[req] = self.read_offset[req]
-                self.read_offset[req] = len(results[req])
-                new_text_batch.append(new_text)
-            else:
-                new_text_batch.append("")
-
-        return new_text_batch
+            token_ids = results[req]
+            states.append(self.states[req])
+            new_token_ids.append(token_ids[self.read_offset[req]:])
+            self.read_offset[req] = len(token_ids)
+        return self.detokenizer.decode(states, new_token_ids)
@@ -21,6 +21,8 @@ class TRTLLMRollingBatch(RollingBatch):
     It also gets any new tokens from the backend and sends them back to the handler.
     """
 
+    supports_cancel = False
+
     def __init__(self, model_id_or_path: str, properties: dict,
                  **kwargs) -> None:
         """
@@ -30,6 +32,8 @@ class TRTLLMRollingBatch(RollingBatch):
         :param properties: other properties of the model, such as decoder strategy
         """
         super().__init__(**kwargs)
+        # not an option of the engine
+        kwargs.pop("response_cache", None)
         if properties.get("mpi_mode") != "true":
             raise AssertionError(
                 f"Need mpi_mode to start tensorrt llm RollingBatcher")
@@ -49,6 +53,23 @@ class TRTLLMRollingBatch(RollingBatch):
         self.request_cache.clear()
         super().reset()
 
+    def abort_requests(self, requests: list) -> None:
+        """
+        Stops reading the stopped or failed requests. The toolkit has no API to
+        stop a response, the engine runs it to its end.
+        """
+        for request in requests:
+            self.request_cache.pop(request.id, None)
+
+    def uses_sampling(self, parameters: dict) -> bool:
+        if parameters.get("do_sample", False):
+            return True
+        # the engine samples with a top k above 1 or any top p, see
+        # translate_triton_params
+        top_k = parameters.get("top_k", parameters.get("runtime_top_k"))
+        top_p = parameters.get("top_p", parameters.get("runtime_top_p"))
+        return float(top_k or 0) > 1 or float(top_p or 0) > 0
+
     def translate_triton_params(self, parameters: dict) -> dict:
         """
         Helper function to convert DJL Serving parameter names to Triton
@@ -98,9 +119,13 @@ class TRTLLMRollingBatch(RollingBatch):
                                              batch_size)
         # step 0: register new active requests
         for request in new_requests:
-            param = self.translate_triton_params(request.parameters)
-            output_len = param["request_output_len"]
-            response = self.model.generate(request.input_text, **param)
+            try:
+                param = self.translate_triton_params(request.parameters)
+                output_len = param["request_output_len"]
+                response = self.model.generate(request.input_text, **param)
+            except Exception as e:
+                self.fail_request(request, e)
+                continue
             self.request_cache[request.id] = {
                 "response": response,
                 "out_length": output_len,
@@ -108,7 +133,10 @@ class TRTLLMRollingBatch(RollingBatch):
             }
 
         # step 1: loop the active requests to send result
-        for request in self.active_requests:
+        for request in self.request_table:
+            if request.last_token:
+                # cancelled before this step
+                continue
             trt_resp = self.request_cache[request.id]["response"]
             generation = trt_resp.fetch()
             log_prob = generation.cum_logprob - self.request_cache[
@@ -16,6 +16,8 @@ from collections import OrderedDict, defaultdict
 from vllm import EngineArgs, LLMEngine, SamplingParams
 from vllm.utils import random_uuid
 from vllm.lora.request import LoRARequest
+from djl_python.response_cache import create_response_cache
+from djl_python.vocabulary import VocabularyTable
 from djl_python.rolling_batch.rolling_batch import RollingBatch, stop_on_any_exception, Token, filter_unused_generation_params
 from djl_python.rolling_batch.rolling_batch_vllm_utils import (
     update_request_cache_with_output, get_lora_request_params, DTYPE_MAPPER,
@@ -32,6 +34,8 @@ class VLLMRollingBatch(RollingBatch):
     It also gets any new tokens from the backend and sends them back to the handler.
     """
 
+    native_stop_sequences = True
+
     # TODO: Make properties is the only parameter, after refactoring all rolling batch handlers
     def __init__(self, model_id_or_path: str, properties: dict,
                  **kwargs) -> None:
@@ -43,7 +47,10 @@ class VLLMRollingBatch(RollingBatch):
         """
         self.vllm_configs = VllmRbProperties(**properties)
         super().__init__(waiting_steps=self.vllm_configs.waiting_steps,
-                         output_formatter=self.vllm_configs.output_formatter)
+                         output_formatter=self.vllm_configs.output_formatter,
+                         response_cache=create_response_cache(
+                             self.vllm_configs),
+                         coalesce_requests=self.vllm_configs.coalesce_requests)
         args = EngineArgs(
             model=self.vllm_configs.model_id_or_path,
             tensor_parallel_size=self.vllm_configs.tensor_parallel_degree,
@@ -64,6 +71,7 @@ class VLLMRollingBatch(RollingBatch):
             max_cpu_loras=self.vllm_configs.max_cpu_loras,
             revision=self.vllm_configs.revision)
         self.engine = LLMEngine.from_engine_args(args)
+        self.vocabulary = VocabularyTable(self.get_tokenizer())
         self.request_cache = OrderedDict()
         self.lora_ids = defaultdict(lambda: len(self.lora_ids) + 1)
 
@@ -79,6 +87,24 @@ class VLLMRollingBatch(RollingBatch):
         self.request_cache = OrderedDict()
         super().reset()
 
+    def abort_requests(self, requests: list) -> None:
+        """
+        Aborts the cancelled requests in the engine, which frees their KV cache
+        """
+        slots = {request.slot for request in requests}
+        for key in [
+                key for key, cache in self.request_cache.items()
+                if cache["slot"] in slots
+        ]:
+            self.engine.abort_request(key)
+            self.request_cache.pop(key)
+
+    def _fail_cached_request(self, request_id: str, error: Exception):
+        cache = self.request_cache.get(request_id)
+        if cache is None:
+            raise error
+        self.fail_request(self.request_table.get(cache["slot"]), error)
+
     def translate_vllm_params(self, parameters: dict) -> dict:
         """
         Helper function to convert DJL Serving parameter names to parameter names
@@ -131,12 +157,18 @@ class VLLMRollingBatch(RollingBatch):
         # step 0: register new requests to engine
         for request in new_requests:
             request_id = random_uuid()
-            params = self.translate_vllm_params(request.parameters)
-            sampling_params = SamplingParams(**params)
-            request_params = get_lora_request_params(request, self.lora_ids)
-            self.engine.add_request(request_id, request.input_text,
-                                    sampling_params, **request_params)
+            try:
+                params = self.translate_vllm_params(request.parameters)
+                sampling_params = SamplingParams(**params)
+                request_params = get_lora_request_params(
+                    request, self.lora_ids)
+                self.engine.add_request(request_id, request.input_text,
+                                        sampling_params, **request_params)
+            except Exception as e:
+                self.fail_request(request, e)
+                continue
             self.request_cache[request_id] = {
+                "slot": request.slot,
                 "curr_length": 0,
                 "text": "",
                 "cumulative_logprob": 0.0,
@@ -148,13 +180,16 @@ class VLLMRollingBatch(RollingBatch):
 
         # step 1: put result to cache
         for request_output in request_outputs:
-            self.request_cache = update_request_cache_with_output(
-                self.request_cache, request_output, self.get_tokenizer())
+            try:
+                self.request_cache = update_request_cache_with_output(
+                    self.request_cache, request_output, self.vocabulary)
+            except Exception as e:
+                self._fail_cached_request(request_output.request_id, e)
 
         # step 2: send result back
         finished_id = []
-        for (key, cache), request in zip(self.request_cache.items(),
-                                         self.active_requests):
+        for key, cache in self.request_cache.items():
+            request = self.request_table.get(cache["slot"])
             finish_reason = None
             prompt_tokens_details = None
             if cache["finished"]:
@@ -337,6 +337,31 @@ class SeqBatchScheduler:
 
         return output, request_uids, exit_request_uids
 
+    def remove_requests(self, request_uids: List[int]):
+        """
+        Removes running requests from their seq_batchers before the next
+        inference_call, e.g. when they are cancelled.
+        Args:
+            request_uids (`List[int]`):
+                The request_uids to remove, unknown ones are ignored.
+        """
+        request_uids = set(request_uids)
+        for seq_batcher_cls in self.seq_batchers:
+            seq_batcher_list_new = []
+            for seq_batcher in self.seq_batchers[seq_batcher_cls]:
+                for i, request_uid in enumerate(
+                        seq_batcher.request_uids.view(-1).tolist()):
+                    if request_uid in request_uids:
+                        seq_batcher.exit_index.add(i)
+                seq_batcher.collect_and_trim()
+                if not seq_batcher.is_empty():
+                    seq_batcher_list_new.append(seq_batcher)
+
+            self.seq_batchers[seq_batcher_cls] = seq_batcher_list_new
+
+        for request_uid in request_uids:
+            self.results.pop(request_uid, None)
+
     def increment_forward(self, count: int):
         # This serves as a demo of how to use this scheduler
         # -> Dict[Type[SeqBatcher]: List[List[int]]]
@@ -18,6 +18,20 @@ import os
 from importlib.machinery import SourceFileLoader
 
 
+def thread_safe(func):
+    """
+    Marks a handler function as safe to be invoked concurrently from multiple
+    threads, see OPTION_CONCURRENT_CONNECTIONS. Handlers that are not marked
+    never run together with any other handler.
+
+    @thread_safe
+    def handle(inputs: Input):
+        ...
+    """
+    func.thread_safe = True
+    return func
+
+
 class ModelService(object):
 
     def __init__(self, module, model_dir):
@@ -28,6 +42,10 @@ class ModelService(object):
         inputs.properties["model_dir"] = self.model_dir
         return getattr(self.module, function_name)(inputs)
 
+    def is_thread_safe(self, function_name) -> bool:
+        handler = getattr(self.module, function_name, None)
+        return getattr(handler, "thread_safe", False) is True
+
 
 def load_model_service(model_dir, entry_point, device_id):
     manifest_file = os.path.join(model_dir, "MAR-INF/MANIFEST.json")
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file
+# except in compliance with the License. A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS"
+# BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+"""
+Shared memory transport for large tensors.
+
+Instead of the tensor bytes, the frame carries a descriptor that points into a
+memory-mapped segment file (in /dev/shm when available). The descriptor is the
+SHM_MAGIC prefix followed by a json object with the token shared with the peer
+and the list of tensors, each with the segment name, offset, length, dtype and
+shape.
+
+Request bodies are sent by clients, so received descriptors are only mapped
+when the transport is enabled and they carry the token of
+OPTION_SHM_TRANSPORT_TOKEN, which only the front end knows.
+
+The producer writes the segment and hands it over to the consumer. The
+consumer maps it, unlinks the file right away so it can't leak if the
+process dies, and keeps the mapping alive while any returned array is alive.
+"""
+
+import hmac
+import json
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+
+import numpy as np
+
+SHM_MAGIC = b"DJLSHM01"
+DEFAULT_SHM_DIR = "/dev/shm" if os.path.isdir(
+    "/dev/shm") else tempfile.gettempdir()
+SEGMENT_PREFIX = "djl-shm-"
+# segments that are not picked up by the peer within this time are removed
+UNCLAIMED_SEGMENT_TTL = 600
+_ALIGNMENT = 64
+
+
+class SharedMemorySegment(object):
+    """
+    A reference counted mapping of a segment file.
+    """
+
+    def __init__(self, name: str, directory: str):
+        self.name = name
+        path = os.path.join(directory, name)
+        fd = os.open(path, os.O_RDWR)
+        try:
+            size = os.fstat(fd).st_size
+            self.buffer = mmap.mmap(fd, size) if size > 0 else b""
+        finally:
+            os.close(fd)
+        # the mapping stays valid after the file is removed
+        os.unlink(path)
+        self.ref_count = 0
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            try:
+                self.buffer.close()
+            except BufferError:
+                # views of a released array are still alive, the mapping is
+                # closed when they are garbage collected
+                pass
+        self.buffer = None
+
+
+_segments = {}
+_lock = threading.Lock()
+_last_sweep = 0.0
+
+
+def get_directory() -> str:
+    """
+    :return: directory of the segment files, OPTION_SHM_TRANSPORT_DIR if set
+    """
+    return os.getenv("OPTION_SHM_TRANSPORT_DIR", DEFAULT_SHM_DIR)
+
+
+def acquire_segment(name: str, directory: str = None) -> SharedMemorySegment:
+    """
+    Maps the segment, or returns the existing mapping, and adds a reference.
+
+    :param name: segment name
+    :param directory: directory of the segment files
+    :return: the segment
+    """
+    if os.path.basename(name) != name or not name.startswith(SEGMENT_PREFIX):
+        raise ValueError(f"Invalid shared memory segment name: {name}")
+    with _lock:
+        segment = _segments.get(name)
+        if segment is None:
+            segment = SharedMemorySegment(name, directory or get_directory())
+            _segments[name] = segment
+        segment.ref_count += 1
+        return segment
+
+
+def release_segment(name: str):
+    """
+    Removes a reference of the segment, the mapping is closed with the last one.
+
+    :param name: segment name
+    """
+    with _lock:
+        segment = _segments.get(name)
+        if segment is None:
+            return
+        segment.ref_count -= 1
+        if segment.ref_count <= 0:
+            del _segments[name]
+            segment.close()
+
+
+def get_segment_count() -> int:
+    """
+    :return: number of segments currently mapped by this process
+    """
+    return len(_segments)
+
+
+def is_descriptor(data) -> bool:
+    """
+    Whether the content is a shared memory descriptor.
+
+    :param data: bytes-like content
+    """
+    return data is not None and len(data) >= len(SHM_MAGIC) and bytes(
+        data[:len(SHM_MAGIC)]) == SHM_MAGIC
+
+
+def _is_token(value, token: str) -> bool:
+    if not token or not isinstance(value, str):
+        return False
+    return hmac.compare_digest(value.encode("utf-8"), token.encode("utf-8"))
+
+
+def from_descriptor(data, token: str, directory: str = None) -> list:
+    """
+    Maps the tensors described by the descriptor.
+
+    The arrays are read-write views into the segment, no data is copied.
+
+    :param data: descriptor
+    :param token: the token shared with the peer
+    :param directory: directory of the segment files
+    :return: list of numpy array
+    """
+    descriptor = json.loads(bytes(data[len(SHM_MAGIC):]).decode("utf-8"))
+    if not isinstance(descriptor, dict) or not _is_token(
+            descriptor.get("token"), token):
+        raise ValueError("Shared memory descriptor without a valid token")
+    result = []
+    for tensor in descriptor["tensors"]:
+        name = tensor["name"]
+        segment = acquire_segment(name, directory)
+        try:
+            dtype = np.dtype(tensor["dtype"])
+            nd = np.frombuffer(segment.buffer,
+                               dtype=dtype,
+                               count=tensor["length"] // dtype.itemsize,
+                               offset=tensor["offset"]).reshape(
+                                   tensor["shape"])
+        except Exception:
+            release_segment(name)
+            raise
+        weakref.finalize(nd, release_segment, name)
+        result.append(nd)
+    return result
+
+
+def to_descriptor(np_list,
+                  directory: str = None,
+                  token: str = None) -> bytearray:
+    """
+    Writes the tensors into a new segment and returns its descriptor.
+
+    The ownership of the segment is transferred to the consumer of the
+    descriptor.
+
+    :param np_list: list of numpy array
+    :param directory: directory of the segment files
+    :param token: the token shared with the peer
+    :return: descriptor
+    """
+    if type(np_list) is not list:
+        np_list = [np_list]
+    directory = directory or get_directory()
+    _remove_unclaimed_segments(directory)
+
+    arrays = []
+    for nd in np_list:
+        nd = np.asarray(nd)
+        if not nd.flags.c_contiguous:
+            nd = nd.copy(order="C")
+        arrays.append(nd)
+    name = f"{SEGMENT_PREFIX}{os.getpid()}-{uuid.uuid4().hex}"
+    tensors = []
+    size = 0
+    for nd in arrays:
+        tensors.append({
+            "name": name,
+            "offset": size,
+            "length": nd.nbytes,
+            "dtype": nd.dtype.str,
+            "shape": list(nd.shape)
+        })
+        size += (nd.nbytes + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+    path = os.path.join(directory, name)
+    fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_RDWR, 0o600)
+    try:
+        os.ftruncate(fd, size)
+        if size > 0:
+            with mmap.mmap(fd, size) as buf:
+                for nd, tensor in zip(arrays, tensors):
+                    view = np.frombuffer(buf,
+                                         dtype=nd.dtype,
+                                         count=nd.size,
+                                         offset=tensor["offset"])
+                    view[:] = nd.reshape(-1)
+                    del view
+    except Exception:
+        os.unlink(path)
+        raise
+    finally:
+        os.close(fd)
+
+    descriptor = bytearray(SHM_MAGIC)
+    descriptor += json.dumps({
+        "token": token,
+        "tensors": tensors
+    }).encode("utf-8")
+    return descriptor
+
+
+def _remove_unclaimed_segments(directory: str):
+    """
+    Removes segments created by this process that were never picked up.
+    """
+    global _last_sweep
+    now = time.time()
+    if now - _last_sweep < UNCLAIMED_SEGMENT_TTL / 10:
+        return
+    _last_sweep = now
+    prefix = f"{SEGMENT_PREFIX}{os.getpid()}-"
+    expire = now - UNCLAIMED_SEGMENT_TTL
+    try:
+        for entry in os.scandir(directory):
+            if entry.name.startswith(
+                    prefix) and entry.stat().st_mtime < expire:
+                logging.warning(
+                    f"Removing unclaimed shared memory segment {entry.name}")
+                os.unlink(entry.path)
+    except OSError:
+        pass
+
+
+class SharedMemoryTransport(object):
+    """
+    Decides which outputs are sent through shared memory.
+    """
+
+    def __init__(self,
+                 threshold: int,
+                 directory: str = None,
+                 token: str = None):
+        """
+        :param threshold: payloads of at least this many bytes use shared memory
+        :param directory: directory of the segment files
+        :param token: the token shared with the front end, received
+            descriptors are only mapped with one
+        """
+        self.threshold = threshold
+        self.directory = directory
+        self.token = token
+
+    def should_use(self, np_list) -> bool:
+        if type(np_list) is not list:
+            np_list = [np_list]
+        return sum(np.asarray(nd).nbytes for nd in np_list) >= self.threshold
+
+    def encode(self, np_list) -> bytearray:
+        return to_descriptor(np_list, self.directory, self.token)
+
+    def accepts(self, data) -> bool:
+        """
+        Whether received content is decoded as a descriptor.
+
+        :param data: bytes-like content
+        """
+        return self.token is not None and is_descriptor(data)
+
+    def decode(self, data) -> list:
+        return from_descriptor(data, self.token, self.directory)
+
+
+_transport = None
+
+
+def get_transport():
+    """
+    Returns the shared memory transport configured with the
+    OPTION_SHM_TRANSPORT_THRESHOLD (bytes), OPTION_SHM_TRANSPORT_DIR and
+    OPTION_SHM_TRANSPORT_TOKEN environment variables, or None if it is not
+    enabled.
+    """
+    global _transport
+    threshold = os.getenv("OPTION_SHM_TRANSPORT_THRESHOLD")
+    if not threshold:
+        return None
+    if _transport is None:
+        _transport = SharedMemoryTransport(
+            int(threshold), get_directory(),
+            os.getenv("OPTION_SHM_TRANSPORT_TOKEN") or None)
+    return _transport
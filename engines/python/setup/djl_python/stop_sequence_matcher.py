@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file
+# except in compliance with the License. A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS"
+# BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+from functools import lru_cache
+from typing import Iterable, Tuple, Union
+
+
+class StopSequenceMatcher(object):
+    """
+    Finds stop sequences in streamed text with an Aho-Corasick automaton.
+
+    The matcher is immutable and shared by all the generations with the same
+    stop sequences. Each generation keeps its own state, an int, and feeds
+    only the newly generated text, so matches across token boundaries are
+    found in time linear in the new text.
+    """
+
+    __slots__ = ("stop_sequences", "_goto", "_fail", "_output")
+
+    def __init__(self, stop_sequences: Iterable[str]):
+        """
+        :param stop_sequences: the stop sequences, empty ones are ignored
+        """
+        self.stop_sequences = tuple(s for s in stop_sequences if s)
+        goto = [{}]
+        output = [None]
+        for stop_sequence in self.stop_sequences:
+            state = 0
+            for c in stop_sequence:
+                next_state = goto[state].get(c)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][c] = next_state
+                    goto.append({})
+                    output.append(None)
+                state = next_state
+            if output[state] is None:
+                output[state] = stop_sequence
+
+        # breadth first, the fail state of a state is always computed first
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for state in queue:
+            for c, next_state in goto[state].items():
+                fail_state = fail[state]
+                while fail_state and c not in goto[fail_state]:
+                    fail_state = fail[fail_state]
+                fail[next_state] = goto[fail_state].get(c, 0)
+                if output[next_state] is None:
+                    # a stop sequence that is a suffix of this one
+                    output[next_state] = output[fail[next_state]]
+                queue.append(next_state)
+
+        self._goto = goto
+        self._fail = fail
+        self._output = output
+
+    def feed(self, state: int, text: str) -> Tuple[int, int]:
+        """
+        Advances the state of a generation by the new text.
+
+        :param state: the state returned by the previous call, 0 initially
+        :param text: the newly generated text
+        :return: the new state and the end index of the first stop sequence
+            found in text, -1 if there is none
+        """
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        for i, c in enumerate(text):
+            next_state = goto[state].get(c)
+            while next_state is None and state:
+                state = fail[state]
+                next_state = goto[state].get(c)
+            state = next_state or 0
+            if output[state] is not None:
+                return state, i + 1
+        return state, -1
+
+
+@lru_cache(maxsize=128)
+def _get_matcher(stop_sequences: tuple) -> StopSequenceMatcher:
+    return StopSequenceMatcher(stop_sequences)
+
+
+def get_stop_sequence_matcher(
+    stop_sequences: Union[str, Iterable[str], None]
+) -> Union[StopSequenceMatcher, None]:
+    """
+    Gets the shared matcher of the stop sequences.
+
+    :param stop_sequences: a stop sequence or a list of them
+    :return: the matcher, None if there are no stop sequences
+    """
+    if not stop_sequences:
+        return None
+    if isinstance(stop_sequences, str):
+        stop_sequences = (stop_sequences, )
+    matcher = _get_matcher(tuple(stop_sequences))
+    if not matcher.stop_sequences:
+        return None
+    return matcher
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file
+# except in compliance with the License. A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS"
+# BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+from typing import List, Union
+
+import torch
+from transformers import StoppingCriteria
+
+from djl_python.stop_sequence_matcher import get_stop_sequence_matcher
+
+# tokens decoded before the new ones, so that the tokenizer adds the spaces
+# between the tokens as in the full text
+_PREFIX_TOKENS = 5
+
+
+class StopWord(StoppingCriteria):
+    """
+    Stops the generation once every sequence of the batch contains one of the
+    stop sequences. Each call only decodes and matches the new tokens.
+
+    Stop sequences are matched as plain text, not as regular expressions.
+    Beam search reorders the rows between steps, so with more than one beam
+    the last tokens of the first beam of every input are decoded and matched
+    again at each step instead.
+    """
+
+    def __init__(self, tokenizer, stop_seq: Union[str, List[str]]):
+        StoppingCriteria.__init__(self)
+        self.tokenizer = tokenizer
+        self.stop_seq = stop_seq
+        self.matcher = get_stop_sequence_matcher(stop_seq)
+        # tokens matched again with beam search, a token decodes to at least
+        # one character
+        self._window = max(map(
+            len, self.matcher.stop_sequences)) if self.matcher else 0
+        self.reset()
+
+    def reset(self, num_beams: int = 1):
+        """
+        Resets the state, called before each generation.
+
+        :param num_beams: the number of beams of the generation
+        """
+        self._num_beams = num_beams
+        self._seq_len = None
+        self._states = []
+        self._prefix_offsets = []
+        self._read_offsets = []
+        self._stopped = []
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor,
+                 **kwargs):
+        if self.matcher is None:
+            return False
+        if self._num_beams > 1:
+            return self._match_windows(input_ids)
+        batch_size, seq_len = input_ids.shape
+        if self._seq_len is None:
+            # the first call of a generation, only the last token is new
+            read_offset = seq_len - 1
+            prefix_offset = max(read_offset - _PREFIX_TOKENS, 0)
+            self._states = [0] * batch_size
+            self._prefix_offsets = [prefix_offset] * batch_size
+            self._read_offsets = [read_offset] * batch_size
+            self._stopped = [False] * batch_size
+        self._seq_len = seq_len
+
+        for i in range(batch_size):
+            if self._stopped[i]:
+                continue
+            prefix_offset = self._prefix_offsets[i]
+            read_offset = self._read_offsets[i]
+            ids = input_ids[i, prefix_offset:].tolist()
+            prefix_text = self.tokenizer.decode(ids[:read_offset -
+                                                    prefix_offset])
+            text = self.tokenizer.decode(ids)
+            if len(text) <= len(prefix_text) or text.endswith("�"):
+                # wait for the rest of a multi byte character
+                continue
+            self._prefix_offsets[i] = read_offset
+            self._read_offsets[i] = seq_len
+            self._states[i], end = self.matcher.feed(self._states[i],
+                                                     text[len(prefix_text):])
+            self._stopped[i] = end >= 0
+
+        return all(self._stopped)
+
+    def _match_windows(self, input_ids: torch.LongTensor) -> bool:
+        num_beams = self._num_beams
+        batch_size = input_ids.shape[0] // num_beams
+        if not self._stopped:
+            # only the index of an input is stable, not the row of its beams
+            self._stopped = [False] * batch_size
+        for i in range(batch_size):
+            if self._stopped[i]:
+                continue
+            text = self.tokenizer.decode(input_ids[i * num_beams,
+                                                   -self._window:].tolist())
+            self._stopped[i] = self.matcher.feed(0, text)[1] >= 0
+
+        return all(self._stopped)
@@ -13,6 +13,7 @@
 
 from djl_python.inputs import Input
 from djl_python.outputs import Output
+from djl_python.response_cache import create_response_cache
 from djl_python.rolling_batch.rolling_batch import get_content_type_from_output_formatter
 from djl_python.rolling_batch.trtllm_rolling_batch import TRTLLMRollingBatch
 from djl_python.properties_manager.trt_properties import TensorRtLlmProperties
@@ -37,7 +38,10 @@ class TRTLLMService(object):
         self.trt_configs = TensorRtLlmProperties(**properties)
 
         self.rolling_batch = TRTLLMRollingBatch(
-            self.trt_configs.model_id_or_path, properties, **properties)
+            self.trt_configs.model_id_or_path,
+            properties,
+            response_cache=create_response_cache(self.trt_configs),
+            **properties)
         self.input_format_configs = InputFormatConfigs(
             is_rolling_batch=True,
             is_adapters_supported=False,
@@ -0,0 +1,471 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file
+# except in compliance with the License. A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS"
+# BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+"""
+Micro benchmarks for the python engine socket protocol.
+
+Usage: python io_benchmark.py [benchmark ...]
+"""
+
+import argparse
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+
+script_directory = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.normpath(os.path.join(script_directory, "../../..")))
+
+import numpy as np
+
+from djl_python import json_util, np_util, shm_util
+from djl_python.inputs import Input, SocketReader, retrieve_buffer
+from djl_python.outputs import Output
+
+
+def _legacy_retrieve_buffer(conn, length):
+    data = bytearray()
+    while length > 0:
+        pkt = conn.recv(length)
+        if len(pkt) == 0:
+            raise ValueError("Connection disconnected")
+        data += pkt
+        length -= len(pkt)
+    return data
+
+
+def _send_repeatedly(conn, payload, reps):
+    for _ in range(reps):
+        conn.sendall(payload)
+
+
+def _bench_recv(read_fn, size, reps):
+    server, client = socket.socketpair()
+    payload = os.urandom(size)
+    writer = threading.Thread(target=_send_repeatedly,
+                              args=(client, payload, reps))
+    writer.start()
+    start = time.perf_counter()
+    for _ in range(reps):
+        read_fn(server, size)
+    elapsed = time.perf_counter() - start
+    writer.join()
+    server.close()
+    client.close()
+    return size * reps / elapsed
+
+
+def bench_recv():
+    print(
+        f"{'size':>8} {'legacy MB/s':>14} {'recv_into MB/s':>16} {'gain':>6}")
+    for name, size, reps in (("1KB", 1 << 10, 20000), ("1MB", 1 << 20, 500),
+                             ("64MB", 64 << 20, 10)):
+        legacy = _bench_recv(_legacy_retrieve_buffer, size, reps)
+        current = _bench_recv(retrieve_buffer, size, reps)
+        print(f"{name:>8} {legacy / 1e6:>14.1f} {current / 1e6:>16.1f} "
+              f"{current / legacy:>5.2f}x")
+
+
+class _CountingSocket(object):
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.recv_calls = 0
+
+    def recv_into(self, buffer, nbytes=0):
+        self.recv_calls += 1
+        return self.conn.recv_into(buffer, nbytes)
+
+
+def _encode_request(num_properties, body):
+    msg = bytearray(struct.pack(">h", num_properties))
+    for i in range(num_properties):
+        Output.write_utf8(msg, f"property_{i}")
+        Output.write_utf8(msg, f"value_{i}")
+    msg += struct.pack(">h", 1)
+    Output.write_utf8(msg, "data")
+    msg += struct.pack(">i", len(body))
+    msg += body
+    return bytes(msg)
+
+
+def bench_frame(reps=20000):
+    request = _encode_request(30, b'{"inputs": "Hello world"}')
+    print(f"{'reader':>10} {'recv/request':>14} {'us/request':>12}")
+    for name, buffered in (("legacy", False), ("buffered", True)):
+        server, client = socket.socketpair()
+        writer = threading.Thread(target=_send_repeatedly,
+                                  args=(client, request, reps))
+        writer.start()
+        counter = _CountingSocket(server)
+        conn = SocketReader(counter) if buffered else counter
+        start = time.perf_counter()
+        for _ in range(reps):
+            Input().read(conn)
+        elapsed = time.perf_counter() - start
+        writer.join()
+        server.close()
+        client.close()
+        print(f"{name:>10} {counter.recv_calls / reps:>14.2f} "
+              f"{elapsed / reps * 1e6:>12.2f}")
+
+
+def _drain(conn):
+    buf = bytearray(1 << 20)
+    while conn.recv_into(buf) > 0:
+        pass
+
+
+def bench_send(reps=20):
+    payload = os.urandom(64 << 20)
+    print(f"{'path':>10} {'MB/s':>10}")
+    for name, vectored in (("sendall", False), ("sendmsg", True)):
+        server, client = socket.socketpair()
+        reader = threading.Thread(target=_drain, args=(server, ))
+        reader.start()
+        outputs = Output().add(payload, key="data")
+        start = time.perf_counter()
+        for _ in range(reps):
+            if vectored:
+                outputs.send(client)
+            else:
+                msg = bytearray()
+                msg += payload
+                client.sendall(msg)
+        elapsed = time.perf_counter() - start
+        client.shutdown(socket.SHUT_WR)
+        reader.join()
+        server.close()
+        client.close()
+        print(f"{name:>10} {len(payload) * reps / elapsed / 1e6:>10.1f}")
+
+
+def _legacy_from_nd_list(encoded):
+    idx = 0
+    num_ele, idx = np_util.get_int(encoded, idx)
+    result = []
+    for _ in range(num_ele):
+        _, idx = np_util.get_str(encoded, idx)
+        _, idx = np_util.get_int(encoded, idx)
+        flag, idx = np_util.get_byte_as_int(encoded, idx)
+        if flag == 1:
+            _, idx = np_util.get_str(encoded, idx)
+        _, idx = np_util.get_str(encoded, idx)
+        datatype, idx = np_util.get_str(encoded, idx)
+        shape, idx = np_util._shape_decode(encoded, idx)
+        order, idx = np_util.get_byte_as_int(encoded, idx)
+        data_length, idx = np_util.get_int(encoded, idx)
+        data, idx = np_util.get_bytes(encoded, idx, data_length)
+        nd = np.ndarray(shape, np.dtype(datatype.lower()), data)
+        result.append(nd.newbyteorder(chr(order)))
+    return result
+
+
+def _legacy_to_nd_list(np_list):
+    arr = bytearray()
+    arr.extend(np_util.set_int(len(np_list)))
+    for nd in np_list:
+        arr.extend(np_util.set_str(np_util.MAGIC_NUMBER))
+        arr.extend(np_util.set_int(np_util.VERSION))
+        arr.append(0)
+        arr.extend(np_util.set_str("default"))
+        arr.extend(np_util.set_str(str(nd.dtype).upper()))
+        np_util._shape_encode(nd.shape, arr)
+        arr.append(ord('<'))
+        nd_bytes = nd.newbyteorder('<').tobytes("C")
+        arr.extend(np_util.set_int(len(nd_bytes)))
+        arr.extend(nd_bytes)
+    return arr
+
+
+def _time_per_call(func, arg, reps):
+    start = time.perf_counter()
+    for _ in range(reps):
+        func(arg)
+    return (time.perf_counter() - start) / reps * 1e6
+
+
+def bench_ndlist():
+    cases = (
+        ("1000 x (4,)", [np.ones(4, dtype=np.float32)] * 1000, 100),
+        ("4 x 64MB", [np.ones(16 << 20, dtype=np.float32)] * 4, 3),
+    )
+    print(f"{'case':>12} {'op':>8} {'legacy us':>12} {'current us':>12} "
+          f"{'gain':>6}")
+    for name, nd_list, reps in cases:
+        encoded = np_util.to_nd_list(nd_list)
+        for op, legacy, current, arg in (("encode", _legacy_to_nd_list,
+                                          np_util.to_nd_list_buffers, nd_list),
+                                         ("decode", _legacy_from_nd_list,
+                                          np_util.from_nd_list, encoded)):
+            legacy_us = _time_per_call(legacy, arg, reps)
+            current_us = _time_per_call(current, arg, reps)
+            print(f"{name:>12} {op:>8} {legacy_us:>12.1f} {current_us:>12.1f} "
+                  f"{legacy_us / current_us:>5.2f}x")
+
+
+def _transfer_numpy(nd_list, reps):
+    server, client = socket.socketpair()
+    start = time.perf_counter()
+    for _ in range(reps):
+        outputs = Output().add_as_numpy(nd_list, key="data")
+        outputs.add_property("Content-Type", "tensor/ndlist")
+        writer = threading.Thread(target=outputs.send, args=(client, ))
+        writer.start()
+        reader = SocketReader(server)
+        reader.read_short()
+        reader.read_utf8()
+        # reuse the output frame as an input frame after code and message
+        inputs = Input()
+        inputs.read(reader)
+        writer.join()
+        inputs.get_as_numpy("data")
+    elapsed = time.perf_counter() - start
+    server.close()
+    client.close()
+    return elapsed / reps * 1e3
+
+
+def bench_shm(reps=5):
+    print(f"{'case':>12} {'socket ms':>12} {'shm ms':>12} {'gain':>6}")
+    for name, nd_list in (("1 x 1MB", [np.ones(1 << 18, dtype=np.float32)]),
+                          ("1 x 256MB", [np.ones(64 << 20,
+                                                 dtype=np.float32)])):
+        os.environ.pop("OPTION_SHM_TRANSPORT_THRESHOLD", None)
+        socket_ms = _transfer_numpy(nd_list, reps)
+        os.environ["OPTION_SHM_TRANSPORT_THRESHOLD"] = "0"
+        os.environ["OPTION_SHM_TRANSPORT_TOKEN"] = "benchmark"
+        shm_util._transport = None
+        shm_ms = _transfer_numpy(nd_list, reps)
+        os.environ.pop("OPTION_SHM_TRANSPORT_THRESHOLD")
+        os.environ.pop("OPTION_SHM_TRANSPORT_TOKEN")
+        shm_util._transport = None
+        print(f"{name:>12} {socket_ms:>12.2f} {shm_ms:>12.2f} "
+              f"{socket_ms / shm_ms:>5.2f}x")
+
+
+class _FixedComputeService(object):
+    """
+    Fake model service that spends a fixed time outside of the GIL.
+    """
+
+    def __init__(self, compute_time):
+        self.compute_time = compute_time
+
+    def invoke_handler(self, function_name, inputs):
+        time.sleep(self.compute_time)
+        return Output().add(b"0" * 64, key="data")
+
+
+def _read_responses(conn, reps):
+    reader = SocketReader(conn)
+    for _ in range(reps):
+        reader.read_short()
+        reader.read_utf8()
+        for _ in range(reader.read_short()):
+            reader.read_utf8()
+            reader.read_utf8()
+        for _ in range(reader.read_short()):
+            reader.read_utf8()
+            reader.read_buffer(reader.read_int())
+
+
+def _serve(engine, conn, pipelined):
+    try:
+        if pipelined:
+            engine.serve_pipelined(conn)
+        else:
+            engine.serve(conn)
+    except ValueError:
+        # client disconnected
+        pass
+
+
+def bench_pipeline(reps=500, compute_time=0.002):
+    from djl_python_engine import PythonEngine
+
+    args = argparse.Namespace(sock_type="tcp",
+                              sock_name=None,
+                              port="0",
+                              device_id=-1,
+                              tensor_parallel_degree=None)
+    engine = PythonEngine(args, _FixedComputeService(compute_time))
+    engine.sock.close()
+    print(f"compute time per request: {compute_time * 1e3:.1f} ms")
+    print(f"{'payload':>8} {'serial ms':>10} {'pipelined ms':>13} "
+          f"{'overlap ms':>11}")
+    for name, size in (("1KB", 1 << 10), ("1MB", 1 << 20), ("8MB", 8 << 20)):
+        request = _encode_request(10, os.urandom(size))
+        result = []
+        for pipelined in (False, True):
+            server, client = socket.socketpair()
+            worker = threading.Thread(target=_serve,
+                                      args=(engine, server, pipelined))
+            worker.start()
+            writer = threading.Thread(target=_send_repeatedly,
+                                      args=(client, request, reps))
+            start = time.perf_counter()
+            writer.start()
+            _read_responses(client, reps)
+            elapsed = time.perf_counter() - start
+            writer.join()
+            client.shutdown(socket.SHUT_WR)
+            worker.join()
+            server.close()
+            client.close()
+            result.append(elapsed / reps * 1e3)
+        print(f"{name:>8} {result[0]:>10.3f} {result[1]:>13.3f} "
+              f"{result[0] - result[1]:>11.3f}")
+
+
+class _LegacyJSONEncoder(json.JSONEncoder):
+
+    def default(self, obj):
+        import datetime
+        if isinstance(obj, datetime.datetime):
+            return obj.__str__()
+
+        try:
+            import numpy as np
+            if isinstance(obj, np.integer):
+                return int(obj)
+            elif isinstance(obj, np.floating):
+                return float(obj)
+            elif isinstance(obj, np.ndarray):
+                return obj.tolist()
+        except ImportError:
+            pass
+
+        return super(_LegacyJSONEncoder, self).default(obj)
+
+
+def _legacy_encode_json(val):
+    return bytearray(
+        json.dumps(val,
+                   ensure_ascii=False,
+                   allow_nan=False,
+                   indent=2,
+                   cls=_LegacyJSONEncoder,
+                   separators=(",", ":")).encode("utf-8"))
+
+
+def bench_json(reps=200):
+    rng = np.random.default_rng(0)
+    embedding = rng.random((32, 1024), dtype=np.float32)
+    labels = [f"label_{i}" for i in range(10)]
+    cases = (
+        ("embedding ndarray", embedding),
+        ("embedding list", embedding.tolist()),
+        ("classification", [[{
+            "label": label,
+            "score": np.float32(score)
+        } for label, score in zip(labels, row[:10])] for row in embedding]),
+    )
+    encoders = [("legacy", _legacy_encode_json)]
+    for name in ("json", "orjson", "ujson"):
+        try:
+            encoders.append((name, json_util.create_encoder(name).dumps))
+        except ImportError:
+            pass
+    print(f"{'case':>18} {'encoder':>8} {'us':>10} {'bytes':>8} {'gain':>6}")
+    for case, value in cases:
+        legacy_us = None
+        for name, encode in encoders:
+            elapsed = _time_per_call(encode, value, reps)
+            legacy_us = legacy_us or elapsed
+            print(f"{case:>18} {name:>8} {elapsed:>10.1f} "
+                  f"{len(encode(value)):>8} {legacy_us / elapsed:>5.2f}x")
+
+
+def _batch_input(batch_size, body, release):
+    inputs = Input()
+    inputs.release_parsed_buffers = release
+    inputs.properties["batch_size"] = str(batch_size)
+    for i in range(batch_size):
+        inputs.content.add(key=f"batch_{i:03d}_data", value=bytearray(body))
+    return inputs
+
+
+def _legacy_parse_twice(inputs):
+    result = []
+    for item in inputs.get_batches():
+        # e.g. parse_input_with_formatter and then get_data in the handler
+        for _ in range(2):
+            parsed = json.loads(item.get_as_bytes().decode("utf-8"))
+        result.append(parsed)
+    return result
+
+
+def _parse_twice(inputs):
+    result = []
+    for item in inputs.get_batches():
+        # parse_input_with_formatter reads the kept object, the handler gets a
+        # copy
+        item.get_as_json(copy=False)
+        result.append(item.get_as_json())
+    return result
+
+
+def bench_parse(batch_size=256, reps=20):
+    body = json.dumps({
+        "inputs":
+        "The quick brown fox jumps over the lazy dog. " * 40,
+        "parameters": {
+            "max_new_tokens": 256,
+            "temperature": 0.7
+        }
+    }).encode("utf-8")
+    print(f"batch of {batch_size} x {len(body)} bytes")
+    print(f"{'parser':>10} {'ms/batch':>10} {'retained KB':>12}")
+    for name, parse, release in (("legacy", _legacy_parse_twice,
+                                  False), ("cached", _parse_twice, False),
+                                 ("released", _parse_twice, True)):
+        elapsed = 0.0
+        for _ in range(reps):
+            inputs = _batch_input(batch_size, body, release)
+            start = time.perf_counter()
+            parse(inputs)
+            elapsed += time.perf_counter() - start
+        tracemalloc.start()
+        inputs = _batch_input(batch_size, body, release)
+        parsed = parse(inputs)
+        retained = tracemalloc.get_traced_memory()[0]
+        del parsed
+        tracemalloc.stop()
+        print(f"{name:>10} {elapsed / reps * 1e3:>10.2f} "
+              f"{retained / 1024:>12.1f}")
+
+
+BENCHMARKS = {
+    "recv": bench_recv,
+    "frame": bench_frame,
+    "send": bench_send,
+    "ndlist": bench_ndlist,
+    "shm": bench_shm,
+    "pipeline": bench_pipeline,
+    "json": bench_json,
+    "parse": bench_parse,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmarks",
+                        nargs="*",
+                        help=f"benchmarks to run: {list(BENCHMARKS.keys())}")
+    args = parser.parse_args()
+    for bench in args.benchmarks or BENCHMARKS.keys():
+        print(f"==== {bench} ====")
+        BENCHMARKS[bench]()
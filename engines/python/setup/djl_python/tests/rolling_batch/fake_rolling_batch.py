@@ -23,6 +23,8 @@ class FakeRollingBatch(RollingBatch):
         """
         Initializes the FakeRollingBatch.
         """
+        kwargs.setdefault("max_prefill_tokens",
+                          properties.get("max_rolling_batch_prefill_tokens"))
         super().__init__(**kwargs)
         self.sample_text = (
             "DJL-Serving is a powerful and user-friendly deep learning model serving solution "
@@ -55,6 +57,10 @@ class FakeRollingBatch(RollingBatch):
         self.cache = OrderedDict()
         super().reset()
 
+    def abort_requests(self, requests):
+        for request in requests:
+            self.cache.pop(request.slot, None)
+
     @stop_on_any_exception
     def inference(self, input_data, parameters, adapters=None):
         batch_size = len(input_data)
@@ -66,9 +72,13 @@ class FakeRollingBatch(RollingBatch):
                 "max_new_tokens"] if "max_new_tokens" in new_request.parameters else 256
             min_len = new_request.parameters[
                 "min_new_tokens"] if "min_new_tokens" in new_request.parameters else 1
-            max_len = max(min_len, max_len)
-            max_len = random.randint(min_len, max_len)
-            self.cache[new_request.id] = {
+            try:
+                max_len = max(min_len, max_len)
+                max_len = random.randint(min_len, max_len)
+            except Exception as e:
+                self.fail_request(new_request, e)
+                continue
+            self.cache[new_request.slot] = {
                 "max_len": max_len,
                 "cur_pos": -1,
                 "finished": False
@@ -81,15 +91,17 @@ class FakeRollingBatch(RollingBatch):
                 value["finished"] = True
 
         finished_id = []
-        for (key, cache), request in zip(self.cache.items(),
-                                         self.active_requests):
+        for slot, cache in self.cache.items():
             # finish condition match
             if cache["finished"]:
-                finished_id.append(key)
+                finished_id.append(slot)
             token_id = self.tokens[cache["cur_pos"]]
             token_txt = " " + self.tokenizer.decode(token_id)
-            request.set_next_token(Token(token_id, token_txt),
-                                   cache["finished"])
+            self.request_table.get(slot).set_next_token(
+                Token(token_id, token_txt), cache["finished"])
+
+        for slot in finished_id:
+            self.cache.pop(slot)
 
         return self.postprocess_results()
 
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file
+# except in compliance with the License. A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS"
+# BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+"""
+Measures the CPU time the rolling batch bookkeeping (Request, Token and the
+output formatters) adds to every step, using FakeRollingBatch.
+
+    python -m djl_python.tests.rolling_batch_test_scripts.request_overhead_benchmark
+
+Without --model_id a character level tokenizer is built locally, so the
+benchmark runs offline.
+"""
+
+import argparse
+import random
+import string
+import tempfile
+import time
+
+from djl_python.tests.rolling_batch.fake_rolling_batch import FakeRollingBatch
+
+
+def build_tokenizer(directory: str) -> str:
+    from tokenizers import Regex, Tokenizer, models, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast
+
+    vocab = {"[UNK]": 0, "[PAD]": 1}
+    for c in string.printable:
+        vocab.setdefault(c, len(vocab))
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Split(Regex("."), "isolated")
+    PreTrainedTokenizerFast(tokenizer_object=tokenizer,
+                            unk_token="[UNK]",
+                            pad_token="[PAD]").save_pretrained(directory)
+    return directory
+
+
+def run(batcher, concurrency: int, max_new_tokens: int, details: bool,
+        output_formatter: str) -> float:
+    """
+    :return: mean time per step in milliseconds
+    """
+    batcher.reset()
+    prompts = [f"prompt {i}" for i in range(concurrency)]
+    parameters = [{
+        "max_new_tokens": max_new_tokens,
+        "min_new_tokens": max_new_tokens,
+        "details": details,
+        "output_formatter": output_formatter
+    } for _ in range(concurrency)]
+    steps = 0
+    start = time.perf_counter()
+    while True:
+        results = batcher.inference(prompts, parameters)
+        steps += 1
+        if all(result["last"] for result in results):
+            break
+    return (time.perf_counter() - start) / steps * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rolling batch per step overhead benchmark")
+    parser.add_argument("--model_id", type=str, default=None)
+    parser.add_argument("-c", "--concurrency", type=int, default=256)
+    parser.add_argument("--max_new_tokens", type=int, default=256)
+    parser.add_argument("-r", "--reps", type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_id = args.model_id
+        if model_id is None:
+            model_id = build_tokenizer(tmp_dir)
+        batcher = FakeRollingBatch(model_id, {})
+
+        print(f"{args.concurrency} requests, {args.max_new_tokens} tokens")
+        for output_formatter in ("json", "jsonlines"):
+            for details in (False, True):
+                best = min(
+                    run(batcher, args.concurrency, args.max_new_tokens,
+                        details, output_formatter) for _ in range(args.reps))
+                print(f"{output_formatter:10} details={str(details):5} "
+                      f"{best:8.3f} ms/step "
+                      f"{best * 1000 / args.concurrency:7.2f} us/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file
+# except in compliance with the License. A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS"
+# BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+import unittest
+
+from tokenizers import Tokenizer, decoders, models, normalizers, pre_tokenizers, trainers
+from transformers import PreTrainedTokenizerFast
+
+from djl_python.detokenizer import IncrementalDetokenizer
+from djl_python.vocabulary import VocabularyTable
+
+CORPUS = [
+    "hello world, naïve café", "日本語のテキスト 🙂 👍🏽", "über die straße!",
+    "ok\n  hello  world\n"
+] * 10
+
+TEXTS = ["hello world", " café 🙂 über", "日本語\nok  ", "straße, naïve 👍🏽!"]
+
+
+def byte_level_tokenizer(**kwargs):
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer.train_from_iterator(
+        CORPUS,
+        trainers.BpeTrainer(
+            vocab_size=300,
+            special_tokens=["<|endoftext|>"],
+            initial_alphabet=pre_tokenizers.ByteLevel.alphabet()))
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer,
+                                   eos_token="<|endoftext|>",
+                                   **kwargs)
+
+
+def sentencepiece_tokenizer():
+    tokenizer = Tokenizer(
+        models.BPE(byte_fallback=True, unk_token="<unk>", fuse_unk=True))
+    tokenizer.normalizer = normalizers.Sequence(
+        [normalizers.Prepend("▁"),
+         normalizers.Replace(" ", "▁")])
+    tokenizer.decoder = decoders.Sequence([
+        decoders.Replace("▁", " "),
+        decoders.ByteFallback(),
+        decoders.Fuse(),
+        decoders.Strip(" ", 1, 0)
+    ])
+    byte_tokens = [f"<0x{b:02X}>" for b in range(256)]
+    tokenizer.train_from_iterator(
+        CORPUS,
+        trainers.BpeTrainer(vocab_size=320,
+                            special_tokens=["<unk>", "<s>", "</s>"] +
+                            byte_tokens,
+                            limit_alphabet=20))
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer,
+                                   eos_token="</s>",
+                                   clean_up_tokenization_spaces=False)
+
+
+def metaspace_tokenizer():
+    tokenizer = Tokenizer(models.BPE(unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Metaspace()
+    tokenizer.decoder = decoders.Metaspace()
+    tokenizer.train_from_iterator(
+        CORPUS,
+        trainers.BpeTrainer(vocab_size=300, special_tokens=["<unk>", "</s>"]))
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer,
+                                   eos_token="</s>",
+                                   clean_up_tokenization_spaces=False)
+
+
+class TestDetokenizer(unittest.TestCase):
+
+    def _check(self, tokenizer, decoder_type):
+        detokenizer = IncrementalDetokenizer(tokenizer)
+        self.assertEqual(detokenizer.decoder_type, decoder_type)
+        token_ids = [
+            tokenizer.encode(text, add_special_tokens=False) +
+            [tokenizer.eos_token_id] for text in TEXTS
+        ]
+        states = [detokenizer.new_sequence() for _ in TEXTS]
+        outputs = [""] * len(TEXTS)
+        # sequences of different lengths in the same batch, one token a step
+        for step in range(max(len(ids) for ids in token_ids)):
+            texts = detokenizer.decode(
+                states, [ids[step:step + 1] for ids in token_ids])
+            for i, text in enumerate(texts):
+                outputs[i] += text
+        for ids, output in zip(token_ids, outputs):
+            self.assertEqual(output, tokenizer.decode(ids))
+            self.assertNotIn("�", output)
+
+    def test_byte_level(self):
+        self._check(byte_level_tokenizer(clean_up_tokenization_spaces=False),
+                    "byte_level")
+
+    def test_sentencepiece(self):
+        self._check(sentencepiece_tokenizer(), "sentencepiece")
+
+    def test_metaspace(self):
+        self._check(metaspace_tokenizer(), "metaspace")
+
+    def test_batch_decode_fallback(self):
+        self._check(byte_level_tokenizer(clean_up_tokenization_spaces=True),
+                    None)
+
+    def test_incomplete_character(self):
+        tokenizer = byte_level_tokenizer(clean_up_tokenization_spaces=False)
+        detokenizer = IncrementalDetokenizer(tokenizer)
+        state = detokenizer.new_sequence()
+        # the bytes of a multi-byte character in separate tokens
+        token_ids = [
+            tokenizer.convert_tokens_to_ids(c) for c in tokenizer.
+            backend_tokenizer.pre_tokenizer.pre_tokenize_str("🙂")[0][0]
+        ]
+        self.assertEqual(len(token_ids), 4)
+        texts = [detokenizer.decode([state], [[i]])[0] for i in token_ids]
+        self.assertEqual(texts, ["", "", "", "🙂"])
+
+
+class TestVocabularyTable(unittest.TestCase):
+
+    def test_vocabulary_table(self):
+        tokenizer = sentencepiece_tokenizer()
+        vocabulary = VocabularyTable(tokenizer)
+        self.assertEqual(len(vocabulary), len(tokenizer))
+        token_ids = tokenizer.encode(" ".join(TEXTS))
+        self.assertEqual(vocabulary.texts_of(token_ids),
+                         [tokenizer.decode([i]) for i in token_ids])
+        self.assertEqual(vocabulary.text(len(tokenizer) + 5),
+                         tokenizer.decode([len(tokenizer) + 5]))
+        self.assertTrue(vocabulary.is_special(tokenizer.eos_token_id))
+        self.assertFalse(vocabulary.is_special(token_ids[0]))
+        self.assertFalse(vocabulary.is_special(len(tokenizer)))
+
+    def test_vocabulary_bytes(self):
+        tokenizer = byte_level_tokenizer()
+        vocabulary = VocabularyTable(tokenizer)
+        # the tables are built on first use
+        self.assertIsNone(vocabulary._texts)
+        self.assertIsNone(vocabulary._bytes)
+        for text in TEXTS:
+            token_ids = tokenizer.encode(text)
+            self.assertEqual(vocabulary.bytes_of(token_ids),
+                             text.encode("utf-8"))
+        # a part of a UTF-8 character
+        token_ids = tokenizer.encode("🙂")
+        data = vocabulary.bytes_of(token_ids[:1])
+        self.assertTrue(0 < len(data) < 4)
+        self.assertTrue("🙂".encode("utf-8").startswith(data))
+        self.assertIsNone(vocabulary._texts)
+
+
+if __name__ == '__main__':
+    unittest.main()
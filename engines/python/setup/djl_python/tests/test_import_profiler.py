@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file
+# except in compliance with the License. A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS"
+# BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+import importlib
+import os
+import sys
+import tempfile
+import unittest
+
+from djl_python.import_profiler import ImportProfiler
+
+
+class TestImportProfiler(unittest.TestCase):
+
+    def test_import_times(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, "profiled_parent.py"), "w") as f:
+                f.write("import time\nimport profiled_child\n"
+                        "time.sleep(0.02)\n")
+            with open(os.path.join(tmp_dir, "profiled_child.py"), "w") as f:
+                f.write("import time\ntime.sleep(0.05)\n")
+            sys.path.insert(0, tmp_dir)
+            profiler = ImportProfiler()
+            try:
+                profiler.start()
+                importlib.import_module("profiled_parent")
+                profiler.end_phase("load")
+            finally:
+                profiler.stop()
+                sys.path.remove(tmp_dir)
+                sys.modules.pop("profiled_parent", None)
+                sys.modules.pop("profiled_child", None)
+
+        self.assertNotIn(profiler, sys.meta_path)
+        report = profiler.report()
+        self.assertEqual(report["phases"][0]["phase"], "load")
+        self.assertEqual(report["modules"], 2)
+        parent, child = report["top"]
+        self.assertEqual(parent["module"], "profiled_parent")
+        self.assertEqual(child["module"], "profiled_child")
+        self.assertGreaterEqual(child["self_ms"], 50)
+        self.assertGreaterEqual(parent["cumulative_ms"], 70)
+        self.assertLess(parent["self_ms"], parent["cumulative_ms"] - 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
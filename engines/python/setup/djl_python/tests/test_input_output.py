@@ -1,6 +1,16 @@
+import datetime
+import json
+import os
+import socket
+import struct
+import threading
+import time
 import unittest
+from unittest import mock
+
 import numpy as np
-from djl_python import test_model, Input, Output
+from djl_python import test_model, Input, Output, PairList, np_util, json_util
+from djl_python.inputs import SocketReader, retrieve_short, retrieve_utf8, retrieve_int, retrieve_buffer
 
 
 class TestInputOutput(unittest.TestCase):
@@ -33,6 +43,62 @@ class TestInputOutput(unittest.TestCase):
         result = inputs.get_as_npz()
         self.assertTrue(np.array_equal(result[0], nd[0]))
 
+    def test_pair_list(self):
+        pairs = PairList()
+        pairs.add("a", b"1")
+        pairs.add("b", b"2")
+        pairs.add("a", b"3")
+        self.assertEqual(pairs.get("a"), b"1")
+        pairs.add("a", b"0", index=0)
+        self.assertEqual(pairs.get("a"), b"0")
+        self.assertEqual(pairs.get("b"), b"2")
+        self.assertIsNone(pairs.get("c"))
+        # direct modification of the key list is still visible
+        pairs.keys.append("c")
+        pairs.values.append(b"4")
+        self.assertEqual(pairs.get("c"), b"4")
+        other = PairList(pair_map={"d": b"5"})
+        pairs.add_all(other)
+        self.assertEqual(pairs.get("d"), b"5")
+        self.assertEqual(pairs.size(), 6)
+
+    def test_get_property_ignore_case(self):
+        inputs = Input()
+        inputs.properties["Content-Type"] = "application/json"
+        inputs.properties["content-type"] = "text/plain"
+        self.assertEqual(inputs.get_property("CONTENT-TYPE"),
+                         "application/json")
+        del inputs.properties["Content-Type"]
+        self.assertEqual(inputs.get_property("Content-Type"), "text/plain")
+        inputs.properties.update({"X-Seed": "1"})
+        self.assertEqual(inputs.get_property("x-seed"), "1")
+        self.assertEqual(inputs.properties.pop("X-Seed"), "1")
+        self.assertIsNone(inputs.get_property("x-seed"))
+        # plain dict properties are still supported
+        inputs.properties = {"Accept": "text/plain"}
+        self.assertEqual(inputs.get_property("accept"), "text/plain")
+
+    def test_nd_list_codec(self):
+        nd_list = [
+            np.arange(12, dtype=np.float32).reshape(3, 4),
+            np.array(5, dtype=np.int64),
+            np.zeros((0, 3), dtype=np.float16),
+            np.arange(4, dtype=">i4"),
+            np.arange(20).reshape(4, 5)[:, ::2]
+        ]
+        encoded = np_util.to_nd_list(nd_list)
+        self.assertEqual(
+            encoded,
+            b"".join(bytes(b) for b in np_util.to_nd_list_buffers(nd_list)))
+        result = np_util.from_nd_list(encoded)
+        self.assertEqual(len(result), len(nd_list))
+        for expected, actual in zip(nd_list, result):
+            self.assertEqual(expected.shape, actual.shape)
+            self.assertTrue(np.array_equal(expected, actual))
+        # decoded arrays are views into the encoded buffer
+        self.assertFalse(result[0].flags.owndata)
+        self.assertEqual(np_util.from_nd_list(np_util.to_nd_list([])), [])
+
     def test_concurrent_batch(self):
         input_list = [{
             "inputs": "who win the oscar this year?",
@@ -54,6 +120,183 @@ class TestInputOutput(unittest.TestCase):
         for key, value in serving_properties.items():
             self.assertEqual(inputs.get_properties()[key], value)
 
+    @staticmethod
+    def _encode_request(payload, content_type="application/octet-stream"):
+        msg = bytearray(struct.pack(">h", 1))
+        Output.write_utf8(msg, "Content-Type")
+        Output.write_utf8(msg, content_type)
+        msg += struct.pack(">h", 1)
+        Output.write_utf8(msg, "data")
+        msg += struct.pack(">i", len(payload))
+        msg += payload
+        return msg
+
+    def test_read_from_socket(self):
+        payload = bytes(range(256)) * 4096
+        msg = self._encode_request(payload)
+
+        server, client = socket.socketpair()
+        writer = threading.Thread(target=client.sendall, args=(msg, ))
+        writer.start()
+        inputs = Input()
+        inputs.read(server)
+        writer.join()
+        server.close()
+        client.close()
+
+        self.assertEqual(inputs.get_property("content-type"),
+                         "application/octet-stream")
+        self.assertEqual(inputs.get_as_bytes(), payload)
+        view = inputs.get_as_buffer()
+        self.assertTrue(view.readonly)
+        self.assertEqual(view.nbytes, len(payload))
+        self.assertEqual(view.tobytes(), payload)
+
+    def test_read_from_socket_reader(self):
+        payloads = [b"small", bytes(range(256)) * 64, b"", b"x" * 100]
+        msg = bytearray()
+        for payload in payloads:
+            msg += self._encode_request(payload,
+                                        content_type="text/" + "a" * 300)
+
+        server, client = socket.socketpair()
+        writer = threading.Thread(target=client.sendall, args=(msg, ))
+        writer.start()
+        reader = SocketReader(server, buffer_size=256)
+        for payload in payloads:
+            reader.reset_stats()
+            inputs = Input()
+            inputs.read(reader)
+            self.assertEqual(inputs.get_property("Content-Type"),
+                             "text/" + "a" * 300)
+            self.assertEqual(inputs.get_as_bytes(), payload)
+            self.assertGreater(reader.get_stats()["recv_calls"], 0)
+        writer.join()
+        server.close()
+        client.close()
+
+    def test_read_batch_from_socket(self):
+        msg = bytearray(struct.pack(">h", 4))
+        for key, value in [("batch_size", "2"), ("batch_000_eula", "true"),
+                           ("batch_001_Content-Type", "text/plain"),
+                           ("handler", "handle")]:
+            Output.write_utf8(msg, key)
+            Output.write_utf8(msg, value)
+        msg += struct.pack(">h", 2)
+        for key, value in [("batch_000_data", b'{"inputs": "a"}'),
+                           ("batch_001_data", b"b")]:
+            Output.write_utf8(msg, key)
+            msg += struct.pack(">i", len(value))
+            msg += value
+
+        server, client = socket.socketpair()
+        client.sendall(msg)
+        inputs = Input()
+        inputs.read(server)
+        server.close()
+        client.close()
+
+        batches = inputs.get_batches()
+        self.assertEqual(len(batches), 2)
+        self.assertEqual(batches[0].properties, {"eula": "true"})
+        self.assertEqual(batches[0].get_as_json(), {"inputs": "a"})
+        self.assertEqual(batches[1].get_property("content-type"), "text/plain")
+        self.assertEqual(batches[1].get_as_string(), "b")
+        self.assertIs(batches[1].get_as_bytes(),
+                      inputs.get_content().value_at(1))
+
+        # each call returns new Inputs over the same slot index
+        slots = inputs._batch_slots
+        batches[0].properties.pop("eula")
+        batches[1].content.add("extra", b"x")
+        batches = inputs.get_batches()
+        self.assertIs(inputs._batch_slots, slots)
+        self.assertEqual(batches[0].properties, {"eula": "true"})
+        self.assertEqual(batches[1].content.get_keys(), ["data"])
+
+        inputs.properties["batch_001_seed"] = "1"
+        batches = inputs.get_batches()
+        self.assertEqual(batches[1].get_property("seed"), "1")
+
+        # changes that keep the number of properties and the content size
+        inputs.properties["batch_000_eula"] = "false"
+        batches = inputs.get_batches()
+        self.assertEqual(batches[0].properties, {"eula": "false"})
+        del inputs.properties["batch_001_seed"]
+        inputs.properties["batch_001_seed"] = "2"
+        self.assertEqual(inputs.get_batches()[1].get_property("seed"), "2")
+        inputs.content = PairList(keys=["batch_000_data", "batch_001_data"],
+                                  values=[b"c", b"d"])
+        batches = inputs.get_batches()
+        self.assertEqual(batches[0].get_as_string(), "c")
+        self.assertIsNot(inputs.get_batches(), batches)
+        inputs.properties = dict(inputs.properties, batch_001_seed="3")
+        self.assertEqual(inputs.get_batches()[1].get_property("seed"), "3")
+
+    def test_parsed_json_cache(self):
+        from djl_python.encode_decode import decode
+        from djl_python.utils import parse_input_with_formatter, InputFormatConfigs
+
+        msg = bytearray(struct.pack(">h", 1))
+        Output.write_utf8(msg, "batch_size")
+        Output.write_utf8(msg, "2")
+        msg += struct.pack(">h", 2)
+        for i in range(2):
+            value = b'{"inputs": "a", "parameters": {"max_new_tokens": 8}}'
+            Output.write_utf8(msg, f"batch_00{i}_data")
+            msg += struct.pack(">i", len(value))
+            msg += value
+
+        server, client = socket.socketpair()
+        client.sendall(msg)
+        inputs = Input()
+        inputs.release_parsed_buffers = True
+        inputs.read(server)
+        server.close()
+        client.close()
+
+        expected = {"inputs": "a", "parameters": {"max_new_tokens": 8}}
+        parsed = parse_input_with_formatter(
+            inputs, InputFormatConfigs(output_formatter="json"))
+        self.assertEqual(parsed.input_data, ["a", "a"])
+        self.assertEqual(parsed.parameters[0], {
+            "max_new_tokens": 8,
+            "output_formatter": "json"
+        })
+
+        batch = inputs.get_batches()[0]
+        result = batch.get_as_json()
+        # the parsed object is kept and was not modified by the parser
+        self.assertEqual(result, expected)
+        # every call returns a copy that may be modified
+        result["parameters"]["max_new_tokens"] = 1
+        self.assertEqual(batch.get_as_json(), expected)
+        self.assertEqual(inputs.get_as_json("batch_000_data"), expected)
+        self.assertEqual(decode(batch, None), expected)
+        # raw buffer is released and can't be read as bytes anymore
+        self.assertTrue(batch.is_parsed())
+        with self.assertRaises(ValueError):
+            inputs.get_as_bytes("batch_000_data")
+        with self.assertRaises(ValueError):
+            batch.get_as_string()
+
+        # without release the content is parsed once too
+        inputs = Input()
+        inputs.content.add("data", bytearray(b'{"a": [1]}'))
+        with mock.patch.object(json_util, "loads",
+                               wraps=json_util.loads) as loads:
+            result = inputs.get_as_json()
+            result["a"].append(2)
+            self.assertEqual(inputs.get_as_json(), {"a": [1]})
+            shared = inputs.get_as_json(copy=False)
+            self.assertIs(inputs.get_as_json(copy=False), shared)
+            parsed = parse_input_with_formatter(inputs, InputFormatConfigs())
+            self.assertEqual(loads.call_count, 1)
+        self.assertEqual(parsed.input_data, [{"a": [1]}])
+        self.assertEqual(shared, {"a": [1]})
+        self.assertFalse(inputs.is_parsed())
+        self.assertEqual(inputs.get_as_string(), '{"a": [1]}')
+
     def test_output(self):
         test_dict = {"Key": "Value"}
         nd = [np.ones((1, 3, 2))]
@@ -66,6 +309,53 @@ class TestInputOutput(unittest.TestCase):
         result = test_model.extract_output_as_npz(outputs, "npz")
         self.assertTrue(np.array_equal(result[0], nd[0]))
 
+    def test_json_encoders(self):
+        value = {
+            "label": "猫",
+            "score": np.float32(0.5),
+            "index": np.int64(3),
+            "flag": np.bool_(True),
+            "embedding": np.arange(6, dtype=np.float32).reshape(2, 3),
+            "strided": np.arange(6)[::2],
+            "time": datetime.datetime(2024, 1, 1),
+        }
+        expected = {
+            "label": "猫",
+            "score": 0.5,
+            "index": 3,
+            "flag": True,
+            "embedding": [[0.0, 1.0, 2.0], [3.0, 4.0, 5.0]],
+            "strided": [0, 2, 4],
+            "time": "2024-01-01 00:00:00",
+        }
+        for name in ("json", "orjson", "auto"):
+            try:
+                encoder = json_util.create_encoder(name)
+            except ImportError:
+                continue
+            encoded = encoder.dumps(value)
+            self.assertNotIn(b"\n", encoded)
+            self.assertEqual(json.loads(encoded), expected)
+            self.assertEqual(json.loads(encoder.dumps(np.ones(2))), [1.0, 1.0])
+
+        json_util.set_encoder(None)
+        try:
+            # the json module is the default, whatever is installed
+            with mock.patch.dict(os.environ, {}, clear=True):
+                self.assertEqual(json_util.get_encoder().name, "json")
+            outputs = Output().error("failed")
+            self.assertEqual(
+                outputs.content.value_at(0),
+                b'{"code":424,"message":"prediction failure","error":"failed"}'
+            )
+            self.assertEqual(Output._default_stream_output_formatter(["a"]),
+                             b'{"outputs":["a"]}\n')
+            for value in (float("nan"), float("inf")):
+                with self.assertRaises(ValueError):
+                    Output().add_as_json({"score": value})
+        finally:
+            json_util.set_encoder(None)
+
     def test_print_message(self):
         nd = [np.ones((1, 3, 2))]
         inputs = test_model.create_numpy_request(nd, "mydata")
@@ -76,6 +366,114 @@ mydata: [array([[[1., 1.],
         [1., 1.]]])]'''
         self.assertEqual(result, expected)
 
+    def test_send_output(self):
+        nd = np.arange(12, dtype=np.float32).reshape(3, 4)
+        outputs = Output().add_property("content-type", "tensor/ndlist")
+        outputs.add(b"bytes", key="a").add(bytearray(b"bytearray"), key="b")
+        outputs.add(memoryview(nd), key="c")
+
+        server, client = socket.socketpair()
+        outputs.send(client)
+        self.assertEqual(retrieve_short(server), 200)
+        self.assertEqual(retrieve_utf8(server), "OK")
+        self.assertEqual(retrieve_short(server), 1)
+        self.assertEqual(retrieve_utf8(server), "content-type")
+        self.assertEqual(retrieve_utf8(server), "tensor/ndlist")
+        self.assertEqual(retrieve_short(server), 3)
+        received = {}
+        for _ in range(3):
+            key = retrieve_utf8(server)
+            received[key] = retrieve_buffer(server, retrieve_int(server))
+        server.close()
+        client.close()
+        self.assertEqual(received["a"], b"bytes")
+        self.assertEqual(received["b"], b"bytearray")
+        self.assertEqual(received["c"], nd.tobytes())
+
+    def test_send_stream_with_partial_writes(self):
+
+        class PartialSocket(object):
+
+            def __init__(self):
+                self.data = bytearray()
+
+            def sendmsg(self, buffers):
+                # only accept a few bytes per call
+                sent = 0
+                for buf in buffers:
+                    chunk = bytes(buf[:7 - sent])
+                    self.data += chunk
+                    sent += len(chunk)
+                    if sent == 7:
+                        break
+                return sent
+
+            def sendall(self, data):
+                self.data += data
+
+        outputs = Output().add_stream_content(iter(["Hello", " world"]), None)
+        conn = PartialSocket()
+        outputs.send(conn)
+        expected = bytearray()
+        expected += struct.pack(">h", 200)
+        Output.write_utf8(expected, "OK")
+        expected += struct.pack(">hh", 0, -1)
+        for text in [b"Hello", b" world"]:
+            expected += b"\1" + struct.pack(">i", len(text)) + text
+        expected += b"\0" + struct.pack(">i", 0)
+        self.assertEqual(conn.data, expected)
+
+    def test_send_coalesced_stream(self):
+
+        def tokens():
+            for i in range(10):
+                yield f"token{i} "
+            time.sleep(0.05)
+            yield "last"
+
+        outputs = Output().add_stream_content(tokens(), None)
+        outputs.set_stream_coalescing(max_bytes=1024, max_delay=0.02)
+        server, client = socket.socketpair()
+        outputs.send(client)
+        client.close()
+        self.assertEqual(retrieve_short(server), 200)
+        self.assertEqual(retrieve_utf8(server), "OK")
+        self.assertEqual(retrieve_short(server), 0)
+        self.assertEqual(retrieve_short(server), -1)
+        text = ""
+        while retrieve_buffer(server, 1)[0] == 1:
+            text += retrieve_buffer(server, retrieve_int(server)).decode()
+        self.assertEqual(retrieve_int(server), 0)
+        server.close()
+        self.assertEqual(text,
+                         "".join(f"token{i} " for i in range(10)) + "last")
+        self.assertEqual(outputs.stream_chunks, 11)
+        self.assertLess(outputs.stream_frames, outputs.stream_chunks)
+
+    def test_coalesced_stream_client_gone(self):
+        server, client = socket.socketpair()
+        generated = []
+
+        def tokens():
+            while True:
+                if len(generated) == 1:
+                    server.close()
+                generated.append(len(generated))
+                yield "token "
+
+        outputs = Output().add_stream_content(tokens(), None)
+        outputs.set_stream_coalescing(max_bytes=16, max_delay=0.02)
+        with self.assertRaises(OSError):
+            outputs.send(client)
+        client.close()
+        # the generation stops with the stream
+        self.assertFalse(
+            any(thread.name == "djl-stream-producer"
+                for thread in threading.enumerate()))
+        count = len(generated)
+        time.sleep(0.05)
+        self.assertEqual(len(generated), count)
+
     def test_finalize(self):
 
         def finalize_func(a, b, c):
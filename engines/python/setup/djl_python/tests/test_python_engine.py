@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file
+# except in compliance with the License. A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS"
+# BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+import argparse
+import os
+import random
+import socket
+import struct
+import threading
+import time
+import types
+import unittest
+from unittest import mock
+
+from djl_python import Output
+from djl_python.inputs import SocketReader
+from djl_python.service_loader import ModelService, thread_safe
+from djl_python_engine import PythonEngine
+
+
+class EchoService(object):
+
+    def invoke_handler(self, function_name, inputs):
+        time.sleep(random.random() / 1000)
+        request_id = inputs.get_property("id")
+        if request_id == "stream":
+            return Output().add_stream_content(iter(["a", "b"]),
+                                               output_formatter=None)
+        return Output().add(request_id, key="id")
+
+
+class ConcurrencyTracker(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def handle(self, inputs):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.1)
+        with self.lock:
+            self.running -= 1
+        return Output().add(inputs.get_property("id"), key="id")
+
+    def stream(self, inputs):
+
+        def generate():
+            with self.lock:
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            time.sleep(0.1)
+            yield inputs.get_property("id")
+            with self.lock:
+                self.running -= 1
+
+        # the model runs while the output is sent
+        return Output().add_stream_content(generate(), output_formatter=None)
+
+
+def encode_request(request_id: str, function_name: str = None):
+    msg = bytearray(struct.pack(">h", 2 if function_name else 1))
+    Output.write_utf8(msg, "id")
+    Output.write_utf8(msg, request_id)
+    if function_name:
+        Output.write_utf8(msg, "handler")
+        Output.write_utf8(msg, function_name)
+    msg += struct.pack(">h", 1)
+    Output.write_utf8(msg, "data")
+    msg += struct.pack(">i", 4096)
+    msg += bytes(4096)
+    return msg
+
+
+def read_response(reader: SocketReader) -> bytes:
+    reader.read_short()
+    reader.read_utf8()
+    for _ in range(reader.read_short()):
+        reader.read_utf8()
+        reader.read_utf8()
+    size = reader.read_short()
+    if size < 0:
+        data = bytearray()
+        while reader.read_buffer(1) == b'\1':
+            data += reader.read_buffer(reader.read_int())
+        reader.read_int()
+        return bytes(data)
+    data = None
+    for _ in range(size):
+        reader.read_utf8()
+        data = bytes(reader.read_buffer(reader.read_int()))
+    return data
+
+
+class TestPythonEngine(unittest.TestCase):
+
+    @staticmethod
+    def create_engine(service) -> PythonEngine:
+        args = argparse.Namespace(sock_type="tcp",
+                                  sock_name=None,
+                                  port="0",
+                                  device_id=-1,
+                                  tensor_parallel_degree=None)
+        return PythonEngine(args, service)
+
+    def setUp(self):
+        self.engine = self.create_engine(EchoService())
+        self.engine.sock.close()
+
+    def test_serve_pipelined(self):
+        server, client = socket.socketpair()
+        errors = []
+
+        def serve():
+            try:
+                self.engine.serve_pipelined(server)
+            except ValueError as e:
+                errors.append(e)
+
+        worker = threading.Thread(target=serve)
+        worker.start()
+        request_ids = [str(i) for i in range(50)]
+        request_ids.insert(10, "stream")
+        for request_id in request_ids:
+            client.sendall(encode_request(request_id))
+
+        reader = SocketReader(client)
+        for request_id in request_ids:
+            expected = b"ab" if request_id == "stream" else request_id.encode()
+            self.assertEqual(expected, read_response(reader))
+
+        # client disconnect stops the server
+        client.shutdown(socket.SHUT_WR)
+        worker.join(timeout=10)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(len(errors), 1)
+        server.close()
+        client.close()
+
+    @mock.patch.dict(os.environ, {"OPTION_CONCURRENT_CONNECTIONS": "4"})
+    def test_serve_concurrently(self):
+        safe = ConcurrencyTracker()
+        unsafe = ConcurrencyTracker()
+        module = types.SimpleNamespace(
+            safe=thread_safe(lambda inputs: safe.handle(inputs)),
+            unsafe=unsafe.handle,
+            unsafe_stream=unsafe.stream)
+        engine = self.create_engine(ModelService(module, "."))
+        errors = []
+
+        def run_server():
+            try:
+                engine.run_server()
+            except ValueError as e:
+                errors.append(e)
+
+        server = threading.Thread(target=run_server, daemon=True)
+        server.start()
+        while engine.sock.getsockname()[1] == 0:
+            time.sleep(0.01)
+        # wait for listen()
+        time.sleep(0.1)
+        clients = [
+            socket.create_connection(engine.sock.getsockname())
+            for _ in range(4)
+        ]
+
+        for function_name, tracker in (("safe", safe), ("unsafe", unsafe)):
+            for i, client in enumerate(clients):
+                client.sendall(encode_request(str(i), function_name))
+            for i, client in enumerate(clients):
+                self.assertEqual(
+                    str(i).encode(), read_response(SocketReader(client)))
+        self.assertEqual(safe.max_running, 4)
+        self.assertEqual(unsafe.max_running, 1)
+
+        for i, client in enumerate(clients):
+            function_name = "unsafe_stream" if i % 2 else "unsafe"
+            client.sendall(encode_request(str(i), function_name))
+        for i, client in enumerate(clients):
+            self.assertEqual(
+                str(i).encode(), read_response(SocketReader(client)))
+        self.assertEqual(unsafe.max_running, 1)
+
+        for client in clients:
+            client.close()
+        server.join(timeout=10)
+        self.assertFalse(server.is_alive())
+        self.assertEqual(len(errors), 1)
+        engine.sock.close()
+
+    @mock.patch.dict(os.environ, {"OPTION_CONCURRENT_CONNECTIONS": "4"})
+    @mock.patch("djl_python_engine.SOCKET_ACCEPT_TIMEOUT", 0.5)
+    def test_serve_fewer_connections(self):
+        engine = self.create_engine(EchoService())
+        errors = []
+
+        def run_server():
+            try:
+                engine.run_server()
+            except ValueError as e:
+                errors.append(e)
+
+        server = threading.Thread(target=run_server, daemon=True)
+        server.start()
+        while engine.sock.getsockname()[1] == 0:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        first = socket.create_connection(engine.sock.getsockname())
+        first.sendall(encode_request("0"))
+        self.assertEqual(b"0", read_response(SocketReader(first)))
+
+        # accept timeouts after the first connection are not fatal
+        time.sleep(1.2)
+        self.assertTrue(server.is_alive())
+        second = socket.create_connection(engine.sock.getsockname())
+        second.sendall(encode_request("1"))
+        self.assertEqual(b"1", read_response(SocketReader(second)))
+        first.sendall(encode_request("2"))
+        self.assertEqual(b"2", read_response(SocketReader(first)))
+
+        first.close()
+        server.join(timeout=10)
+        self.assertFalse(server.is_alive())
+        self.assertEqual(len(errors), 1)
+        second.close()
+        engine.sock.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
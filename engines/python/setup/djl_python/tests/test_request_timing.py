@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file
+# except in compliance with the License. A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS"
+# BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+import socket
+import threading
+import time
+import unittest
+
+from djl_python import request_timing
+from djl_python.inputs import Input, SocketReader
+from djl_python.outputs import Output
+from djl_python.tests import test_input_output
+
+
+class TestRequestTiming(unittest.TestCase):
+
+    def tearDown(self):
+        request_timing.activate(None)
+        request_timing.disable()
+
+    def test_histogram(self):
+        histogram = request_timing.StageHistogram()
+        for _ in range(90):
+            histogram.add(0.0001)
+        for _ in range(10):
+            histogram.add(0.1)
+        summary = histogram.summary()
+        self.assertEqual(summary["count"], 100)
+        self.assertLess(summary["p50_ms"], 0.2)
+        self.assertGreater(summary["p99_ms"], 50)
+        self.assertEqual(summary["max_ms"], 100)
+
+    def test_disabled(self):
+        self.assertIsNone(request_timing.new_request())
+        span = request_timing.span("tokenize")
+        self.assertIs(span, request_timing.span("decode"))
+        with span:
+            pass
+        request_timing.record("decode", 1.0)
+        request_timing.finish(None)
+
+    def test_spans(self):
+        request_timing.enable(log_interval=3600)
+        timing = request_timing.new_request()
+        request_timing.activate(timing)
+        with request_timing.span("decode"):
+            time.sleep(0.01)
+        with request_timing.span("decode"):
+            time.sleep(0.01)
+        request_timing.record("prefill", 0.005)
+        request_timing.activate(None)
+        with request_timing.span("ignored"):
+            pass
+        self.assertGreaterEqual(timing.stages["decode"], 0.02)
+        self.assertEqual(timing.stages["prefill"], 0.005)
+        self.assertNotIn("ignored", timing.stages)
+
+        request_timing.finish(timing)
+        summary = request_timing.get_registry().get_summary()
+        self.assertEqual(set(summary), {"decode", "prefill", "total"})
+        self.assertEqual(summary["total"]["count"], 1)
+
+        with self.assertLogs(level="INFO") as logs:
+            request_timing.get_registry().log_metrics()
+        self.assertIn("Request timing:", logs.output[0])
+        self.assertEqual(request_timing.get_registry().get_summary(), {})
+
+    def test_socket_stages(self):
+        request_timing.enable(log_interval=3600)
+        timing = request_timing.new_request()
+        request_timing.activate(timing)
+        server, client = socket.socketpair()
+        try:
+            data = test_input_output.TestInputOutput._encode_request(b"a" *
+                                                                     1000000)
+            writer = threading.Thread(target=client.sendall, args=(data, ))
+            writer.start()
+            reader = SocketReader(server)
+            Input().read(reader)
+            writer.join()
+            self.assertGreater(reader.recv_time, 0)
+
+            outputs = Output().add("hello")
+            outputs.send(server)
+            self.assertIn("encode", timing.stages)
+            self.assertIn("send", timing.stages)
+        finally:
+            server.close()
+            client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
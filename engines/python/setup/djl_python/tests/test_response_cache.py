@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file
+# except in compliance with the License. A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS"
+# BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+import unittest
+from unittest import mock
+
+from djl_python.response_cache import ResponseCache, json_response_size
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def test_key(self):
+        cache = ResponseCache(1024, 60, namespace="model@main")
+        key = cache.key("prompt", {"max_new_tokens": 5, "seed": "1"}, False)
+        # greedy requests ignore the seed, the parameter order doesn't matter
+        self.assertEqual(
+            key, cache.key("prompt", {
+                "seed": "2",
+                "max_new_tokens": 5
+            }, False))
+        self.assertNotEqual(key,
+                            cache.key("prompt ", {"max_new_tokens": 5}, False))
+        self.assertNotEqual(key,
+                            cache.key("prompt", {"max_new_tokens": 6}, False))
+        self.assertNotEqual(
+            key, cache.key("prompt", {"max_new_tokens": 5}, False,
+                           adapter="a"))
+        self.assertNotEqual(
+            key,
+            ResponseCache(1024, 60,
+                          namespace="model@dev").key("prompt",
+                                                     {"max_new_tokens": 5},
+                                                     False))
+
+        # the backend decides whether a request samples, whatever its
+        # parameters are
+        sampled = {"decoding_strategy": "sample", "seed": "1"}
+        self.assertIsNotNone(cache.key("prompt", sampled, False))
+        self.assertIsNone(cache.key("prompt", sampled, True))
+        cache = ResponseCache(1024, 60, allow_seeded=True)
+        self.assertIsNotNone(cache.key("prompt", sampled, True))
+        self.assertIsNone(cache.key("prompt", {"do_sample": True}, True))
+        self.assertIsNone(cache.key("prompt", {"stop": object()}, False))
+
+    def test_lru(self):
+        cache = ResponseCache(100, 60)
+        cache.put("a", "A", 40)
+        cache.put("b", "B", 40)
+        self.assertEqual(cache.get("a"), "A")
+        cache.put("c", "C", 40)
+        # b is the least recently used
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), "C")
+        cache.put("d", "D", 101)
+        self.assertIsNone(cache.get("d"))
+        self.assertEqual(cache.size, 80)
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 2)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["entries"], 2)
+
+    def test_ttl(self):
+        cache = ResponseCache(100, 10)
+        with mock.patch("time.monotonic", return_value=100.0):
+            cache.put("a", "A", 10)
+        with mock.patch("time.monotonic", return_value=109.0):
+            self.assertEqual(cache.get("a"), "A")
+        with mock.patch("time.monotonic", return_value=110.0):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.size, 0)
+        self.assertEqual(cache.expirations, 1)
+
+    def test_json_response_size(self):
+        small = json_response_size([{"generated_text": "a"}])
+        large = json_response_size([{"generated_text": "a" * 1000}])
+        self.assertEqual(large - small, 999)
+        self.assertIsNone(json_response_size([{"scores": object()}]))
+
+    def test_pipeline_outputs(self):
+        from djl_python.huggingface import HuggingFaceService
+
+        service = HuggingFaceService()
+        service.response_cache = ResponseCache(1 << 20, 60)
+        service.hf_pipeline = mock.Mock(
+            side_effect=lambda inputs, **kwargs: [{
+                "generated_text": text + "!"
+            } for text in inputs])
+
+        prediction = service._run_pipeline(["a", "b"], [1, 1], {})
+        self.assertEqual(prediction, [{
+            "generated_text": "a!"
+        }, {
+            "generated_text": "b!"
+        }])
+        # changes to the predictions don't reach the cache
+        prediction[0]["generated_text"] = "changed"
+        prediction = service._run_pipeline(["a"], [1], {})
+        self.assertEqual(prediction, [{"generated_text": "a!"}])
+        prediction[0].clear()
+        prediction = service._run_pipeline(["a"], [1], {})
+        self.assertEqual(prediction, [{"generated_text": "a!"}])
+        self.assertEqual(service.hf_pipeline.call_count, 1)
+        self.assertEqual(service.response_cache.hits, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
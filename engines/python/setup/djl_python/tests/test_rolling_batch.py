@@ -2,7 +2,49 @@ import json
 import unittest
 
 import djl_python.rolling_batch.rolling_batch
-from djl_python.rolling_batch.rolling_batch import Request, Token, _json_output_formatter, _jsonlines_output_formatter
+from djl_python.response_cache import ResponseCache
+from djl_python.rolling_batch.rolling_batch import Request, RequestTable, RollingBatch, Token, _json_output_formatter, _jsonlines_output_formatter
+
+
+class EchoRollingBatch(RollingBatch):
+    """
+    Generates the input text max_new_tokens times.
+    """
+
+    def inference(self, input_data, parameters, adapters=None):
+        self.get_new_requests(input_data, parameters, len(input_data))
+        for request in self.request_table:
+            if request.last_token:
+                continue
+            last = len(request.generated_tokens
+                       ) + 1 >= request.parameters["max_new_tokens"]
+            request.set_next_token(request.input_text, last_token=last)
+        return self.postprocess_results()
+
+    def abort_requests(self, requests):
+        self.aborted = [request.input_text for request in requests]
+
+    def preprocess_requests(self, requests):
+        pass
+
+    def get_tokenizer(self):
+        return WordTokenizer()
+
+
+class SamplingEchoRollingBatch(EchoRollingBatch):
+    """
+    Samples unless the request asks for greedy decoding, like a backend
+    configured with sampling as its default.
+    """
+
+    def uses_sampling(self, parameters):
+        return parameters.get("decoding_strategy", "sample") == "sample"
+
+
+class WordTokenizer(object):
+
+    def encode(self, text):
+        return text.split()
 
 
 class TestRollingBatch(unittest.TestCase):
@@ -465,6 +507,463 @@ class TestRollingBatch(unittest.TestCase):
             7
         }
 
+    def test_token_cache(self):
+        req = Request(0,
+                      "This is a wonderful day",
+                      parameters={"max_new_tokens": 256},
+                      details=True,
+                      input_ids=[1, 2, 3],
+                      output_formatter=_jsonlines_output_formatter)
+        self.assertFalse(hasattr(req, "__dict__"))
+        req.set_next_token(Token(244, "He", -0.334532))
+        self.assertEqual(req.token_cache, [{
+            "id": [244],
+            "text": "He",
+            "log_prob": -0.334532
+        }])
+        req.set_next_token(Token(576, "llo", special_token=True), True,
+                           "length")
+        self.assertEqual(req.token_cache[-1], {
+            "id": [576],
+            "text": "llo",
+            "special_token": True
+        })
+        details = req.get_details("length")
+        self.assertEqual(details["generated_tokens"], 2)
+        self.assertEqual(details["prompt_tokens"], 3)
+        self.assertIs(details["tokens"], req.token_cache)
+
+        req = Request(1, "Hi", parameters={})
+        req.set_next_token("Hello", True)
+        self.assertIsNone(req.token_cache)
+        self.assertEqual(req.get_details("error"), {"finish_reason": "error"})
+
+    def test_json_chat_fmt(self):
+        req = Request(3,
+                      "Hi",
+                      parameters={
+                          "details": True,
+                          "logprobs": True
+                      },
+                      details=True,
+                      input_ids=[1, 2],
+                      output_formatter="json_chat")
+        final_str = []
+        req.set_next_token(Token(244, "He\"", -0.25))
+        final_str.append(req.get_next_token())
+        req.reset_next_token()
+        req.set_next_token(Token(576, "llo", -0.5), True, "length")
+        final_str.append(req.get_next_token())
+        final_json = json.loads(''.join(final_str))
+        self.assertEqual(final_json["choices"][0]["message"]["content"],
+                         "He\"llo")
+        self.assertEqual(
+            final_json["choices"][0]["logprobs"]["content"][0], {
+                "token":
+                "He\"",
+                "logprob":
+                -0.25,
+                "bytes": [72, 101, 34],
+                "top_logprobs": [{
+                    "token": "He\"",
+                    "logprob": -0.25,
+                    "bytes": [72, 101, 34]
+                }]
+            })
+        self.assertEqual(final_json["choices"][0]["finish_reason"], "length")
+        self.assertEqual(final_json["usage"], {
+            "prompt_tokens": 2,
+            "completion_tokens": 2,
+            "total_tokens": 4
+        })
+
+    def test_jsonlines_chat_fmt(self):
+        req = Request(3,
+                      "Hi",
+                      parameters={
+                          "details": True,
+                          "logprobs": True
+                      },
+                      details=True,
+                      output_formatter="jsonlines_chat")
+        req.set_next_token(Token(244, "He", -0.25))
+        result = json.loads(req.get_next_token())
+        self.assertEqual(result["id"], "chatcmpl-3")
+        self.assertEqual(result["choices"][0]["delta"], {
+            "content": "He",
+            "role": "assistant"
+        })
+        self.assertEqual(
+            result["choices"][0]["logprobs"][0]["content"][0]["bytes"],
+            [72, 101])
+        req.reset_next_token()
+        # the UTF-8 bytes, not the code points
+        req.set_next_token(Token(577, "é", -0.5))
+        result = json.loads(req.get_next_token())
+        self.assertEqual(
+            result["choices"][0]["logprobs"][0]["content"][0]["bytes"],
+            [195, 169])
+        req.reset_next_token()
+        req.set_next_token(Token(576, "llo", -0.5), True, "length")
+        result = json.loads(req.get_next_token())
+        self.assertEqual(result["choices"][0]["delta"], {"content": "llo"})
+        self.assertEqual(result["choices"][0]["finish_reason"], "length")
+
+        # the bytes of a part of a character are looked up by token id
+        class Vocabulary(object):
+
+            def bytes_of(self, token_ids):
+                return b"".join(bytes([i]) for i in token_ids)
+
+        req = Request(4,
+                      "Hi",
+                      parameters={
+                          "details": True,
+                          "logprobs": True
+                      },
+                      details=True,
+                      output_formatter="jsonlines_chat")
+        req.use_vocabulary(Vocabulary())
+        req.set_next_token(Token(240, "\ufffd", -0.25))
+        result = json.loads(req.get_next_token())
+        self.assertEqual(
+            result["choices"][0]["logprobs"][0]["content"][0]["bytes"], [240])
+        req = Request(5, "Hi", parameters={}, output_formatter="jsonlines")
+        req.use_vocabulary(Vocabulary())
+        self.assertIsNone(req.vocabulary)
+
+    def test_request_table(self):
+        rolling_batch = EchoRollingBatch(output_formatter="none")
+        inputs = ["a", "b", "c"]
+        params = [{"max_new_tokens": n} for n in (1, 3, 2)]
+        results = rolling_batch.inference(inputs, params)
+        self.assertEqual([r["data"] for r in results], ["a", "b", "c"])
+        self.assertEqual([r["last"] for r in results], [True, False, False])
+        self.assertEqual([r.slot for r in rolling_batch.request_table], [1, 2])
+
+        # the frontend drops finished requests and appends new ones
+        inputs = ["b", "c", "d"]
+        params = [{}, {}, {"max_new_tokens": 2}]
+        results = rolling_batch.inference(inputs, params)
+        self.assertEqual([r["data"] for r in results], ["b", "c", "d"])
+        self.assertEqual([r["last"] for r in results], [False, True, False])
+        request = rolling_batch.request_table.get(0)
+        self.assertEqual(request.input_text, "d")
+        self.assertEqual([r.input_text for r in rolling_batch.active_requests],
+                         ["b", "d"])
+
+        results = rolling_batch.inference(["b", "d"], [{}, {}])
+        self.assertEqual([r["last"] for r in results], [True, True])
+        self.assertEqual(len(rolling_batch.request_table), 0)
+        self.assertIsNone(request.slot)
+        self.assertEqual(rolling_batch.req_id_counter, 0)
+
+        # requests admitted out of order are iterated in id order
+        table = RequestTable()
+        requests = [Request(i, "x", parameters={}) for i in range(4)]
+        for i in (2, 0, 3, 1):
+            table.add(requests[i])
+        self.assertEqual([r.id for r in table], [0, 1, 2, 3])
+        table.remove(requests[2].slot)
+        table.add(Request(4, "x", parameters={}))
+        self.assertEqual([r.id for r in table], [0, 1, 3, 4])
+        self.assertEqual(table.get(requests[3].slot), requests[3])
+
+    def test_prefill_admission(self):
+        rolling_batch = EchoRollingBatch(output_formatter="none",
+                                         max_prefill_tokens=4)
+        rolling_batch.admission_controller.max_wait_steps = 2
+        results = rolling_batch.inference(["a a"], [{"max_new_tokens": 10}])
+        self.assertEqual(results[0]["data"], "a a")
+
+        inputs = ["a a", "b b b b b", "c", "d d"]
+        params = [{}] + [{"max_new_tokens": 10} for _ in range(3)]
+        results = rolling_batch.inference(inputs, params)
+        # the short prompts are admitted, the long one keeps its position
+        self.assertEqual([r["data"] for r in results], ["a a", "", "c", "d d"])
+        self.assertEqual([r.input_text for r in rolling_batch.request_table],
+                         ["a a", "c", "d d"])
+        self.assertEqual(len(rolling_batch.pending_requests), 1)
+
+        results = rolling_batch.inference(inputs, params)
+        self.assertEqual(results[1]["data"], "")
+        # starving requests are admitted even if they exceed the budget
+        results = rolling_batch.inference(inputs, params)
+        self.assertEqual([r["data"] for r in results],
+                         ["a a", "b b b b b", "c", "d d"])
+        self.assertEqual([r.input_text for r in rolling_batch.request_table],
+                         inputs)
+        self.assertEqual(rolling_batch.pending_requests, [])
+
+    def test_prefill_reuses_input_ids(self):
+        from unittest import mock
+        from transformers import GenerationConfig, PreTrainedTokenizerFast
+        from djl_python.detokenizer import IncrementalDetokenizer
+        from djl_python.tests.test_detokenizer import TEXTS, byte_level_tokenizer
+        from djl_python.transformers_neuronx_scheduler.optimum_neuron_scheduler import ContinuousBatchingNeuronGenerator
+        from djl_python.transformers_neuronx_scheduler.slot import Slot
+
+        tokenizer = byte_level_tokenizer(pad_token="<|endoftext|>")
+        rolling_batch = EchoRollingBatch(output_formatter="none",
+                                         max_prefill_tokens=1024)
+        rolling_batch.get_tokenizer = lambda: tokenizer
+        requests = rolling_batch.get_new_requests(TEXTS, [{
+            "max_new_tokens": 2
+        } for _ in TEXTS], len(TEXTS))
+        slots = [Slot(i) for i in range(len(requests))]
+        for slot, request in zip(slots, requests):
+            slot.assign(request, GenerationConfig(eos_token_id=[0]),
+                        IncrementalDetokenizer(tokenizer))
+        generator = ContinuousBatchingNeuronGenerator.__new__(
+            ContinuousBatchingNeuronGenerator)
+        generator.tokenizer = tokenizer
+
+        for padding_side in ("right", "left"):
+            tokenizer.padding_side = padding_side
+            expected = tokenizer(TEXTS, return_tensors="pt", padding=True)
+            # the prompts encoded for admission control are not encoded again
+            with mock.patch.object(PreTrainedTokenizerFast,
+                                   "__call__",
+                                   side_effect=AssertionError):
+                padded = generator._pad_inputs(slots)
+            self.assertEqual(padded.input_ids.tolist(),
+                             expected.input_ids.tolist())
+            self.assertEqual(padded.attention_mask.tolist(),
+                             expected.attention_mask.tolist())
+
+        # the generated text is part of the inputs from then on
+        slots[0].reset(padded.input_ids[0], padded.attention_mask[0], None,
+                       padded.input_ids[0][:1])
+        slots[0].append(0, "!")
+        self.assertIsNone(slots[0].input_ids)
+        padded = generator._pad_inputs(slots)
+        self.assertEqual(padded.input_ids.tolist(),
+                         expected.input_ids.tolist())
+
+    def test_cancel(self):
+        rolling_batch = EchoRollingBatch(output_formatter="jsonlines",
+                                         max_prefill_tokens=2)
+        inputs = ["a", "b b b", "c"]
+        params = [{"max_new_tokens": 10, "details": True} for _ in range(3)]
+        results = rolling_batch.inference(inputs, params)
+        self.assertEqual([r["step_token_num"] for r in results], [-1, 0, -1])
+        self.assertEqual(len(rolling_batch.pending_requests), 1)
+
+        # cancel a running and a pending request, the new one arrives cancelled
+        inputs = ["", "", "", "d"]
+        params = [{
+            "cancel": True
+        }, {
+            "cancel": True
+        }, {}, {
+            "cancel": True,
+            "details": True
+        }]
+        results = rolling_batch.inference(inputs, params)
+        self.assertEqual(rolling_batch.aborted, ["a"])
+        self.assertEqual([r["last"] for r in results],
+                         [True, True, False, True])
+        for i in (0, 1, 3):
+            token = json.loads(results[i]["data"])
+            self.assertEqual(token["details"]["finish_reason"], "cancelled")
+        self.assertEqual([r.input_text for r in rolling_batch.request_table],
+                         ["c"])
+        self.assertEqual(rolling_batch.pending_requests, [])
+
+        results = rolling_batch.inference([""], [{}])
+        self.assertEqual(json.loads(results[0]["data"])["token"]["text"], "c")
+
+    def test_cancel_from_frontend(self):
+        from djl_python import Input
+        from djl_python.utils import parse_input_with_formatter, InputFormatConfigs
+
+        def step(rolling_batch, content):
+            # requests after their first step have empty data and properties
+            inputs = Input()
+            inputs.properties["batch_size"] = str(len(content))
+            for i, entries in enumerate(content):
+                for key, value in entries.items():
+                    inputs.content.add(f"batch_{i:03d}.{key}", value)
+            parsed = parse_input_with_formatter(
+                inputs, InputFormatConfigs(is_rolling_batch=True))
+            return rolling_batch.inference(parsed.input_data,
+                                           parsed.parameters)
+
+        rolling_batch = EchoRollingBatch(output_formatter="none")
+        data = b'{"inputs": "a", "parameters": {"max_new_tokens": 10}}'
+        step(rolling_batch, [{"data": data, "seed": b"1"}])
+        results = step(rolling_batch, [{
+            "data": b"",
+            "cancel": b"true"
+        }, {
+            "data": data.replace(b'"a"', b'"b"'),
+            "seed": b"2"
+        }])
+        self.assertEqual([r["last"] for r in results], [True, False])
+        self.assertEqual(rolling_batch.aborted, ["a"])
+        results = step(rolling_batch, [{"data": b""}])
+        self.assertEqual([r["data"] for r in results], ["b"])
+
+        # backends that can't stop a running request fail it
+        rolling_batch = EchoRollingBatch(output_formatter="none")
+        rolling_batch.supports_cancel = False
+        step(rolling_batch, [{"data": data}])
+        with self.assertLogs(level="WARNING"):
+            results = step(rolling_batch, [{"data": b"", "cancel": b"true"}])
+        self.assertTrue(results[0]["last"])
+        self.assertIn("can't cancel running requests", results[0]["error"])
+
+    def test_request_failure(self):
+
+        def custom_fmt(token, first_token, last_token, details, generated_text,
+                       id):
+            if token.text == "boom":
+                raise ValueError("Unsupported token")
+            return token.text
+
+        rolling_batch = EchoRollingBatch(output_formatter=custom_fmt)
+        inputs = ["a", 5, "boom", "b"]
+        params = [{"max_new_tokens": 2, "details": True} for _ in range(4)]
+        with self.assertLogs(level="WARNING"):
+            results = rolling_batch.inference(inputs, params)
+        # only the request that can't be tokenized and the one whose output
+        # can't be formatted fail
+        self.assertEqual([r["data"] for r in results][::3], ["a", "b"])
+        self.assertEqual([r["last"] for r in results],
+                         [False, True, True, False])
+        self.assertEqual(results[1]["code"], 424)
+        self.assertIn("split", results[1]["error"])
+        self.assertEqual(
+            json.loads(results[2]["data"])["error"], "Unsupported token")
+        self.assertIn("boom", rolling_batch.aborted)
+        self.assertEqual(len(rolling_batch.request_table), 2)
+
+        results = rolling_batch.inference(["a", "b"], [{}, {}])
+        self.assertEqual([r["data"] for r in results], ["a", "b"])
+        self.assertEqual([r["last"] for r in results], [True, True])
+        self.assertEqual([r.get("code") for r in results], [None, None])
+
+    def test_stop_sequences(self):
+        rolling_batch = EchoRollingBatch(output_formatter="none")
+        inputs = ["ab", "xy"]
+        params = [{
+            "max_new_tokens": 5,
+            "stop_sequences": ["ba", "zz"]
+        }, {
+            "max_new_tokens": 2,
+            "stop_sequences": "zz"
+        }]
+        results = rolling_batch.inference(inputs, params)
+        self.assertEqual([r["last"] for r in results], [False, False])
+        self.assertNotIn("stop_sequences",
+                         rolling_batch.request_table.get(0).parameters)
+
+        # the stop sequence spans the tokens, the output ends with it
+        results = rolling_batch.inference(inputs, [{}, {}])
+        self.assertEqual([r["data"] for r in results], ["a", "xy"])
+        self.assertEqual([r["last"] for r in results], [True, True])
+        self.assertEqual(rolling_batch.aborted, ["ab"])
+
+    def test_response_cache(self):
+        response_cache = ResponseCache(1 << 20, 60)
+        rolling_batch = EchoRollingBatch(output_formatter="jsonlines",
+                                         response_cache=response_cache)
+        params = {"max_new_tokens": 2, "details": True, "seed": "1"}
+        rolling_batch.inference(["a"], [params.copy()])
+        results = rolling_batch.inference([""], [{}])
+        self.assertTrue(results[0]["last"])
+        self.assertEqual(len(response_cache), 1)
+
+        # the same request with another seed is replayed in one step, the
+        # sampled one runs
+        inputs = ["a", "a"]
+        params = [{
+            "max_new_tokens": 2,
+            "details": True,
+            "seed": "2"
+        }, {
+            "max_new_tokens": 2,
+            "do_sample": True,
+            "seed": "2"
+        }]
+        results = rolling_batch.inference(inputs, params)
+        self.assertEqual([r["last"] for r in results], [True, False])
+        tokens = [
+            json.loads(line) for line in results[0]["data"].split("\n")[:-1]
+        ]
+        self.assertEqual([t["token"]["text"] for t in tokens], ["a", "a"])
+        self.assertEqual(tokens[-1]["generated_text"], "aa")
+        self.assertEqual(tokens[-1]["details"]["finish_reason"], None)
+        self.assertEqual(tokens[-1]["details"]["generated_tokens"], 2)
+        self.assertEqual(response_cache.hits, 1)
+        self.assertEqual(response_cache.misses, 1)
+        self.assertEqual(len(rolling_batch.request_table), 1)
+
+        # cancelled requests are not cached
+        rolling_batch = EchoRollingBatch(
+            response_cache=ResponseCache(1 << 20, 60))
+        rolling_batch.inference(["b"], [{"max_new_tokens": 5}])
+        rolling_batch.inference([""], [{"cancel": True}])
+        self.assertEqual(len(rolling_batch.response_cache), 0)
+
+        # requests sampled by default are not cached
+        rolling_batch = SamplingEchoRollingBatch(
+            response_cache=ResponseCache(1 << 20, 60))
+        for params in [{}, {"decoding_strategy": "greedy"}]:
+            params["max_new_tokens"] = 1
+            rolling_batch.inference(["c"], [params])
+        self.assertEqual(len(rolling_batch.response_cache), 1)
+        self.assertEqual(rolling_batch.response_cache.misses, 1)
+
+    def test_coalesce_requests(self):
+        rolling_batch = EchoRollingBatch(output_formatter="jsonlines",
+                                         coalesce_requests=True)
+
+        def texts(result):
+            return [
+                json.loads(line)["token"].get("text")
+                for line in result["data"].split("\n")[:-1]
+            ]
+
+        params = {"max_new_tokens": 3}
+        rolling_batch.inference(["a"], [params.copy()])
+        # the identical request joins the first one and catches up, the
+        # sampled one runs
+        results = rolling_batch.inference(
+            ["", "a", "a"],
+            [{}, params.copy(),
+             dict(params, do_sample=True)])
+        self.assertEqual([texts(r) for r in results],
+                         [["a"], ["a", "a"], ["a"]])
+        self.assertEqual(len(rolling_batch.request_table), 2)
+        self.assertEqual(len(rolling_batch.followers), 1)
+        results = rolling_batch.inference(["", "", ""], [{}, {}, {}])
+        self.assertEqual([r["last"] for r in results], [True, True, False])
+        self.assertEqual(results[0]["data"], results[1]["data"])
+        self.assertEqual(len(rolling_batch.followers), 0)
+        self.assertEqual(len(rolling_batch.leaders), 0)
+
+        # the follower of a cancelled request generates in its place
+        # without repeating the tokens it received
+        rolling_batch = EchoRollingBatch(output_formatter="jsonlines",
+                                         coalesce_requests=True)
+        rolling_batch.inference(["b", "b"], [params.copy(), params.copy()])
+        results = rolling_batch.inference(["", ""], [{"cancel": True}, {}])
+        self.assertEqual([r["last"] for r in results], [True, False])
+        self.assertEqual(len(rolling_batch.pending_requests), 1)
+        output = []
+        for _ in range(3):
+            result = rolling_batch.inference([""], [{}])[0]
+            output += texts(result)
+        self.assertTrue(result["last"])
+        self.assertEqual(output, ["b", "b"])
+
+        # requests sampled by default each run on the backend
+        rolling_batch = SamplingEchoRollingBatch(coalesce_requests=True)
+        rolling_batch.inference(["c", "c"], [params.copy(), params.copy()])
+        self.assertEqual(len(rolling_batch.request_table), 2)
+        self.assertEqual(len(rolling_batch.followers), 0)
+
 
 if __name__ == '__main__':
     unittest.main()
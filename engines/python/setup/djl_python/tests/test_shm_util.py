@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file
+# except in compliance with the License. A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS"
+# BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+import gc
+import os
+import socket
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from djl_python import Input, Output, shm_util
+from djl_python.inputs import retrieve_short, retrieve_utf8, retrieve_int, retrieve_buffer
+
+
+class TestShmUtil(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(
+            os.environ, {
+                "OPTION_SHM_TRANSPORT_THRESHOLD": "1024",
+                "OPTION_SHM_TRANSPORT_DIR": self.tmp_dir.name,
+                "OPTION_SHM_TRANSPORT_TOKEN": "secret"
+            })
+        self.env.start()
+        shm_util._transport = None
+
+    def tearDown(self):
+        self.env.stop()
+        shm_util._transport = None
+        self.tmp_dir.cleanup()
+
+    def test_input_from_peer(self):
+        nd_list = [
+            np.arange(1024, dtype=np.float32).reshape(32, 32),
+            np.array(3, dtype=np.int64)
+        ]
+        # stand-in front end writes the segment and sends the descriptor
+        descriptor = shm_util.to_descriptor(nd_list, token="secret")
+        msg = bytearray(struct.pack(">h", 1))
+        Output.write_utf8(msg, "Content-Type")
+        Output.write_utf8(msg, "tensor/ndlist")
+        msg += struct.pack(">h", 1)
+        Output.write_utf8(msg, "data")
+        msg += struct.pack(">i", len(descriptor))
+        msg += descriptor
+        server, client = socket.socketpair()
+        client.sendall(msg)
+        inputs = Input()
+        inputs.read(server)
+        server.close()
+        client.close()
+
+        result = inputs.get_data()
+        # segment file is unlinked once mapped
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+        self.assertEqual(shm_util.get_segment_count(), 1)
+        for expected, actual in zip(nd_list, result):
+            self.assertEqual(expected.shape, actual.shape)
+            self.assertTrue(np.array_equal(expected, actual))
+        del result, expected, actual
+        gc.collect()
+        self.assertEqual(shm_util.get_segment_count(), 0)
+
+    def test_output_to_peer(self):
+        small = np.ones(4, dtype=np.float32)
+        large = np.ones((64, 64), dtype=np.float32)
+        outputs = Output().add_as_numpy([small], key="small")
+        outputs.add_as_numpy([large], key="large")
+        server, client = socket.socketpair()
+        outputs.send(client)
+        retrieve_short(server)
+        retrieve_utf8(server)
+        retrieve_short(server)
+        self.assertEqual(retrieve_short(server), 2)
+        received = {}
+        for _ in range(2):
+            key = retrieve_utf8(server)
+            received[key] = retrieve_buffer(server, retrieve_int(server))
+        server.close()
+        client.close()
+
+        self.assertFalse(shm_util.is_descriptor(received["small"]))
+        self.assertTrue(shm_util.is_descriptor(received["large"]))
+        self.assertLess(len(received["large"]), 200)
+        self.assertEqual(len(os.listdir(self.tmp_dir.name)), 1)
+        # stand-in front end maps the segment
+        result = shm_util.from_descriptor(received["large"], "secret")
+        self.assertTrue(np.array_equal(result[0], large))
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+
+    def test_invalid_segment_name(self):
+        descriptor = bytearray(shm_util.SHM_MAGIC)
+        descriptor += b'{"token": "secret", "tensors": [{"name": ' \
+                      b'"../etc/passwd", "offset": 0, "length": 0, ' \
+                      b'"dtype": "<f4", "shape": [0]}]}'
+        with self.assertRaises(ValueError):
+            shm_util.from_descriptor(descriptor, "secret")
+
+    def test_untrusted_descriptor(self):
+        nd_list = [np.ones(4, dtype=np.float32)]
+        # a client can't name segments without the token of the front end
+        for token in (None, "guess"):
+            inputs = Input()
+            inputs.content.add("data",
+                               shm_util.to_descriptor(nd_list, token=token))
+            with self.assertRaises(ValueError):
+                inputs.get_as_numpy("data")
+        # without a token received descriptors are never mapped
+        os.environ["OPTION_SHM_TRANSPORT_TOKEN"] = ""
+        shm_util._transport = None
+        inputs = Input()
+        inputs.content.add("data",
+                           shm_util.to_descriptor(nd_list, token="secret"))
+        with self.assertRaises(Exception):
+            inputs.get_as_numpy("data")
+        self.assertEqual(len(os.listdir(self.tmp_dir.name)), 3)
+        self.assertEqual(shm_util.get_segment_count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
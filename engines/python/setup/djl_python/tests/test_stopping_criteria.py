@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file
+# except in compliance with the License. A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS"
+# BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+import unittest
+
+import torch
+
+from djl_python.stopping_criteria import StopWord
+
+
+class CharTokenizer(object):
+
+    def decode(self, ids):
+        return "".join(map(chr, ids))
+
+
+def ids(*texts):
+    return torch.tensor([[ord(c) for c in text] for text in texts])
+
+
+class TestStopWord(unittest.TestCase):
+
+    def test_incremental(self):
+        stop_word = StopWord(CharTokenizer(), ["c.d", "yz"])
+        row0 = "pacxdc.d"
+        row1 = "pxyzzzzz"
+        for i in range(2, len(row0)):
+            # plain text, c.d is not a regular expression
+            self.assertFalse(stop_word(ids(row0[:i], row1[:i]), None))
+        self.assertTrue(stop_word(ids(row0, row1), None))
+
+        stop_word.reset()
+        self.assertFalse(stop_word(ids("pyz", "pab"), None))
+
+    def test_beam_search(self):
+        stop_word = StopWord(CharTokenizer(), "xy")
+        stop_word.reset(num_beams=2)
+        self.assertFalse(stop_word(ids("pa", "px", "qa", "qb"), None))
+        # the beams of the first input swap rows
+        self.assertFalse(stop_word(ids("pxy", "pab", "qab", "qbc"), None))
+        self.assertTrue(stop_word(ids("pxyz", "pabc", "qbxy", "qabc"), None))
+
+
+if __name__ == '__main__':
+    unittest.main()
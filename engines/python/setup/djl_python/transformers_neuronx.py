@@ -13,19 +13,17 @@
 
 import json
 import logging
-from transformers import AutoModelForCausalLM, AutoConfig, AutoTokenizer
 from djl_python import Input, Output
 from djl_python.encode_decode import encode
+from djl_python.response_cache import create_response_cache
 from djl_python.rolling_batch.rolling_batch import get_content_type_from_output_formatter
-from djl_python.rolling_batch.neuron_rolling_batch import NeuronRollingBatch
-from djl_python.stable_diffusion_inf2 import StableDiffusionNeuronXService
-from djl_python.streaming_utils import StreamingUtils
 from djl_python.properties_manager.tnx_properties import TransformerNeuronXProperties, TnXGenerationStrategy
 from djl_python.properties_manager.properties import StreamingEnum, is_rolling_batch_enabled
-from djl_python.neuron_utils.model_loader import TNXModelLoader, OptimumModelLoader
-from djl_python.neuron_utils.utils import task_from_config
 from djl_python.utils import InputFormatConfigs, parse_input_with_formatter
 
+# transformers, the neuron model loaders, the rolling batcher and the stable
+# diffusion service are imported on first use to keep the worker startup fast
+
 model = None
 
 OPTIMUM_CAUSALLM_MODEL_TYPES = {"gpt2", "opt", "bloom", "llama", "mistral"}
@@ -44,7 +42,7 @@ class TransformersNeuronXService(object):
         self.config = None
         self.rolling_batch_config = dict()
         self.input_format_configs = None
-        self._model_loader_class = OptimumModelLoader
+        self._model_loader_class = None
 
     def optimum_not_supported(self) -> bool:
         support = False
@@ -61,6 +59,8 @@ class TransformersNeuronXService(object):
         return support
 
     def set_model_loader_class(self):
+        from djl_python.neuron_utils.model_loader import TNXModelLoader, OptimumModelLoader
+        self._model_loader_class = OptimumModelLoader
         if self.config.model_loader == "optimum":
             logging.info("Loading model using OptimumModelLoader...")
             return
@@ -78,6 +78,7 @@ class TransformersNeuronXService(object):
             logging.info("Loading model using OptimumModelLoader...")
 
     def set_configs(self, properties):
+        from transformers import AutoConfig
         self.config = TransformerNeuronXProperties(**properties)
         if self.config.rolling_batch != "disable":
             """batch_size needs to match max_rolling_batch_size for precompiled neuron models running rolling batch"""
@@ -97,9 +98,11 @@ class TransformersNeuronXService(object):
         logging.info(f"Model loading properties: {self.config}")
         self.set_model_loader_class()
         if not self.config.task:
+            from djl_python.neuron_utils.utils import task_from_config
             self.config.task = task_from_config(self.model_config)
 
     def set_tokenizer(self):
+        from transformers import AutoTokenizer
         self.tokenizer = AutoTokenizer.from_pretrained(
             self.config.model_id_or_path,
             trust_remote_code=self.config.trust_remote_code,
@@ -110,8 +113,15 @@ class TransformersNeuronXService(object):
 
     def set_rolling_batch(self):
         if self.config.rolling_batch != "disable":
+            from djl_python.rolling_batch.neuron_rolling_batch import NeuronRollingBatch
             self.rolling_batch_config[
                 "output_formatter"] = self.config.output_formatter
+            self.rolling_batch_config[
+                "max_prefill_tokens"] = self.config.max_rolling_batch_prefill_tokens
+            self.rolling_batch_config[
+                "response_cache"] = create_response_cache(self.config)
+            self.rolling_batch_config[
+                "coalesce_requests"] = self.config.coalesce_requests
             self.rolling_batch = NeuronRollingBatch(
                 self.model, self.tokenizer, self.config.batch_size,
                 self.config.n_positions, self.config.rolling_batch_strategy,
@@ -216,6 +226,7 @@ class TransformersNeuronXService(object):
             if len(batch) > 1:
                 raise NotImplementedError(
                     "Dynamic batch not supported for generic streaming")
+            from djl_python.streaming_utils import StreamingUtils
             outputs.add_property("content-type", "application/jsonlines")
             if self.config.enable_streaming == StreamingEnum.huggingface:
                 outputs.add_stream_content(
@@ -289,6 +300,7 @@ def partition(inputs: Input):
     global _service
     if not _service.initialized:
         if "use_stable_diffusion" in inputs.get_properties():
+            from djl_python.stable_diffusion_inf2 import StableDiffusionNeuronXService
             _service = StableDiffusionNeuronXService()
         _service.partition(inputs.get_properties())
 
@@ -297,6 +309,7 @@ def handle(inputs: Input):
     global _service
     if not _service.initialized:
         if "use_stable_diffusion" in inputs.get_properties():
+            from djl_python.stable_diffusion_inf2 import StableDiffusionNeuronXService
             _service = StableDiffusionNeuronXService()
         _service.initialize(inputs.get_properties())
 
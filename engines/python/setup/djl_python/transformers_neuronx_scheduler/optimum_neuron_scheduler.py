@@ -23,7 +23,9 @@ from transformers import PreTrainedTokenizerBase
 from djl_python.transformers_neuronx_scheduler.slot import Slot
 from djl_python.rolling_batch.rolling_batch import Request, filter_unused_generation_params
 from djl_python.transformers_neuronx_scheduler.token_selector import TokenSelector
-from djl_python.transformers_neuronx_scheduler.utils import Generation, FinishReason, GeneratedText, TokenDecoder
+from djl_python.transformers_neuronx_scheduler.utils import Generation, FinishReason, GeneratedText
+from djl_python.detokenizer import IncrementalDetokenizer
+from djl_python.vocabulary import VocabularyTable
 
 
 class NeuronGenerator(ABC):
@@ -37,12 +39,27 @@ class NeuronGenerator(ABC):
                  trim_cache=False):
         self.model = model
         self.tokenizer = tokenizer
+        self.detokenizer = IncrementalDetokenizer(tokenizer)
+        self.vocabulary = VocabularyTable(tokenizer)
         self.slots = [Slot(i) for i in range(batch_size)]
         self.batch_size = batch_size
         self.n_positions = n_positions
         self.trim_cache = trim_cache
         self.cache_ids = None
 
+    def _pad_inputs(self, slots: List[Slot]):
+        """Tokenizes the inputs of the slots with padding. The token ids the
+        rolling batch already encoded are padded as is when all the slots
+        have them.
+        """
+        input_ids = [slot.input_ids for slot in slots]
+        if all(ids is not None for ids in input_ids):
+            return self.tokenizer.pad({"input_ids": input_ids},
+                                      return_tensors="pt")
+        return self.tokenizer([slot.inputs for slot in slots],
+                              return_tensors="pt",
+                              padding=True)
+
     def get_slots_by_state(self, slot_state: Slot.State):
         slots = {state: [] for state in Slot.State}
         for slot in self.slots:
@@ -98,16 +115,22 @@ class NeuronGenerator(ABC):
             return_dict=True,
         )
         generations = []
-        request_ids = []
         active_slots = self.get_slots_by_state(Slot.State.READY)
+        next_tokens = []
         for i, slot in enumerate(active_slots):
-            request_id = slot.request_id
-            request_ids.append(request_id)
             next_token_logits = outputs.logits[i:i + 1, -1, :]
             slot_input_ids = input_ids[i:i + 1, :]
-            next_token, next_log_prob = slot.select(slot_input_ids,
-                                                    next_token_logits)
-            next_token_text = slot.decoder.decode(next_token.item())
+            next_tokens.append(slot.select(slot_input_ids, next_token_logits))
+        next_token_ids = [next_token.item() for next_token, _ in next_tokens]
+        # the text of all the slots is decoded at once
+        next_token_texts = self.detokenizer.decode(
+            [slot.decode_state for slot in active_slots],
+            [[next_token_id] for next_token_id in next_token_ids])
+        for i, slot in enumerate(active_slots):
+            next_token, next_log_prob = next_tokens[i]
+            next_token_id = next_token_ids[i]
+            next_token_text = next_token_texts[i]
+            request_id = slot.request_id
             if self.trim_cache:
                 slot.trim_cache_id()
             slot.append(next_token, next_token_text)
@@ -135,7 +158,7 @@ class NeuronGenerator(ABC):
                     token_id=next_token,
                     token_logprob=next_log_prob,
                     token_text=next_token_text,
-                    token_is_special=(next_token in slot.special_tokens),
+                    token_is_special=self.vocabulary.is_special(next_token_id),
                     generated_text=generated_text,
                 ))
         return generations
@@ -205,21 +228,18 @@ class ContinuousBatchingNeuronGenerator(NeuronGenerator):
         prefill_slots = []
         for request in new_requests:
             slot = empty_slots.pop()
-            slot.assign(request, self.model.generation_config, self.tokenizer)
+            slot.assign(request, self.model.generation_config,
+                        self.detokenizer)
             prefill_slots.append(slot)
             logging.debug(
                 f"Request {slot.request_id} assigned to slot {slot.id}")
 
-        inputs = [slot.inputs for slot in prefill_slots]
-
         # Set and arrange active batch ids for prefill
         seq_ids = [slot.id for slot in prefill_slots]
         seq_ids = torch.as_tensor(sorted(seq_ids), dtype=torch.int32)
 
         # Tokenize with padding
-        padded_inputs = self.tokenizer(inputs,
-                                       return_tensors="pt",
-                                       padding=True)
+        padded_inputs = self._pad_inputs(prefill_slots)
         #  If needed truncate sequences to fit into the static dimensions
         seq_length = min(padded_inputs.input_ids.shape[-1], self.n_positions)
         input_ids = padded_inputs.input_ids[:, :seq_length]
@@ -336,15 +356,12 @@ class NaiveRollingBatchNeuronGenerator(NeuronGenerator):
         )
         for request in new_requests:
             slot = empty_slots.pop()
-            slot.assign(request, self.model.generation_config, self.tokenizer)
+            slot.assign(request, self.model.generation_config,
+                        self.detokenizer)
             logging.debug(
                 f"Request {slot.request_id} assigned to slot {slot.id}")
-        # Reconstruct the full inputs (without padding)
-        inputs = [slot.inputs for slot in self.slots]
-        # Tokenize with padding
-        padded_inputs = self.tokenizer(inputs,
-                                       return_tensors="pt",
-                                       padding=True)
+        # Reconstruct the full inputs and tokenize them with padding
+        padded_inputs = self._pad_inputs(self.slots)
         #  If needed truncate sequences to fit into the static dimensions
         seq_length = min(padded_inputs.input_ids.shape[-1], self.n_positions)
         input_ids = padded_inputs.input_ids[:, :seq_length]
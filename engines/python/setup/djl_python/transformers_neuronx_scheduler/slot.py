@@ -17,7 +17,8 @@ from enum import Enum
 from typing import Optional, Any, List
 from transformers.generation import GenerationConfig
 from djl_python.rolling_batch.rolling_batch import Request, filter_unused_generation_params
-from djl_python.transformers_neuronx_scheduler.utils import Generation, FinishReason, GeneratedText, TokenDecoder
+from djl_python.transformers_neuronx_scheduler.utils import Generation, FinishReason, GeneratedText
+from djl_python.detokenizer import DecodeState, IncrementalDetokenizer
 
 GENERATION_PARAMS = list(GenerationConfig().__dict__.keys())
 TOKEN_SELECTION_PARAMS = ["seed", "ignore_eos", "stop_token_ids"]
@@ -50,6 +51,7 @@ class Slot:
         self._state = Slot.State.EMPTY
         self._request_id = None
         self._inputs = ""
+        self._input_ids = None
         self._generation_config = None
         self._tokens = []
         self._mask = []
@@ -57,9 +59,8 @@ class Slot:
         self._generated_tokens = 0
         self._next_token_text = ""
         self._cache_id = torch.zeros(1)
-        self._token_decoder = None
+        self._decode_state = None
         self._token_acceptor = None
-        self._special_tokens = []
         self._ignore_eos_id = False
         self.seed = 0
 
@@ -79,6 +80,12 @@ class Slot:
     def inputs(self) -> str:
         return self._inputs
 
+    @property
+    def input_ids(self) -> Optional[List[int]]:
+        """The token ids of the inputs, if the rolling batch already encoded
+        them and nothing was generated since."""
+        return self._input_ids
+
     @property
     def generation_config(self) -> GenerationConfig:
         return self._generation_config
@@ -88,17 +95,13 @@ class Slot:
         return self._generated_tokens
 
     @property
-    def decoder(self) -> TokenDecoder:
-        return self._token_decoder
+    def decode_state(self) -> DecodeState:
+        return self._decode_state
 
     @property
     def acceptor(self) -> Optional[Any]:
         return self._token_acceptor
 
-    @property
-    def special_tokens(self) -> List[int]:
-        return self._special_tokens
-
     def build_eos_token_ids(self, params) -> List[int]:
         if isinstance(self._generation_config.eos_token_id, int):
             eos_token_ids = [self._generation_config.eos_token_id]
@@ -115,7 +118,7 @@ class Slot:
     def assign(self,
                request: Request,
                generation_config: GenerationConfig,
-               tokenizer,
+               detokenizer: IncrementalDetokenizer,
                token_acceptor=None):
         """Assign a request to a slot.
 
@@ -124,12 +127,13 @@ class Slot:
                 The request to be assigned. Contains the inputs and tokens selection parameters.
             generation_config (`transformers.GenerationConfig`):
                 The base generation config (might be modified by the request generation parameters).
-            tokenizer:
-                The tokenizer used to decode token.
+            detokenizer (`IncrementalDetokenizer`):
+                The detokenizer used to decode the generated tokens.
         """
         self._state = Slot.State.READY
         self._request_id = request.id
         self._inputs = request.input_text
+        self._input_ids = request.input_ids or None
         self._generation_config = copy.deepcopy(generation_config)
         # Update generation config with token chooser parameters
         param = translate_neuronx_params(request.parameters)
@@ -147,7 +151,7 @@ class Slot:
         self._generation_config.max_new_tokens = param.get(
             "max_new_tokens", 30)
         self._generation_config.eos_token_id = self.build_eos_token_ids(param)
-        self._token_decoder = TokenDecoder(tokenizer)
+        self._decode_state = detokenizer.new_sequence()
         self._token_acceptor = token_acceptor
         self._ignore_eos_id = param.pop("ignore_eos", False)
         filter_unused_generation_params(param,
@@ -209,6 +213,7 @@ class Slot:
         self._generated_tokens += 1
         # Now that a new token has been generated, we can append the previous one to the inputs
         self._inputs += self._next_token_text
+        self._input_ids = None
         self._next_token_text = next_token_text
         self.increment_cache_id()
 
@@ -50,7 +50,11 @@ def parse_input_with_formatter(
     for i, item in enumerate(batch):
         try:
             content_type = item.get_property("Content-Type")
-            input_map = decode(item, content_type)
+            input_map = decode(item, content_type, copy=False)
+            if type(input_map) is dict:
+                # the parsed json is kept by the input, only the top level
+                # dicts are changed below
+                input_map = dict(input_map)
         except Exception as e:  # pylint: disable=broad-except
             logging.warning(f"Parse input failed: {i}")
             input_size.append(0)
@@ -91,7 +95,7 @@ def _parse_inputs_params(input_map, item, input_format_configs):
             input_format_configs.tokenizer)
     else:
         _inputs = input_map.pop("inputs", input_map)
-        _param = input_map.pop("parameters", {})
+        _param = dict(input_map.pop("parameters", {}))
 
     # Add some additional parameters that are necessary.
     # Per request streaming is only supported by rolling batch
@@ -104,6 +108,9 @@ def _parse_inputs_params(input_map, item, input_format_configs):
         # set server provided seed if seed is not part of request
         if item.contains_key("seed"):
             _param["seed"] = item.get_as_string(key="seed")
+    if item.contains_key("cancel"):
+        # set by the frontend when the client of a running request is gone
+        _param["cancel"] = item.get_as_string(key="cancel").lower() == "true"
     if not "output_formatter" in _param:
         _param["output_formatter"] = input_format_configs.output_formatter
 
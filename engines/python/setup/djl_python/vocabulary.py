@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file
+# except in compliance with the License. A copy of the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "LICENSE.txt" file accompanying this file. This file is distributed on an "AS IS"
+# BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+import logging
+import time
+from typing import Iterable, List
+
+from djl_python.detokenizer import vocabulary_bytes
+
+
+class VocabularyTable(object):
+    """
+    The text and the UTF-8 bytes of every token id of a tokenizer, and which
+    of them are special tokens, so that single tokens are looked up by id
+    instead of decoded by the tokenizer.
+
+    The text and the bytes tables are built on first use, with one call over
+    the whole vocabulary, so backends that never look up a token don't pay
+    for them.
+    """
+
+    __slots__ = ("tokenizer", "special", "_texts", "_bytes")
+
+    def __init__(self, tokenizer):
+        """
+        :param tokenizer: the huggingface tokenizer
+        """
+        self.tokenizer = tokenizer
+        size = len(tokenizer)
+        self.special = bytearray(size)
+        for token_id in tokenizer.all_special_ids:
+            if 0 <= token_id < size:
+                self.special[token_id] = 1
+        self._texts = None
+        self._bytes = None
+
+    def __len__(self):
+        return len(self.special)
+
+    @property
+    def texts(self) -> List[str]:
+        """
+        :return: the text of every token decoded on its own, by token id
+        """
+        if self._texts is None:
+            start = time.perf_counter()
+            # the same text as tokenizer.decode([token_id]), in one call
+            self._texts = self.tokenizer.batch_decode(
+                [[i] for i in range(len(self))])
+            logging.info(f"Vocabulary text table of {len(self)} tokens built "
+                         f"in {time.perf_counter() - start:.3f} seconds")
+        return self._texts
+
+    @property
+    def token_bytes(self) -> List[bytes]:
+        """
+        :return: the bytes of every token in a text, by token id. Byte level
+            tokens may be parts of a UTF-8 character.
+        """
+        if self._bytes is None:
+            start = time.perf_counter()
+            table = vocabulary_bytes(self.tokenizer)
+            if table is None:
+                # the tokens can't be concatenated, their own text is used
+                table = [text.encode("utf-8") for text in self.texts]
+            self._bytes = table
+            logging.info(f"Vocabulary bytes table of {len(self)} tokens built "
+                         f"in {time.perf_counter() - start:.3f} seconds")
+        return self._bytes
+
+    def text(self, token_id: int) -> str:
+        """
+        :return: the text of the token decoded on its own
+        """
+        texts = self.texts
+        if 0 <= token_id < len(texts):
+            return texts[token_id]
+        # ids of a model vocabulary padded beyond the tokenizer
+        return self.tokenizer.decode([token_id])
+
+    def texts_of(self, token_ids: Iterable[int]) -> List[str]:
+        """
+        :return: the text of each token decoded on its own
+        """
+        texts = self.texts
+        size = len(texts)
+        return [texts[i] if 0 <= i < size else self.text(i) for i in token_ids]
+
+    def bytes_of(self, token_ids: Iterable[int]) -> bytes:
+        """
+        :return: the UTF-8 bytes of the tokens in a text
+        """
+        table = self.token_bytes
+        size = len(table)
+        return b"".join(
+            table[i] if 0 <= i < size else self.text(i).encode("utf-8")
+            for i in token_ids)
+
+    def is_special(self, token_id: int) -> bool:
+        """
+        :return: whether the token is a special token
+        """
+        return 0 <= token_id < len(
+            self.special) and self.special[token_id] == 1
@@ -15,19 +15,69 @@ DJL Python engine.
 Communication message format: binary encoding
 """
 
+import json
 import logging
 import os
+import queue
 import signal
 import socket
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+from djl_python import request_timing
 from djl_python.arg_parser import ArgParser
-from djl_python.inputs import Input
-from djl_python.outputs import Output
+from djl_python.import_profiler import ImportProfiler
+from djl_python.inputs import Input, SocketReader
+from djl_python.outputs import Output, DEFAULT_COALESCE_MAX_BYTES
 from djl_python.service_loader import load_model_service
 from djl_python.sm_log_filter import SMLogFilter
 
 SOCKET_ACCEPT_TIMEOUT = 30.0
+DEFAULT_PIPELINE_DEPTH = 2
+
+
+class HandlerGate(object):
+    """
+    Lets thread safe handlers run together and other handlers run alone.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.shared = 0
+        self.exclusive = False
+        self.exclusive_waiting = 0
+
+    def acquire(self, exclusive: bool):
+        with self.condition:
+            if exclusive:
+                self.exclusive_waiting += 1
+                self.condition.wait_for(
+                    lambda: not self.exclusive and self.shared == 0)
+                self.exclusive_waiting -= 1
+                self.exclusive = True
+            else:
+                # waiting exclusive handlers go first
+                self.condition.wait_for(
+                    lambda: not self.exclusive and self.exclusive_waiting == 0)
+                self.shared += 1
+
+    def release(self, exclusive: bool):
+        with self.condition:
+            if exclusive:
+                self.exclusive = False
+            else:
+                self.shared -= 1
+            self.condition.notify_all()
+
+
+def _uses_model_after_return(outputs: Output) -> bool:
+    """
+    :return: whether streaming content or a finalize function of the output,
+        which may use the model, run while it is sent
+    """
+    return outputs.stream_content is not None or outputs.finalize_function is not None
 
 
 class PythonEngine(object):
@@ -51,6 +101,27 @@ class PythonEngine(object):
         self.service = service
         self.device_id = args.device_id
         self.tensor_parallel_degree = args.tensor_parallel_degree
+        # opt-in merging of streaming chunks, e.g. OPTION_STREAM_COALESCE_DELAY_MS=2
+        coalesce_delay = os.getenv("OPTION_STREAM_COALESCE_DELAY_MS")
+        self.stream_coalesce_delay = float(
+            coalesce_delay) / 1000 if coalesce_delay else None
+        self.stream_coalesce_max_bytes = int(
+            os.getenv("OPTION_STREAM_COALESCE_MAX_BYTES",
+                      DEFAULT_COALESCE_MAX_BYTES))
+        # opt-in overlap of socket I/O with the handler, e.g. OPTION_PIPELINED_IO=true
+        self.pipelined_io = os.getenv("OPTION_PIPELINED_IO",
+                                      "false").lower() == "true"
+        self.pipeline_depth = int(
+            os.getenv("OPTION_PIPELINE_DEPTH", DEFAULT_PIPELINE_DEPTH))
+        # opt-in concurrent requests on one model, e.g. OPTION_CONCURRENT_CONNECTIONS=4
+        self.concurrent_connections = int(
+            os.getenv("OPTION_CONCURRENT_CONNECTIONS", "1"))
+        self.handler_threads = int(
+            os.getenv("OPTION_HANDLER_THREADS", self.concurrent_connections))
+        self.handler_pool = None
+        self.handler_gate = HandlerGate()
+        self.import_profiler = None
+        self.import_profile_lock = threading.Lock()
 
         if self.sock_type == "unix":
             if self.sock_name is None:
@@ -101,43 +172,271 @@ class PythonEngine(object):
         self.sock.listen(128)
         logging.info("Python engine started.")
 
+        if self.concurrent_connections > 1:
+            self.serve_concurrently()
+            return
+
         (cl_socket, _) = self.sock.accept()
         # workaround error(35, 'Resource temporarily unavailable') on OSX
         cl_socket.setblocking(True)
+        self.serve_connection(cl_socket)
 
-        while True:
-            inputs = Input()
-            inputs.read(cl_socket)
-            prop = inputs.get_properties()
-            if self.tensor_parallel_degree:
-                prop["tensor_parallel_degree"] = self.tensor_parallel_degree
-            prop["device_id"] = self.device_id
-            if "output_formatter" in prop and hasattr(
-                    self.service, prop["output_formatter"]):
-                prop["output_formatter"] = getattr(self.service,
-                                                   prop["output_formatter"])
-            function_name = inputs.get_function_name()
+    def serve_connection(self, cl_socket):
+        if self.pipelined_io:
+            self.serve_pipelined(cl_socket)
+        else:
+            self.serve(cl_socket)
+
+    def serve_concurrently(self):
+        """
+        Serves up to OPTION_CONCURRENT_CONNECTIONS connections, each one on
+        its own thread as soon as it is accepted. The first connection must
+        arrive within the accept timeout, the others are accepted in the
+        background for as long as the engine runs. Handlers marked as thread
+        safe run concurrently on a pool of OPTION_HANDLER_THREADS threads,
+        other handlers run one at a time. The engine stops when any connection
+        fails.
+        """
+        self.handler_pool = ThreadPoolExecutor(
+            max_workers=self.handler_threads, thread_name_prefix="djl-handler")
+        failures = queue.Queue()
+
+        def serve(conn):
             try:
-                outputs = self.service.invoke_handler(function_name, inputs)
-                if outputs is None:
-                    outputs = Output(code=204, message="No content")
-                elif not isinstance(outputs, Output):
-                    outputs = Output().error(
-                        f"Invalid output type: {type(outputs)}")
-            except Exception as e:
-                logging.exception("Failed invoke service.invoke_handler()", e)
-                if type(e).__name__ == "OutOfMemoryError" or type(
-                        e).__name__ == "MemoryError":
-                    outputs = Output(code=507, message=str(e))
-                else:
-                    outputs = Output().error(str(e))
-
-            outputs.send(cl_socket)
-            logging.debug("Outputs is sent to DJL engine.")
+                self.serve_connection(conn)
+            except Exception as e:  # pylint: disable=broad-except
+                failures.put(e)
+
+        def start(conn, i):
+            # workaround error(35, 'Resource temporarily unavailable') on OSX
+            conn.setblocking(True)
+            threading.Thread(target=serve,
+                             args=(conn, ),
+                             name=f"djl-connection-{i}",
+                             daemon=True).start()
+
+        def accept_remaining():
+            for i in range(1, self.concurrent_connections):
+                while True:
+                    try:
+                        (conn, _) = self.sock.accept()
+                        break
+                    except socket.timeout:
+                        # the frontend may open fewer connections than allowed
+                        continue
+                    except OSError:
+                        # listener closed
+                        return
+                logging.debug(f"Accepted connection {i}.")
+                start(conn, i)
+
+        (cl_socket, _) = self.sock.accept()
+        start(cl_socket, 0)
+        threading.Thread(target=accept_remaining,
+                         name="djl-accept",
+                         daemon=True).start()
+        logging.info(
+            f"Serving up to {self.concurrent_connections} connections with "
+            f"{self.handler_threads} handler threads.")
+        try:
+            raise failures.get()
+        finally:
+            self.handler_pool.shutdown(wait=False)
+
+    def serve(self, cl_socket):
+        """
+        Reads, handles and responds to requests one at a time.
+
+        :param cl_socket: client connection
+        """
+        reader = SocketReader(cl_socket)
+        while True:
+            inputs, timing = self.read_input(reader)
+            self.handle_request(
+                inputs, timing,
+                lambda outputs: self.send_output(outputs, cl_socket, timing))
+
+    def serve_pipelined(self, cl_socket):
+        """
+        Decodes the next request on a reader thread and sends responses on a
+        writer thread while the handler runs. Requests are handled one at a
+        time on the calling thread, so responses keep the request order.
+
+        :param cl_socket: client connection
+        """
+        reader = SocketReader(cl_socket)
+        requests = queue.Queue(maxsize=self.pipeline_depth)
+        responses = queue.Queue(maxsize=self.pipeline_depth)
+        failure = []
+
+        def read_loop():
             try:
-                outputs.execute_finalize()
-            except Exception as e:
-                logging.exception(f"Failed on finalize function: {e}")
+                while True:
+                    requests.put(self.read_input(reader))
+            except Exception as e:  # pylint: disable=broad-except
+                requests.put(e)
+
+        def write_loop():
+            while True:
+                outputs, timing = responses.get()
+                try:
+                    if not failure:
+                        self.send_output(outputs, cl_socket, timing)
+                except Exception as e:  # pylint: disable=broad-except
+                    failure.append(e)
+                finally:
+                    responses.task_done()
+
+        def send(outputs, timing):
+            responses.put((outputs, timing))
+            if _uses_model_after_return(outputs):
+                # streaming content and finalize functions may use the
+                # model, the next handler waits for them
+                responses.join()
+
+        threading.Thread(target=read_loop, daemon=True).start()
+        threading.Thread(target=write_loop, daemon=True).start()
+
+        while True:
+            request = requests.get()
+            if isinstance(request, Exception):
+                responses.join()
+                raise request
+            if failure:
+                raise failure[0]
+            inputs, timing = request
+            self.handle_request(inputs, timing,
+                                lambda outputs: send(outputs, timing))
+
+    def read_input(self, reader) -> tuple:
+        """
+        Reads the next request.
+
+        :param reader: SocketReader of the connection
+        :return: the Input and its RequestTiming, None if timing is disabled
+        """
+        inputs = Input()
+        reader.reset_stats()
+        timing = request_timing.new_request()
+        inputs.read(reader)
+        if timing is not None:
+            end = time.perf_counter()
+            if reader.first_recv_time is not None:
+                timing.start = reader.first_recv_time
+            timing.record("read", reader.recv_time)
+            timing.record("decode", end - timing.start - reader.recv_time)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            stats = reader.get_stats()
+            logging.debug(
+                f"Input read with {stats['recv_calls']} recv calls in "
+                f"{stats['read_latency_ms']:.3f} ms.")
+        prop = inputs.get_properties()
+        if self.tensor_parallel_degree:
+            prop["tensor_parallel_degree"] = self.tensor_parallel_degree
+        prop["device_id"] = self.device_id
+        if "output_formatter" in prop and hasattr(self.service,
+                                                  prop["output_formatter"]):
+            prop["output_formatter"] = getattr(self.service,
+                                               prop["output_formatter"])
+        return inputs, timing
+
+    def handle_request(self, inputs: Input, timing, send):
+        """
+        Invokes the handler and sends its output. Handlers that are not thread
+        safe run alone. When the output has streaming content or a finalize
+        function, the handler keeps its place in the HandlerGate until the
+        output is sent.
+
+        :param inputs: the request
+        :param timing: its RequestTiming, None if timing is disabled
+        :param send: sends the Output
+        """
+        if self.handler_pool is None:
+            send(self.invoke_handler(inputs, timing))
+            return
+        is_thread_safe = getattr(self.service, "is_thread_safe", None)
+        exclusive = is_thread_safe is None or not is_thread_safe(
+            inputs.get_function_name())
+        self.handler_gate.acquire(exclusive)
+        held = True
+        try:
+            if exclusive:
+                outputs = self.invoke_handler(inputs, timing)
+            else:
+                outputs = self.handler_pool.submit(self.invoke_handler, inputs,
+                                                   timing).result()
+            if not _uses_model_after_return(outputs):
+                held = False
+                self.handler_gate.release(exclusive)
+            send(outputs)
+        finally:
+            if held:
+                self.handler_gate.release(exclusive)
+
+    def invoke_handler(self, inputs: Input, timing=None) -> Output:
+        function_name = inputs.get_function_name()
+        if timing is not None:
+            request_timing.activate(timing)
+            start = time.perf_counter()
+        try:
+            outputs = self.service.invoke_handler(function_name, inputs)
+            if outputs is None:
+                outputs = Output(code=204, message="No content")
+            elif not isinstance(outputs, Output):
+                outputs = Output().error(
+                    f"Invalid output type: {type(outputs)}")
+        except Exception as e:
+            logging.exception("Failed invoke service.invoke_handler()", e)
+            if type(e).__name__ == "OutOfMemoryError" or type(
+                    e).__name__ == "MemoryError":
+                outputs = Output(code=507, message=str(e))
+            else:
+                outputs = Output().error(str(e))
+        if timing is not None:
+            timing.record("handler", time.perf_counter() - start)
+            request_timing.activate(None)
+        if self.import_profiler is not None:
+            self.log_import_profile()
+        return outputs
+
+    def log_import_profile(self):
+        """
+        Logs the imports of the model loading and the first request, which
+        usually initializes the model.
+        """
+        # the first requests of several connections may finish together
+        with self.import_profile_lock:
+            profiler = self.import_profiler
+            self.import_profiler = None
+        if profiler is None:
+            return
+        profiler.end_phase("first_request")
+        profiler.stop()
+        logging.info(f"Import profile: {json.dumps(profiler.report())}")
+
+    def send_output(self, outputs: Output, cl_socket, timing=None):
+        if timing is not None:
+            request_timing.activate(timing)
+        if self.stream_coalesce_delay is not None and outputs.stream_content is not None \
+                and not outputs.is_stream_coalescing_enabled():
+            outputs.set_stream_coalescing(self.stream_coalesce_max_bytes,
+                                          self.stream_coalesce_delay)
+        outputs.send(cl_socket)
+        logging.debug("Outputs is sent to DJL engine.")
+        if outputs.stream_content is not None:
+            logging.debug(
+                f"Streamed {outputs.stream_chunks} chunks in {outputs.stream_frames} frames."
+            )
+        if timing is not None:
+            start = time.perf_counter()
+        try:
+            outputs.execute_finalize()
+        except Exception as e:
+            logging.exception(f"Failed on finalize function: {e}")
+        if timing is not None:
+            timing.record("finalize", time.perf_counter() - start)
+            request_timing.activate(None)
+            request_timing.finish(timing)
 
 
 def main():
@@ -158,10 +457,18 @@ def main():
         sock_type = args.sock_type
         sock_name = args.sock_name if rank is None else f"{args.sock_name}.{rank}"
 
+        profiler = None
+        if os.getenv("OPTION_IMPORT_PROFILE", "false").lower() == "true":
+            profiler = ImportProfiler()
+            profiler.start()
+
         model_service = load_model_service(args.model_dir, args.entry_point,
                                            args.device_id)
 
         engine = PythonEngine(args, model_service)
+        if profiler is not None:
+            profiler.end_phase("load_model_service")
+            engine.import_profiler = profiler
 
         engine.run_server()
     except socket.timeout: